@@ -1,22 +1,41 @@
 import os
 import time
 import sqlite3
-import requests
-import pandas as pd
 import csv
 import io
+import click
 from flask import Flask, render_template, send_file
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from threading import Thread
+from threading import BoundedSemaphore, Thread, Lock
 from flask import request
 from flask import jsonify
-
-
-def init_local_db():
+from snapshot_pedidos import init_snapshot_db, guardar_snapshot, leer_snapshot
+from entregas_whatsapp import init_entregas_db, registrar_mensaje_enviado, estado_folio, resumen_latencias
+from metricas import Contador, Histograma, Medidor, BUCKETS_CONTEO, TIPO_CONTENIDO, exponer
+import kpis
+import folios
+import vencimientos
+import delta_planner
+import reglas_sla
+import perfilado
+import respuestas
+import fragmentos
+from perfilado import fase
+from registro import obtener_logger
+
+log = obtener_logger("app")
+
+# pandas, SQLAlchemy y requests se importan dentro de las funciones que los usan
+# para que el proceso arranque rápido (ver benchmarks/bench_arranque.py).
+
+
+def init_planner_db():
     conn = sqlite3.connect("local_data.db")
     cursor = conn.cursor()
+    # WAL: los planners leen mientras otro escribe
+    cursor.execute("PRAGMA journal_mode=WAL")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS pedidos (
             pedido TEXT PRIMARY KEY,
@@ -26,17 +45,21 @@ def init_local_db():
             cumplimiento TEXT
         )
     """)
+    # Los KPIs filtran el historial por fecha de solicitud
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_fecha_solicitada ON pedidos (fecha_solicitada)")
     conn.commit()
+    kpis.init_kpi_buckets(conn)
+    vencimientos.init_alertas_db(conn)
+    delta_planner.init_secuencia(conn)
     conn.close()
 
-# Inicializa al inicio
-init_local_db()
-
 
 # ------------------------------------------------------
 # CONFIGURACIÓN DE FLASK
 # ------------------------------------------------------
 app = Flask(__name__)
+perfilado.instalar(app)  # Server-Timing, log de peticiones lentas y perfilado opcional
+respuestas.instalar(app)  # gzip/brotli y ETag (304 si los datos no cambiaron)
 
 # ------------------------------------------------------
 # VARIABLES DE ENTORNO (.env)
@@ -46,7 +69,8 @@ load_dotenv()
 # WhatsApp Cloud API
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
 WHATSAPP_PHONE_ID = os.getenv("WHATSAPP_PHONE_ID")
-WHATSAPP_DESTINATARIO = os.getenv("WHATSAPP_DESTINATARIO")
+WHATSAPP_DESTINATARIO = os.getenv("WHATSAPP_DESTINATARIO") or os.getenv("WHATSAPP_TO")
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL", "https://graph.facebook.com/v17.0")
 
 # SQL Server
 SQL_SERVER = os.getenv("SQL_SERVER", "204.232.237.135")
@@ -54,24 +78,110 @@ SQL_DB = os.getenv("SQL_DB", "Recsolog_wms")
 SQL_USER = os.getenv("SQL_USER", "recsolog")
 SQL_PASS = os.getenv("SQL_PASS", "8_HaZ!2Z")
 
+# Lecturas al WMS sin estorbar sus escrituras. WMS_AISLAMIENTO aplica a todas
+# las consultas (el sincronizador incluido): "SNAPSHOT" lee versiones sin tomar
+# bloqueos compartidos, pero solo si el DBA activó ALLOW_SNAPSHOT_ISOLATION en
+# la base. WMS_AISLAMIENTO_DASHBOARD se usa en planner, KPIs y exportaciones,
+# donde un dato sin confirmar es aceptable ("READ UNCOMMITTED"). Cada conexión
+# corta las consultas a los WMS_TIMEOUT_CONSULTA s y la espera de un bloqueo a
+# los WMS_LOCK_TIMEOUT_MS ms, y cede ante el WMS si hay deadlock.
+AISLAMIENTOS_WMS = ("READ COMMITTED", "READ UNCOMMITTED", "SNAPSHOT")
+
+def _aislamiento(variable, por_defecto):
+    valor = os.getenv(variable, por_defecto).strip().upper().replace("_", " ")
+    if valor not in AISLAMIENTOS_WMS:
+        log.warning("⚠️ %s=%s no es válido (%s); se usa %s", variable, valor, ", ".join(AISLAMIENTOS_WMS), por_defecto)
+        return por_defecto
+    return valor
+
+WMS_AISLAMIENTO = _aislamiento("WMS_AISLAMIENTO", "READ COMMITTED")
+WMS_AISLAMIENTO_DASHBOARD = _aislamiento("WMS_AISLAMIENTO_DASHBOARD", WMS_AISLAMIENTO)
+WMS_TIMEOUT_CONSULTA = int(os.getenv("WMS_TIMEOUT_CONSULTA", "30"))   # segundos; 0 = sin límite
+WMS_LOCK_TIMEOUT_MS = int(os.getenv("WMS_LOCK_TIMEOUT_MS", "2000"))  # -1 = esperar indefinidamente
+
+# ------------------------------------------------------
+# MÉTRICAS (expuestas en /metrics)
+# ------------------------------------------------------
+METRICA_WMS_SEGUNDOS = Histograma(
+    "recsolog_wms_consulta_segundos", "Duración de la consulta de pedidos a SQL Server", ("resultado",))
+METRICA_WMS_FILAS = Histograma(
+    "recsolog_wms_consulta_filas", "Filas devueltas por la consulta de pedidos", buckets=BUCKETS_CONTEO)
+METRICA_SQLITE_SEGUNDOS = Histograma(
+    "recsolog_sqlite_operacion_segundos", "Latencia de operaciones sobre las bases SQLite locales", ("operacion",))
+METRICA_TICK_SEGUNDOS = Histograma(
+    "recsolog_sync_tick_segundos", "Duración de un ciclo del sincronizador")
+METRICA_TICK_NUEVOS = Histograma(
+    "recsolog_sync_folios_nuevos", "Folios nuevos detectados por ciclo del sincronizador", buckets=BUCKETS_CONTEO)
+METRICA_NOTIFICADOS = Contador(
+    "recsolog_sync_notificados_total", "Folios notificados por WhatsApp")
+METRICA_WA_SEGUNDOS = Histograma(
+    "recsolog_whatsapp_envio_segundos", "Latencia del POST de mensajes a la Graph API")
+METRICA_WA_RESPUESTAS = Contador(
+    "recsolog_whatsapp_respuestas_total", "Respuestas de la Graph API por código HTTP", ("codigo",))
+METRICA_WA_PENDIENTES = Medidor(
+    "recsolog_whatsapp_pendientes", "Notificaciones por enviar en el ciclo actual del sincronizador")
+METRICA_EXPORTACION_SEGUNDOS = Histograma(
+    "recsolog_exportacion_segundos", "Duración de la generación de exportaciones", ("formato",))
+
 # ------------------------------------------------------
 # CONEXIÓN A SQL SERVER (OPTIMIZADA CON POOLING)
 # ------------------------------------------------------
+def _configurar_conexion_wms(dbapi_conn, _registro):
+    """Límites de cada conexión nueva al WMS (pyodbc)."""
+    if WMS_TIMEOUT_CONSULTA > 0:
+        dbapi_conn.timeout = WMS_TIMEOUT_CONSULTA
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute(f"SET LOCK_TIMEOUT {int(WMS_LOCK_TIMEOUT_MS)}")
+        # Si hay deadlock con una escritura del almacén, la víctima es esta lectura
+        cursor.execute("SET DEADLOCK_PRIORITY LOW")
+    finally:
+        cursor.close()
+
 def crear_engine_sqlserver():
     try:
+        from sqlalchemy import create_engine, event
+
         connection_string = (
             f"mssql+pyodbc://{SQL_USER}:{SQL_PASS}@{SQL_SERVER}/{SQL_DB}"
             "?driver=ODBC+Driver+18+for+SQL+Server"
             "&Encrypt=no"
         )
-        engine = create_engine(connection_string, pool_size=5, max_overflow=10, pool_recycle=1800)
-        print("✅ Conectado correctamente a SQL Server.")
+        engine = create_engine(
+            connection_string, pool_size=5, max_overflow=10, pool_recycle=1800,
+            isolation_level=WMS_AISLAMIENTO
+        )
+        event.listen(engine, "connect", _configurar_conexion_wms)
+        log.info("✅ Engine de SQL Server creado.", extra={
+            "servidor": SQL_SERVER, "base": SQL_DB, "aislamiento": WMS_AISLAMIENTO,
+            "aislamiento_dashboard": WMS_AISLAMIENTO_DASHBOARD,
+        })
         return engine
     except Exception as e:
-        print(f"❌ Error al conectar a SQL Server: {e}")
+        log.error("❌ Error al conectar a SQL Server: %s", e)
         return None
 
-engine = crear_engine_sqlserver()
+# El engine se crea en el primer uso (get_engine), no al importar el módulo.
+engine = None
+_engine_lock = Lock()
+
+def get_engine():
+    global engine
+    if engine is None:
+        with _engine_lock:
+            if engine is None:
+                engine = crear_engine_sqlserver()
+    return engine
+
+def _engine_tras_fork():
+    # Un worker de gunicorn no comparte las conexiones abiertas del proceso padre
+    global _engine_lock, _cupos_tramos
+    _engine_lock = Lock()
+    _cupos_tramos = BoundedSemaphore(CONSULTA_HILOS)
+    if engine is not None:
+        engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_engine_tras_fork)
 
 # ------------------------------------------------------
 # BASE LOCAL SQLITE (registra notificaciones y evita duplicados)
@@ -110,51 +220,68 @@ def init_local_db():
     # Agregar las faltantes
     for col, sql in columnas_necesarias.items():
         if col not in existentes:
-            print(f"🛠️ Añadiendo columna faltante '{col}' a pedidos_local")
+            log.info("🛠️ Añadiendo columna faltante '%s' a pedidos_local", col)
             cur.execute(sql)
 
     conn.commit()
     conn.close()
 
 
-# ------------------------------------------------------
-# FUNCIONES AUXILIARES SQLITE
-# ------------------------------------------------------
-def pedido_ya_enviado_hoy(folio):
-    """Verifica si el pedido ya fue notificado hoy."""
-    conn = sqlite3.connect(LOCAL_DB)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT fecha_envio FROM pedidos_local
-        WHERE folio = ? AND date(fecha_envio) = date('now', 'localtime')
-    """, (folio,))
-    existe = cur.fetchone() is not None
-    conn.close()
-    return existe
+_bases_inicializadas = False
+_bases_lock = Lock()
+
+def inicializar_bases():
+    """Crea o actualiza las bases locales una sola vez por proceso (primer uso)."""
+    global _bases_inicializadas
+    if _bases_inicializadas:
+        return
+    with _bases_lock:
+        if not _bases_inicializadas:
+            init_planner_db()
+            init_local_db()
+            init_snapshot_db()
+            init_entregas_db()
+            folios.init_folios_db()
+            _bases_inicializadas = True
 
-def registrar_envio(folio):
-    """Registra que el pedido fue notificado hoy."""
-    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn = sqlite3.connect(LOCAL_DB)
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO pedidos_local (folio) VALUES (?)", (folio,))
-    cur.execute("UPDATE pedidos_local SET fecha_envio = ? WHERE folio = ?", (ahora, folio))
-    conn.commit()
-    conn.close()
 
 # ------------------------------------------------------
-# FUNCIONES DE TIEMPO Y CUMPLIMIENTO
+# FUNCIONES AUXILIARES SQLITE
 # ------------------------------------------------------
-def calcular_hora_limite(fecha_solicitada):
-    dt = datetime.strptime(fecha_solicitada, "%Y-%m-%d %H:%M:%S")
-    return (dt + timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M:%S")
-
-def calcular_cumplimiento(hora_limite, fecha_entregada):
-    if not fecha_entregada or not hora_limite:
-        return "Pendiente"
-    dt_lim = datetime.strptime(hora_limite, "%Y-%m-%d %H:%M:%S")
-    dt_env = datetime.strptime(fecha_entregada, "%Y-%m-%d %H:%M:%S")
-    return "Cumple" if dt_env <= dt_lim else "No Cumple"
+# Folios ya notificados hoy; sobrevive a reinicios (folios.py)
+_vistos_hoy = folios.VistosHoy()
+
+@METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="registrar_envios")
+def registrar_envios(folios_enviados):
+    """Registra en una transacción que los pedidos fueron notificados hoy."""
+    if not folios_enviados:
+        return
+    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = sqlite3.connect(LOCAL_DB, timeout=10)
+    try:
+        with conn:
+            conn.executemany("""
+                INSERT INTO pedidos_local (folio, fecha_envio) VALUES (?, ?)
+                ON CONFLICT(folio) DO UPDATE SET fecha_envio = excluded.fecha_envio
+            """, [(f, ahora) for f in folios_enviados])
+    finally:
+        conn.close()
+    _vistos_hoy.registrar(folios_enviados)
+
+@METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="registrar_pedidos_nuevos")
+def registrar_pedidos_nuevos(folios_nuevos):
+    """Da de alta en local_data.db (Pendiente) los folios que aún no están; los existentes no se tocan."""
+    if not folios_nuevos:
+        return
+    conn = sqlite3.connect("local_data.db", timeout=10)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO pedidos (pedido, cumplimiento) VALUES (?, 'Pendiente')",
+                [(f,) for f in folios_nuevos]
+            )
+    finally:
+        conn.close()
 
 # ------------------------------------------------------
 # REGISTRO DE LOGS EN CSV (HISTORIAL DE ENVÍOS)
@@ -179,9 +306,13 @@ def registrar_log_envio(folio, mensaje, exito=True):
 # ------------------------------------------------------
 # FUNCIÓN PARA ENVIAR MENSAJE A WHATSAPP
 # ------------------------------------------------------
-def enviar_mensaje_whatsapp(mensaje):
-    """Envía un mensaje de texto a través de la API de WhatsApp Cloud."""
-    url = f"https://graph.facebook.com/v17.0/{WHATSAPP_PHONE_ID}/messages"
+def enviar_mensaje_whatsapp(mensaje, folio=None):
+    """
+    Envía un mensaje de texto a través de la API de WhatsApp Cloud.
+    Devuelve el id del mensaje (wamid) o None si falló; si se indica el folio,
+    el id queda registrado para seguir su entrega con los webhooks de estado.
+    """
+    url = f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_ID}/messages"
     headers = {
         "Authorization": f"Bearer {WHATSAPP_TOKEN}",
         "Content-Type": "application/json"
@@ -194,113 +325,385 @@ def enviar_mensaje_whatsapp(mensaje):
     }
 
     try:
-        res = requests.post(url, json=data, headers=headers)
+        import requests
+
+        # Antes del POST: la latencia de entrega incluye la llamada a la Graph API
+        enviado_en = time.time()
+        with METRICA_WA_SEGUNDOS.cronometrar():
+            res = requests.post(url, json=data, headers=headers)
+        METRICA_WA_RESPUESTAS.inc(codigo=res.status_code)
         if res.status_code == 200:
-            print(f"✅ Mensaje enviado a WhatsApp: {mensaje}")
+            wamid = (res.json().get("messages") or [{}])[0].get("id")
+            log.debug("✅ Mensaje enviado a WhatsApp", extra={"folio": folio, "wamid": wamid})
+            if wamid and folio:
+                registrar_mensaje_enviado(wamid, folio, enviado_en)
+            return wamid
         else:
-            print(f"⚠️ Error al enviar mensaje: {res.status_code} - {res.text}")
+            log.warning("⚠️ Error al enviar mensaje: %s - %s", res.status_code, res.text, extra={"folio": folio})
     except Exception as e:
-        print(f"❌ Error en conexión con WhatsApp API: {e}")
+        METRICA_WA_RESPUESTAS.inc(codigo="error")
+        log.error("❌ Error en conexión con WhatsApp API: %s", e, extra={"folio": folio})
+    return None
+
+def mensaje_nuevo_pedido(folio):
+    return (
+        f"📦 Nuevo pedido detectado: *{folio}*\n"
+        f"Por favor imprimir la factura correspondiente."
+    )
+
+def mensaje_sla_vencido(folio, hora_limite):
+    return (
+        f"⏰ Pedido *{folio}* sin entregar: su hora límite era {hora_limite[11:16]}.\n"
+        f"Por favor revisar el pedido en el planner."
+    )
+
+def alertar_vencimiento(folio, hora_limite):
+    mensaje = mensaje_sla_vencido(folio, hora_limite)
+    wamid = enviar_mensaje_whatsapp(mensaje, folio=folio)
+    registrar_log_envio(folio, mensaje, exito=wamid is not None)
+    log.info("⏰ Pedido %s vencido sin entrega", folio, extra={"folio": folio, "hora_limite": hora_limite})
+
+# Alertas de pedidos que pasan su hora límite sin entrega (vencimientos.py)
+_vencimientos = vencimientos.Vencimientos(alertar_vencimiento)
 
 # ------------------------------------------------------
 # CONSULTA SQL: SOLO PEDIDOS DE HOY Y FACTURABLES
 # ------------------------------------------------------
+def _rango_fechas(fecha_inicio=None, fecha_fin=None):
+    hoy = datetime.now().strftime("%Y-%m-%d")
+    return fecha_inicio or hoy, fecha_fin or hoy
+
+def _pedidos_pendientes(folios_sql):
+    return [folios.Pedido(f) for f in folios_sql]
+
+def leer_estado_local(conn=None, folios_buscados=None):
+    """
+    {pedido: (fecha_solicitada, hora_limite, fecha_entregada, cumplimiento)} de
+    local_data.db; con 'folios_buscados', solo esos (consultas de 500 en 500).
+    """
+    propia = conn is None
+    conn = conn or sqlite3.connect("local_data.db")
+    sql = "SELECT pedido, fecha_solicitada, hora_limite, fecha_entregada, cumplimiento FROM pedidos"
+    try:
+        if folios_buscados is None:
+            return {fila[0]: fila[1:] for fila in conn.execute(sql)}
+        estado = {}
+        for i in range(0, len(folios_buscados), 500):
+            lote = folios_buscados[i:i + 500]
+            for fila in conn.execute(f"{sql} WHERE pedido IN ({', '.join('?' * len(lote))})", lote):
+                estado[fila[0]] = fila[1:]
+        return estado
+    finally:
+        if propia:
+            conn.close()
+
+SQL_PEDIDOS = """
+    SELECT 
+        d.IDDocumentoSalida AS IDDocumentoSalida,
+        d.FechaHoraRegistro AS FechaHoraRegistro
+    FROM DOCUMENTOSALIDA d
+    INNER JOIN DETALLEEMBARQUE e 
+        ON d.IDDocumentoSalida = e.IDEmbarque
+    WHERE e.IDEstadoEmbarque = 7
+      AND (
+          d.IDDocumentoSalida LIKE '%-F1'
+          OR d.IDDocumentoSalida LIKE '%-F1X'
+          OR d.IDDocumentoSalida LIKE '%-F2'
+      )
+      AND CONVERT(date, d.FechaHoraRegistro) BETWEEN :inicio AND :fin
+    ORDER BY d.FechaHoraRegistro DESC
+"""
+
+# Opcional (CONSULTA_TRAMO_DIAS > 0): los rangos largos se parten en tramos de
+# esos días, una consulta corta por tramo que no retiene bloqueos del WMS todo
+# el rango. Por defecto (0) una sola consulta, como siempre. Los tramos en
+# paralelo de todas las peticiones del proceso comparten CONSULTA_HILOS cupos:
+# con 8 hilos de gunicorn, 8 consultas simples + 4 tramos caben en el pool
+# (pool_size=5 + max_overflow=10) sin que un reporte ancho lo agote.
+CONSULTA_TRAMO_DIAS = int(os.getenv("CONSULTA_TRAMO_DIAS", "0"))
+CONSULTA_HILOS = int(os.getenv("CONSULTA_HILOS", "4"))
+_cupos_tramos = BoundedSemaphore(CONSULTA_HILOS)
+
+def _tramos(fecha_inicio, fecha_fin, dias=None):
+    """[(inicio, fin)] del rango en tramos de 'dias' días, del más nuevo al más viejo (el orden de SQL_PEDIDOS)."""
+    dias = CONSULTA_TRAMO_DIAS if dias is None else dias
+    try:
+        inicio, fin = date.fromisoformat(fecha_inicio), date.fromisoformat(fecha_fin)
+    except ValueError:
+        return [(fecha_inicio, fecha_fin)]
+    if dias <= 0 or (fin - inicio).days < dias:
+        return [(fecha_inicio, fecha_fin)]
+    tramos = []
+    while fin >= inicio:
+        desde = max(inicio, fin - timedelta(days=dias - 1))
+        tramos.append((desde.isoformat(), fin.isoformat()))
+        fin = desde - timedelta(days=1)
+    return tramos
+
+def _consultar_tramo(query, tramo, aislamiento):
+    with get_engine().connect() as conn:
+        conn = conn.execution_options(isolation_level=aislamiento)
+        return conn.execute(query, {"inicio": tramo[0], "fin": tramo[1]}).fetchall()
+
+def _consultar_tramo_con_cupo(query, tramo, aislamiento):
+    with _cupos_tramos:
+        return _consultar_tramo(query, tramo, aislamiento)
+
+def _consultar_pedidos_sql(fecha_inicio, fecha_fin, aislamiento=None):
+    """
+    Consulta SQL Server (por tramos en paralelo si el rango es largo) y guarda
+    el resultado como respaldo. Propaga los errores. Sin 'aislamiento', el de
+    los dashboards (WMS_AISLAMIENTO_DASHBOARD).
+    """
+    from sqlalchemy import text
+
+    query = text(SQL_PEDIDOS)
+    tramos = _tramos(fecha_inicio, fecha_fin)
+    aislamiento = aislamiento or WMS_AISLAMIENTO_DASHBOARD
+
+    inicio = time.perf_counter()
+    try:
+        with fase("sql"):
+            if len(tramos) == 1:
+                registros = _consultar_tramo(query, tramos[0], aislamiento)
+            else:
+                # Ejecutor por llamada: sin hilos vivos que hereden los workers tras un fork
+                with ThreadPoolExecutor(max_workers=min(CONSULTA_HILOS, len(tramos)),
+                                        thread_name_prefix="wms") as ejecutor:
+                    partes = ejecutor.map(
+                        lambda tramo: _consultar_tramo_con_cupo(query, tramo, aislamiento), tramos
+                    )
+                    registros = [r for parte in partes for r in parte]
+    except Exception:
+        METRICA_WMS_SEGUNDOS.observe(time.perf_counter() - inicio, resultado="error")
+        raise
+    METRICA_WMS_SEGUNDOS.observe(time.perf_counter() - inicio, resultado="ok")
+    METRICA_WMS_FILAS.observe(len(registros))
+
+    folios_sql = [r.IDDocumentoSalida for r in registros]
+    with fase("sqlite"), METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="guardar_snapshot"):
+        guardado_en = guardar_snapshot(fecha_inicio, fecha_fin, folios_sql)
+    return _pedidos_pendientes(folios_sql), guardado_en
+
 def get_pedidos(fecha_inicio=None, fecha_fin=None):
     """Obtiene pedidos del SQL Server (con IDEstadoEmbarque = 7 y terminaciones F1, F1X, F2) 
     y combina con la base local para mantener las fechas y cumplimiento."""
     try:
-        hoy = datetime.now().strftime("%Y-%m-%d")
-        fecha_inicio = fecha_inicio or hoy
-        fecha_fin = fecha_fin or hoy
-
-        query = text("""
-            SELECT 
-                d.IDDocumentoSalida AS IDDocumentoSalida,
-                d.FechaHoraRegistro AS FechaHoraRegistro
-            FROM DOCUMENTOSALIDA d
-            INNER JOIN DETALLEEMBARQUE e 
-                ON d.IDDocumentoSalida = e.IDEmbarque
-            WHERE e.IDEstadoEmbarque = 7
-              AND (
-                  d.IDDocumentoSalida LIKE '%-F1'
-                  OR d.IDDocumentoSalida LIKE '%-F1X'
-                  OR d.IDDocumentoSalida LIKE '%-F2'
-              )
-              AND CONVERT(date, d.FechaHoraRegistro) BETWEEN :inicio AND :fin
-            ORDER BY d.FechaHoraRegistro DESC
-        """)
-
-        with engine.connect() as conn:
-            registros = conn.execute(query, {"inicio": fecha_inicio, "fin": fecha_fin}).fetchall()
-
-        pedidos = []
-        for r in registros:
-            pedidos.append({
-                "pedido": r.IDDocumentoSalida,
-                "fecha_solicitada": None,
-                "hora_limite": None,
-                "fecha_entregada": None,
-                "cumplimiento": "Pendiente"
-            })
-
-        print(f"✅ {len(pedidos)} pedidos cargados desde SQL Server ({fecha_inicio} a {fecha_fin})")
+        fecha_inicio, fecha_fin = _rango_fechas(fecha_inicio, fecha_fin)
+        # El sincronizador decide qué notificar: nunca con lecturas sin confirmar
+        pedidos, _ = _consultar_pedidos_sql(fecha_inicio, fecha_fin, aislamiento=WMS_AISLAMIENTO)
+        log.info("✅ %d pedidos cargados desde SQL Server (%s a %s)", len(pedidos), fecha_inicio, fecha_fin)
         return pedidos
 
     except Exception as e:
-        print(f"⚠️ Error al obtener pedidos: {e}")
+        log.warning("⚠️ Error al obtener pedidos: %s", e)
         return []
 
+# ------------------------------------------------------
+# LECTURA POR LOTES PARA RANGOS GRANDES
+# ------------------------------------------------------
+# iterar_pedidos entrega los pedidos del rango en lotes de LOTE_STREAM, tramo
+# por tramo de EXPORTACION_TRAMO_DIAS días, sin armar la lista completa ni
+# guardar respaldo: para exportaciones de meses que empiezan a enviar bytes de
+# inmediato con memoria acotada a un tramo. Cada tramo se lee entero (fetchmany
+# sobre el cursor de pyodbc, que no tiene cursores del lado del servidor) y la
+# conexión vuelve al pool antes de entregar sus lotes: un cliente lento no
+# retiene una conexión del WMS mientras descarga.
+LOTE_STREAM = int(os.getenv("LOTE_STREAM", "2000"))
+EXPORTACION_TRAMO_DIAS = int(os.getenv("EXPORTACION_TRAMO_DIAS", "7"))
+
+def _leer_tramo_por_lotes(query, tramo, tamano_lote):
+    with get_engine().connect() as conn:
+        resultado = conn.execution_options(isolation_level=WMS_AISLAMIENTO_DASHBOARD).execute(
+            query, {"inicio": tramo[0], "fin": tramo[1]}
+        )
+        lotes = []
+        while True:
+            filas = resultado.fetchmany(tamano_lote)
+            if not filas:
+                return lotes
+            lotes.append([r.IDDocumentoSalida for r in filas])
+
+def iterar_pedidos(fecha_inicio=None, fecha_fin=None, tamano_lote=LOTE_STREAM):
+    """Genera listas de Pedido (pendientes) del rango, en el orden de la consulta. Propaga los errores."""
+    from sqlalchemy import text
+
+    fecha_inicio, fecha_fin = _rango_fechas(fecha_inicio, fecha_fin)
+    query = text(SQL_PEDIDOS)
+    inicio = time.perf_counter()
+    total = 0
+    try:
+        # Tramo por tramo, en orden; la conexión se libera antes de cada yield
+        for tramo in _tramos(fecha_inicio, fecha_fin, dias=EXPORTACION_TRAMO_DIAS):
+            for folios_lote in _leer_tramo_por_lotes(query, tramo, tamano_lote):
+                total += len(folios_lote)
+                yield _pedidos_pendientes(folios_lote)
+    except Exception:
+        METRICA_WMS_SEGUNDOS.observe(time.perf_counter() - inicio, resultado="error")
+        raise
+    METRICA_WMS_SEGUNDOS.observe(time.perf_counter() - inicio, resultado="ok")
+    METRICA_WMS_FILAS.observe(total)
+
+def iterar_pedidos_con_respaldo(fecha_inicio=None, fecha_fin=None, tamano_lote=LOTE_STREAM):
+    """
+    Como iterar_pedidos, pero si SQL Server falla antes del primer lote sigue con
+    el último respaldo del rango. Devuelve (lotes, origen) con origen "sql",
+    "respaldo" o None si no hay ninguno de los dos.
+    """
+    fecha_inicio, fecha_fin = _rango_fechas(fecha_inicio, fecha_fin)
+    lotes = iterar_pedidos(fecha_inicio, fecha_fin, tamano_lote)
+    try:
+        primero = next(lotes, None)
+    except Exception as e:
+        log.warning("⚠️ Error al leer pedidos por lotes, se usa el respaldo: %s", e)
+        guardado = leer_snapshot(fecha_inicio, fecha_fin)
+        if guardado is None:
+            return iter(()), None
+        folios_sql = guardado[0]
+        return (
+            _pedidos_pendientes(folios_sql[i:i + tamano_lote])
+            for i in range(0, len(folios_sql), tamano_lote)
+        ), "respaldo"
+
+    def _todos():
+        if primero is not None:
+            yield primero
+            yield from lotes
+    return _todos(), "sql"
+
+# ------------------------------------------------------
+# RESPALDO LOCAL: SIRVE EL ÚLTIMO RESULTADO Y REFRESCA EN SEGUNDO PLANO
+# ------------------------------------------------------
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", "90"))  # segundos antes de considerar viejo el respaldo
+
+_refrescos_en_curso = set()
+_refrescos_lock = Lock()
+ERRORES_REFRESCO_MAX = 256
+_errores_refresco = {}  # último error por rango, hasta ERRORES_REFRESCO_MAX rangos
+
+def _anotar_error_refresco(clave, error):
+    with _refrescos_lock:
+        _errores_refresco.pop(clave, None)
+        if error is not None:
+            _errores_refresco[clave] = error
+            while len(_errores_refresco) > ERRORES_REFRESCO_MAX:
+                del _errores_refresco[next(iter(_errores_refresco))]
+
+def _refrescar_snapshot(fecha_inicio, fecha_fin):
+    clave = (fecha_inicio, fecha_fin)
+    try:
+        pedidos, _ = _consultar_pedidos_sql(fecha_inicio, fecha_fin)
+        _anotar_error_refresco(clave, None)
+        log.info("🔄 Respaldo actualizado: %d pedidos (%s a %s)", len(pedidos), fecha_inicio, fecha_fin)
+    except Exception as e:
+        _anotar_error_refresco(clave, str(e))
+        log.warning("⚠️ No se pudo refrescar el respaldo (%s a %s): %s", fecha_inicio, fecha_fin, e)
+    finally:
+        with _refrescos_lock:
+            _refrescos_en_curso.discard(clave)
+
+def _refrescar_en_segundo_plano(fecha_inicio, fecha_fin):
+    """Lanza un refresco del rango si no hay otro en curso."""
+    clave = (fecha_inicio, fecha_fin)
+    with _refrescos_lock:
+        if clave in _refrescos_en_curso:
+            return
+        _refrescos_en_curso.add(clave)
+    Thread(target=_refrescar_snapshot, args=clave, daemon=True).start()
+
+def get_pedidos_con_respaldo(fecha_inicio=None, fecha_fin=None):
+    """
+    Devuelve (pedidos, respaldo). Sirve de inmediato el último resultado guardado
+    del rango y, si ya es viejo, lo refresca en segundo plano. Solo consulta
+    SQL Server en línea cuando no existe respaldo del rango.
+    'respaldo' describe la antigüedad de los datos para mostrar el aviso en pantalla.
+    """
+    fecha_inicio, fecha_fin = _rango_fechas(fecha_inicio, fecha_fin)
+    clave = (fecha_inicio, fecha_fin)
+
+    guardado = leer_snapshot(fecha_inicio, fecha_fin)
+    if guardado is None:
+        try:
+            pedidos, _ = _consultar_pedidos_sql(fecha_inicio, fecha_fin)
+            _anotar_error_refresco(clave, None)
+            log.info("✅ %d pedidos cargados desde SQL Server (%s a %s)", len(pedidos), fecha_inicio, fecha_fin)
+        except Exception as e:
+            log.warning("⚠️ Error al obtener pedidos y no hay respaldo local: %s", e)
+            return [], {"desactualizado": True, "guardado_en": None, "antiguedad_min": None, "error": str(e)}
+        guardado = leer_snapshot(fecha_inicio, fecha_fin)
+
+    folios_sql, guardado_en = guardado
+    edad = time.time() - guardado_en
+    desactualizado = edad > SNAPSHOT_TTL
+    if desactualizado:
+        _refrescar_en_segundo_plano(fecha_inicio, fecha_fin)
+
+    respaldo = {
+        "desactualizado": desactualizado,
+        "guardado_en": datetime.fromtimestamp(guardado_en).strftime("%Y-%m-%d %H:%M:%S"),
+        "antiguedad_min": int(edad // 60),
+        "error": _errores_refresco.get(clave),
+    }
+    return _pedidos_pendientes(folios_sql), respaldo
+
 # ------------------------------------------------------
 # SINCRONIZACIÓN Y NOTIFICACIÓN AUTOMÁTICA
 # ------------------------------------------------------
+@METRICA_TICK_SEGUNDOS.cronometrar()
+def sincronizar_una_vez(pedidos_previos):
+    """Un ciclo del sincronizador: notifica los folios nuevos y devuelve los actuales."""
+    pedidos = get_pedidos()
+    actuales = {p.pedido for p in pedidos}
+    nuevos = actuales - pedidos_previos
+    METRICA_TICK_NUEVOS.observe(len(nuevos))
+
+    if nuevos:
+        # Alta en el planner: los triggers les dan seq y la página los recibe por delta
+        registrar_pedidos_nuevos(nuevos)
+
+        # Tras un reinicio 'nuevos' son todos los del día: se filtran en memoria
+        # contra los ya notificados y se registran en bloque antes de enviar
+        por_notificar = _vistos_hoy.no_vistos(nuevos)
+        METRICA_WA_PENDIENTES.set(len(por_notificar))
+        registrar_envios(por_notificar)
+
+        enviados_hoy = 0
+        for folio in por_notificar:
+            METRICA_WA_PENDIENTES.dec()
+            mensaje = mensaje_nuevo_pedido(folio)
+
+            try:
+                wamid = enviar_mensaje_whatsapp(mensaje, folio=folio)
+                registrar_log_envio(folio, mensaje, exito=wamid is not None)
+            except Exception as e:
+                registrar_log_envio(folio, mensaje, exito=False)
+                log.warning("⚠️ Error al enviar mensaje: %s", e, extra={"folio": folio})
+
+            enviados_hoy += 1
+            METRICA_NOTIFICADOS.inc()
+
+        if enviados_hoy > 0:
+            log.info("🟢 %d nuevos pedidos detectados y notificados.", enviados_hoy)
+        else:
+            log.info("✅ No hay pedidos nuevos que notificar hoy.")
+    else:
+        log.debug("🔁 Sin cambios detectados en pedidos.")
+
+    return actuales
+
 def sincronizar_periodicamente():
+    inicializar_bases()
     pedidos_previos = set()
     while True:
         try:
-            pedidos = get_pedidos()
-            actuales = {p["pedido"] for p in pedidos}
-            nuevos = actuales - pedidos_previos
-
-            if nuevos:
-                enviados_hoy = 0
-                for folio in nuevos:
-                    if pedido_ya_enviado_hoy(folio):
-                        continue
-
-                    registrar_envio(folio)
-                    mensaje = (
-                        f"📦 Nuevo pedido detectado: *{folio}*\n"
-                        f"Por favor imprimir la factura correspondiente."
-                    )
-
-                    try:
-                        enviar_mensaje_whatsapp(mensaje)
-                        registrar_log_envio(folio, mensaje, exito=True)
-                    except Exception as e:
-                        registrar_log_envio(folio, mensaje, exito=False)
-                        print(f"⚠️ Error al enviar mensaje: {e}")
-
-                    enviados_hoy += 1
-
-                if enviados_hoy > 0:
-                    print(f"🟢 {enviados_hoy} nuevos pedidos detectados y notificados.")
-                else:
-                    print("✅ No hay pedidos nuevos que notificar hoy.")
-            else:
-                print("🔁 Sin cambios detectados en pedidos.")
-
-            pedidos_previos = actuales
+            pedidos_previos = sincronizar_una_vez(pedidos_previos)
         except Exception as e:
-            print(f"Error en sincronización: {e}")
+            log.exception("Error en sincronización: %s", e)
         time.sleep(60)
 
 # ------------------------------------------------------
 # EXPORTAR REPORTE A EXCEL
 # ------------------------------------------------------
-from flask import send_file
-import io
-import pandas as pd
-
 @app.route("/exportar_excel")
 def exportar_excel():
     """
@@ -308,136 +711,108 @@ def exportar_excel():
     combinando los datos del SQL Server y los registros locales.
     """
     try:
-        # 1️⃣ Obtener pedidos desde SQL Server
-        pedidos_sql = get_pedidos()
+        import pandas as pd
+
+        # 1️⃣ Obtener pedidos desde SQL Server (o el último respaldo si no responde)
+        pedidos_sql, respaldo = get_pedidos_con_respaldo()
 
         # 2️⃣ Obtener información local (solicitada, límite, entrega, cumplimiento)
-        conn = sqlite3.connect("local_data.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM pedidos")
-        pedidos_local = {row["pedido"]: dict(row) for row in cursor.fetchall()}
-        conn.close()
+        with fase("sqlite"), METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="leer_pedidos"):
+            estado_local = leer_estado_local()
 
-        # 3️⃣ Combinar datos
-        datos_para_excel = []
-        for p in pedidos_sql:
-            pedido_id = p["pedido"]
-            local = pedidos_local.get(pedido_id, {})
-            datos_para_excel.append({
-                "Pedido": pedido_id,
-                "Fecha Solicitada": local.get("fecha_solicitada", ""),
-                "Hora Límite": local.get("hora_limite", ""),
-                "Fecha Entregada": local.get("fecha_entregada", ""),
-                "Cumplimiento": local.get("cumplimiento", "Pendiente"),
-            })
+        # 3️⃣ Combinar datos, columna por columna
+        with fase("merge"):
+            pedidos = folios.combinar(pedidos_sql, estado_local)
 
-        if not datos_para_excel:
+        if not pedidos:
             return "No hay datos para exportar."
 
         # 4️⃣ Crear el Excel en memoria
-        df = pd.DataFrame(datos_para_excel)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="KPI_Facturas")
+        with fase("xlsx"), METRICA_EXPORTACION_SEGUNDOS.cronometrar(formato="xlsx"):
+            df = pd.DataFrame({
+                "Pedido": [p.pedido for p in pedidos],
+                "Fecha Solicitada": [p.fecha_solicitada for p in pedidos],
+                "Hora Límite": [p.hora_limite for p in pedidos],
+                "Fecha Entregada": [p.fecha_entregada for p in pedidos],
+                "Cumplimiento": [p.cumplimiento for p in pedidos],
+            })
+            output = io.BytesIO()
+            with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+                df.to_excel(writer, index=False, sheet_name="KPI_Facturas")
 
         output.seek(0)
         fecha_hoy = datetime.now().strftime("%Y%m%d_%H%M%S")
 
         # 5️⃣ Enviar el archivo para descarga
-        return send_file(
+        respuesta = send_file(
             output,
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             download_name=f"Reporte_KPI_Facturas_{fecha_hoy}.xlsx",
             as_attachment=True
         )
+        if respaldo["guardado_en"]:
+            respuesta.headers["X-Datos-Actualizados"] = respaldo["guardado_en"]
+        return respuesta
 
     except Exception as e:
-        print(f"⚠️ Error al exportar a Excel: {e}")
+        log.exception("⚠️ Error al exportar a Excel: %s", e)
         return "Error al generar el archivo Excel."
 
-def sincronizar_pedidos():
+@app.route("/exportar_csv")
+def exportar_csv():
     """
-    Sincroniza pedidos desde SQL Server y notifica nuevos pedidos por WhatsApp.
-    No borra los datos locales (hora solicitada, entrega, etc.)
+    Descarga en CSV los pedidos del rango (fecha_inicio/fecha_fin) mientras se
+    leen de SQL Server, lote por lote: apta para rangos de meses.
     """
-    try:
-        pedidos_sql = get_pedidos()  # pedidos del SQL Server
+    fecha_inicio, fecha_fin = _rango_fechas(request.args.get("fecha_inicio"), request.args.get("fecha_fin"))
+    lotes, origen = iterar_pedidos_con_respaldo(fecha_inicio, fecha_fin)
+    if origen is None:
+        return "Error al generar el archivo CSV.", 503
+
+    def generar():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM para que Excel abra el UTF-8 con acentos
+        buffer.write("\ufeff")
+        writer.writerow(["Pedido", "Fecha Solicitada", "Hora Límite", "Fecha Entregada", "Cumplimiento"])
+        total = 0
+        inicio = time.perf_counter()
         conn = sqlite3.connect("local_data.db")
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pedidos (
-                pedido TEXT PRIMARY KEY,
-                fecha_solicitada TEXT,
-                hora_limite TEXT,
-                fecha_entregada TEXT,
-                cumplimiento TEXT
-            )
-        """)
-
-        nuevos = []
-        for p in pedidos_sql:
-            pedido_id = p["pedido"]
-
-            # Verificar si ya existe localmente
-            cursor.execute("SELECT 1 FROM pedidos WHERE pedido = ?", (pedido_id,))
-            existe = cursor.fetchone()
-
-            if not existe:
-                # Inserta pedido nuevo en la base local
-                cursor.execute("""
-                    INSERT INTO pedidos (pedido, fecha_solicitada, hora_limite, fecha_entregada, cumplimiento)
-                    VALUES (?, NULL, NULL, NULL, 'Pendiente')
-                """, (pedido_id,))
-                nuevos.append(pedido_id)
-
-        conn.commit()
-        conn.close()
-
-        if nuevos:
-            print(f"🟢 {len(nuevos)} nuevos pedidos detectados: {nuevos}")
-            for pedido in nuevos:
-                enviar_mensaje_whatsapp(pedido)
-        else:
-            print("✅ No hay pedidos nuevos que notificar hoy.")
-
-    except Exception as e:
-        print(f"⚠️ Error en sincronización incremental: {e}")
-
-def enviar_mensaje_whatsapp(pedido):
-    """Envía un mensaje a WhatsApp cuando se detecta un nuevo pedido."""
-    try:
-        token = os.getenv("WHATSAPP_TOKEN")
-        phone_number_id = os.getenv("WHATSAPP_PHONE_ID")
-        to = os.getenv("WHATSAPP_TO")  # tu número autorizado
-
-        url = f"https://graph.facebook.com/v17.0/{phone_number_id}/messages"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "messaging_product": "whatsapp",
-            "to": to,
-            "type": "text",
-            "text": {
-                "body": f"📦 Nuevo pedido detectado: *{pedido}*\nPor favor imprimir la factura correspondiente."
-            }
-        }
-
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            print(f"✅ Mensaje enviado a WhatsApp: {pedido}")
-        else:
-            print(f"⚠️ Error al enviar mensaje: {response.text}")
-
-    except Exception as e:
-        print(f"⚠️ Error en envío WhatsApp: {e}")
-
+        try:
+            for lote in lotes:
+                folios_lote = [p.pedido for p in lote]
+                for p in folios.combinar(lote, leer_estado_local(conn, folios_lote)):
+                    writer.writerow([p.pedido, p.fecha_solicitada, p.hora_limite, p.fecha_entregada, p.cumplimiento])
+                total += len(lote)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        except Exception as e:
+            # Los encabezados (200) ya salieron: se marca el archivo como incompleto y se
+            # corta la conexión sin cerrar la respuesta, para que la descarga falle
+            log.exception("⚠️ Exportación CSV interrumpida tras %d pedidos: %s", total, e)
+            yield buffer.getvalue() + f"# ERROR: exportación incompleta tras {total} pedidos\r\n"
+            raise
+        finally:
+            conn.close()
+            METRICA_EXPORTACION_SEGUNDOS.observe(time.perf_counter() - inicio, formato="csv")
+
+    respuesta = app.response_class(generar(), mimetype="text/csv")
+    respuesta.headers["Content-Disposition"] = (
+        f"attachment; filename=Reporte_KPI_Facturas_{fecha_inicio}_{fecha_fin}.csv"
+    )
+    respuesta.headers["X-Origen-Datos"] = origen
+    return respuesta
 
 # ------------------------------------------------------
 # RUTAS FLASK BÁSICAS
 # ------------------------------------------------------
+@app.before_request
+def asegurar_bases_locales():
+    inicializar_bases()
+
+
 @app.route("/")
 def index():
     return render_template("index.html", datetime=datetime)
@@ -450,238 +825,535 @@ def planner_view():
         fecha_fin = request.args.get("fecha_fin")
         search = request.args.get("search", "")
 
-        # Trae pedidos desde SQL Server
-        pedidos_sql = get_pedidos(fecha_inicio, fecha_fin)
-
-        # Trae datos locales
-        conn = sqlite3.connect("local_data.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM pedidos")
-        pedidos_local = {row["pedido"]: dict(row) for row in cursor.fetchall()}
-        conn.close()
+        # Trae pedidos desde SQL Server (o el último respaldo si no responde)
+        pedidos_sql, respaldo = get_pedidos_con_respaldo(fecha_inicio, fecha_fin)
+
+        # Trae datos locales; seq se lee antes para que los cambios que ocurran
+        # durante la lectura lleguen después por /api/planner/delta
+        with fase("sqlite"), METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="leer_pedidos"):
+            conn = sqlite3.connect("local_data.db")
+            try:
+                seq = delta_planner.secuencia_actual(conn)
+                no_modificado = respuestas.no_modificado(
+                    *_rango_fechas(fecha_inicio, fecha_fin), seq, *_version_respaldo(respaldo)
+                )
+                if no_modificado:
+                    return no_modificado
+                estado_local = leer_estado_local(conn)
+            finally:
+                conn.close()
 
         # Combina ambos
-        pedidos_finales = []
-        for p in pedidos_sql:
-            pedido_id = p["pedido"]
-            local = pedidos_local.get(pedido_id, {})
-            pedidos_finales.append({
-                "pedido": pedido_id,
-                "fecha_solicitada": local.get("fecha_solicitada"),
-                "hora_limite": local.get("hora_limite"),
-                "fecha_entregada": local.get("fecha_entregada"),
-                "cumplimiento": local.get("cumplimiento", "Pendiente"),
-            })
+        with fase("merge"):
+            pedidos_finales = folios.combinar(pedidos_sql, estado_local)
 
-        print(f"✅ Renderizando {len(pedidos_finales)} pedidos (combinados SQL + local)")
+        log.debug("✅ Renderizando %d pedidos (combinados SQL + local)", len(pedidos_finales))
+        # Solo las filas que cambiaron se renderizan; el resto sale del cache
+        with fase("filas"):
+            filas = fragmentos.filas_planner(app.jinja_env, pedidos_finales)
         return render_template(
             "planner_dashboard.html",
             facturas=pedidos_finales,
+            filas=filas,
             fecha_inicio=fecha_inicio,
             fecha_fin=fecha_fin,
-            search=search
+            search=search,
+            respaldo=respaldo,
+            seq=seq,
+            vista_de_hoy=_es_vista_de_hoy(fecha_inicio, fecha_fin)
         )
     except Exception as e:
-        print(f"⚠️ Error al renderizar planner: {e}")
+        log.exception("⚠️ Error al renderizar planner: %s", e)
         return render_template("planner_dashboard.html", facturas=[], fecha_inicio=None, fecha_fin=None)
 
 
+def _version_respaldo(respaldo):
+    """Lo que del respaldo se ve en la página (el aviso solo muestra la antigüedad si está desactualizado)."""
+    desactualizado = respaldo["desactualizado"]
+    return (respaldo["guardado_en"], desactualizado,
+            respaldo["antiguedad_min"] if desactualizado else None, respaldo["error"])
+
+
+def _secuencia_planner():
+    conn = sqlite3.connect("local_data.db")
+    try:
+        return delta_planner.secuencia_actual(conn)
+    finally:
+        conn.close()
+
+
+def _es_vista_de_hoy(fecha_inicio, fecha_fin):
+    """El planner muestra solo hoy: los folios nuevos del sincronizador pertenecen a la tabla."""
+    hoy = datetime.now().strftime("%Y-%m-%d")
+    return (fecha_inicio or hoy) == hoy and (fecha_fin or hoy) == hoy
+
+
+@app.route("/api/planner/delta")
+def api_planner_delta():
+    """Pedidos de local_data.db cambiados después de ?since=N (ver delta_planner.py)."""
+    try:
+        desde = int(request.args.get("since", "0"))
+    except ValueError:
+        return jsonify({"status": "error", "msg": "since debe ser un entero"}), 400
+
+    with METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="delta_planner"):
+        conn = sqlite3.connect("local_data.db")
+        try:
+            cambios = delta_planner.cambios_desde(conn, desde)
+        finally:
+            conn.close()
+    return jsonify(cambios)
+
+
+# ------------------------------------------------------
+# ESCRITURAS DEL PLANNER (local_data.db)
+# ------------------------------------------------------
+# Cada marca es una sola sentencia con RETURNING: el cumplimiento se evalúa en
+# SQLite contra la hora límite guardada, sin leer-calcular-escribir, así dos
+# planners (o el hilo de sincronización) no se pisan. El esquema se crea al
+# arrancar (inicializar_bases), nunca dentro de la petición. Si otro escritor
+# tiene la base, se espera hasta PLANNER_BUSY_TIMEOUT segundos y luego 503.
+PLANNER_BUSY_TIMEOUT = float(os.getenv("PLANNER_BUSY_TIMEOUT", "5"))
+
+SQL_MARCAR_SOLICITADA = """
+    INSERT INTO pedidos (pedido, fecha_solicitada, hora_limite, cumplimiento)
+    VALUES (:pedido, :fecha, :hora_limite, 'Pendiente')
+    ON CONFLICT(pedido) DO UPDATE SET
+        fecha_solicitada = excluded.fecha_solicitada,
+        hora_limite = excluded.hora_limite,
+        fecha_entregada = NULL,
+        cumplimiento = 'Pendiente'
+    RETURNING fecha_solicitada, hora_limite
+"""
+
+SQL_MARCAR_ENTREGADA = """
+    UPDATE pedidos
+    SET fecha_entregada = :fecha,
+        cumplimiento = CASE WHEN :fecha <= hora_limite THEN 'Cumple' ELSE 'No cumple' END
+    WHERE pedido = :pedido
+      AND hora_limite IS NOT NULL
+      AND (fecha_solicitada IS NULL OR fecha_solicitada <= :fecha)
+    RETURNING fecha_entregada, cumplimiento
+"""
+
+
+def _conectar_planner():
+    return sqlite3.connect("local_data.db", timeout=PLANNER_BUSY_TIMEOUT)
+
+
+def _base_ocupada(error):
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def _respuesta_base_ocupada():
+    return jsonify({"status": "error", "msg": "Base local ocupada, reintenta"}), 503, {"Retry-After": "1"}
+
+
+def _marcar_solicitada(conn, pedido, fecha, hora_limite):
+    # fetchall: la sentencia debe terminar antes del COMMIT
+    (fecha_solicitada, hora_limite), = conn.execute(
+        SQL_MARCAR_SOLICITADA, {"pedido": pedido, "fecha": fecha, "hora_limite": hora_limite}
+    ).fetchall()
+    return {"pedido": pedido, "status": "success", "fecha_solicitada": fecha_solicitada, "hora_limite": hora_limite}
+
+
+def _marcar_entregada(conn, pedido, fecha):
+    """Resultado por pedido; si no se actualizó, se consulta el motivo (solo en ese caso)."""
+    filas = conn.execute(SQL_MARCAR_ENTREGADA, {"pedido": pedido, "fecha": fecha}).fetchall()
+    if filas:
+        fecha_entregada, cumplimiento = filas[0]
+        return {"pedido": pedido, "status": "success", "fecha_entregada": fecha_entregada,
+                "cumplimiento": cumplimiento, "cumple": cumplimiento == "Cumple"}
+
+    actual = conn.execute("SELECT hora_limite FROM pedidos WHERE pedido = ?", (pedido,)).fetchone()
+    if actual is None:
+        msg = "Pedido no encontrado"
+    elif actual[0] is None:
+        msg = "Pedido sin hora límite"
+    else:
+        msg = "Entrega anterior a la solicitud"
+    return {"pedido": pedido, "status": "error", "msg": msg}
+
+
 @app.route("/actualizar_solicitada/<pedido>", methods=["POST"])
+@METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="actualizar_solicitada")
 def actualizar_solicitada(pedido):
-    """Registra fecha solicitada y calcula hora límite (+30 minutos)."""
+    """Registra fecha solicitada y calcula hora límite según las reglas de SLA."""
     try:
-        conn = sqlite3.connect("local_data.db")
-        cursor = conn.cursor()
-
-        # Crear la tabla si no existe (seguridad extra)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pedidos (
-                pedido TEXT PRIMARY KEY,
-                fecha_solicitada TEXT,
-                hora_limite TEXT,
-                fecha_entregada TEXT,
-                cumplimiento TEXT
-            )
-        """)
-
-        # Calcula las horas
-        fecha_solicitada = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        hora_limite_dt = datetime.now() + timedelta(minutes=30)
-        hora_limite = hora_limite_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-        # Inserta o actualiza según exista
-        cursor.execute("""
-            INSERT INTO pedidos (pedido, fecha_solicitada, hora_limite, cumplimiento)
-            VALUES (?, ?, ?, 'Pendiente')
-            ON CONFLICT(pedido) DO UPDATE SET
-                fecha_solicitada=excluded.fecha_solicitada,
-                hora_limite=excluded.hora_limite,
-                cumplimiento='Pendiente'
-        """, (pedido, fecha_solicitada, hora_limite))
+        ahora = datetime.now()
+        hora_limite = reglas_sla.hora_limite_pedido(pedido, ahora)
 
-        conn.commit()
-        conn.close()
+        conn = _conectar_planner()
+        try:
+            with conn:
+                resultado = _marcar_solicitada(conn, pedido, ahora.strftime("%Y-%m-%d %H:%M:%S"), hora_limite)
+        finally:
+            conn.close()
+        kpis.invalidar_cache()
+        _vencimientos.programar(pedido, resultado["hora_limite"])
 
         return jsonify({
             "status": "success",
-            "fecha_solicitada": fecha_solicitada,
-            "hora_limite": hora_limite
+            "fecha_solicitada": resultado["fecha_solicitada"],
+            "hora_limite": resultado["hora_limite"]
         })
 
     except Exception as e:
-        print(f"⚠️ Error al actualizar solicitada: {e}")
+        if _base_ocupada(e):
+            log.warning("⚠️ Base local ocupada al actualizar solicitada", extra={"folio": pedido})
+            return _respuesta_base_ocupada()
+        log.exception("⚠️ Error al actualizar solicitada: %s", e, extra={"folio": pedido})
         return jsonify({"status": "error"}), 500
 
 
 @app.route("/actualizar_entregada/<pedido>", methods=["POST"])
+@METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="actualizar_entregada")
 def actualizar_entregada(pedido):
     """Registra fecha de entrega y evalúa cumplimiento con hora límite."""
     try:
-        conn = sqlite3.connect("local_data.db")
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT hora_limite FROM pedidos WHERE pedido = ?", (pedido,))
-        row = cursor.fetchone()
-        if not row:
-            print(f"⚠️ Pedido no encontrado en local_data.db: {pedido}")
-            return jsonify({"status": "error", "msg": "Pedido no encontrado"}), 404
+        conn = _conectar_planner()
+        try:
+            with conn:
+                resultado = _marcar_entregada(conn, pedido, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        finally:
+            conn.close()
+    except Exception as e:
+        if _base_ocupada(e):
+            log.warning("⚠️ Base local ocupada al actualizar entrega", extra={"folio": pedido})
+            return _respuesta_base_ocupada()
+        log.exception("⚠️ Error al actualizar entrega: %s", e, extra={"folio": pedido})
+        return jsonify({"status": "error"}), 500
 
-        hora_limite = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
-        fecha_entregada_dt = datetime.now()
-        fecha_entregada = fecha_entregada_dt.strftime("%Y-%m-%d %H:%M:%S")
+    if resultado["status"] != "success":
+        log.warning("⚠️ No se marcó la entrega de %s: %s", pedido, resultado["msg"])
+        return jsonify({"status": "error", "msg": resultado["msg"]}), 404 if resultado["msg"] == "Pedido no encontrado" else 409
 
-        cumple = fecha_entregada_dt <= hora_limite
-        cumplimiento = "Cumple" if cumple else "No cumple"
+    kpis.invalidar_cache()
+    _vencimientos.cancelar(pedido)
+    return jsonify({
+        "status": "success",
+        "fecha_entregada": resultado["fecha_entregada"],
+        "cumplimiento": resultado["cumplimiento"],
+        "cumple": resultado["cumple"]
+    })
 
-        cursor.execute("""
-            UPDATE pedidos
-            SET fecha_entregada = ?, cumplimiento = ?
-            WHERE pedido = ?
-        """, (fecha_entregada, cumplimiento, pedido))
 
-        conn.commit()
-        conn.close()
+# ------------------------------------------------------
+# ACCIONES EN LOTE DEL PLANNER
+# ------------------------------------------------------
+# Cuerpo JSON: {"pedidos": ["OV-1-F1", {"pedido": "OV-2-F1", "fecha": "2025-10-22 13:05:00"}],
+#               "fecha": "..."}  — 'fecha' (por pedido o para todo el lote) es opcional
+# y sirve para capturas hechas fuera de línea (p. ej. lector de mano); sin ella, ahora.
+# Todo el lote se aplica en una transacción y se responde el resultado por pedido.
+MAX_LOTE = int(os.getenv("MAX_LOTE", "1000"))
 
-        return jsonify({
-            "status": "success",
-            "fecha_entregada": fecha_entregada,
-            "cumplimiento": cumplimiento,
-            "cumple": cumple
-        })
 
-    except Exception as e:
-        print(f"⚠️ Error al actualizar entrega: {e}")
-        return jsonify({"status": "error"}), 500
+def _fecha_lote(valor, por_defecto):
+    if not valor:
+        return por_defecto
+    fecha = datetime.fromisoformat(str(valor))
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone().replace(tzinfo=None)
+    return fecha.replace(microsecond=0)
 
 
-@app.route("/kpi")
-def kpi_view():
-    """Vista de KPIs basada en los mismos datos del Planner."""
+def _leer_lote():
+    """
+    ([(pedido, fecha)], {posición: resultado con error}) del cuerpo de la
+    petición; las posiciones permiten responder en el orden recibido.
+    """
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict):
+        raise ValueError("Se esperaba {'pedidos': [...]} con al menos un pedido")
+    pedidos = datos.get("pedidos")
+    if not isinstance(pedidos, list) or not pedidos:
+        raise ValueError("Se esperaba {'pedidos': [...]} con al menos un pedido")
+    if len(pedidos) > MAX_LOTE:
+        raise ValueError(f"Máximo {MAX_LOTE} pedidos por lote")
+
+    ahora = datetime.now().replace(microsecond=0)
+    por_defecto = _fecha_lote(datos.get("fecha"), ahora)
+
+    entradas, errores, vistos = [], {}, set()
+    for i, item in enumerate(pedidos):
+        pedido, fecha = (item.get("pedido"), item.get("fecha")) if isinstance(item, dict) else (item, None)
+        if not pedido or not isinstance(pedido, str):
+            errores[i] = {"pedido": pedido, "status": "error", "msg": "Pedido inválido"}
+            continue
+        if pedido in vistos:
+            errores[i] = {"pedido": pedido, "status": "error", "msg": "Pedido repetido en el lote"}
+            continue
+        vistos.add(pedido)
+        try:
+            entradas.append((pedido, _fecha_lote(fecha, por_defecto)))
+        except ValueError:
+            errores[i] = {"pedido": pedido, "status": "error", "msg": "Fecha inválida"}
+    return entradas, errores
+
+
+def _respuesta_lote(errores, por_pedido):
+    """Une los errores de lectura con el resultado de cada pedido, en el orden recibido."""
+    resultados = list(por_pedido.values())
+    for i in sorted(errores):
+        resultados.insert(i, errores[i])
+    actualizados = sum(1 for r in resultados if r["status"] == "success")
+    return jsonify({
+        "status": "success" if actualizados == len(resultados) else "parcial" if actualizados else "error",
+        "actualizados": actualizados,
+        "resultados": resultados
+    })
+
+
+@app.route("/actualizar_solicitada_lote", methods=["POST"])
+@METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="actualizar_solicitada_lote")
+def actualizar_solicitada_lote():
+    """Marca varios pedidos como solicitados (con su hora límite) en una sola transacción."""
     try:
-        # Obtener rango de fechas desde parámetros (opcional)
-        fecha_inicio = request.args.get("fecha_inicio")
-        fecha_fin = request.args.get("fecha_fin")
+        entradas, errores = _leer_lote()
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
 
-        pedidos = get_pedidos(fecha_inicio, fecha_fin)
-        total = len(pedidos)
+    try:
+        horas_limite = reglas_sla.horas_limite(entradas)
+        conn = _conectar_planner()
+        try:
+            with conn:
+                por_pedido = {
+                    pedido: _marcar_solicitada(conn, pedido, fecha.strftime("%Y-%m-%d %H:%M:%S"), hora_limite)
+                    if hora_limite is not None else
+                    {"pedido": pedido, "status": "error", "msg": "Fecha inválida"}
+                    for (pedido, fecha), hora_limite in zip(entradas, horas_limite)
+                }
+        finally:
+            conn.close()
+        kpis.invalidar_cache()
+        for pedido, resultado in por_pedido.items():
+            if resultado["status"] == "success":
+                _vencimientos.programar(pedido, resultado["hora_limite"])
+    except Exception as e:
+        if _base_ocupada(e):
+            return _respuesta_base_ocupada()
+        log.exception("⚠️ Error al actualizar solicitadas en lote: %s", e, extra={"folios": [p for p, _ in entradas]})
+        return jsonify({"status": "error"}), 500
 
-        # Calcular métricas
-        cumple = sum(1 for p in pedidos if p.get("Cumplimiento") == "Cumple")
-        no_cumple = sum(1 for p in pedidos if p.get("Cumplimiento") == "No Cumple")
-        pendiente = sum(1 for p in pedidos if p.get("Cumplimiento") == "Pendiente")
+    return _respuesta_lote(errores, por_pedido)
 
-        cumplimiento_pct = 0
-        if total > 0:
-            cumplimiento_pct = round((cumple / total) * 100, 2)
 
-        # Promedio de tiempo entre solicitada y entregada (en minutos)
-        tiempos = []
-        for p in pedidos:
-            if p.get("FechaSolicitada") and p.get("FechaEntregada"):
-                try:
-                    f1 = datetime.strptime(p["FechaSolicitada"], "%Y-%m-%d %H:%M:%S")
-                    f2 = datetime.strptime(p["FechaEntregada"], "%Y-%m-%d %H:%M:%S")
-                    delta = (f2 - f1).total_seconds() / 60
-                    tiempos.append(delta)
-                except:
-                    pass
+@app.route("/actualizar_entregada_lote", methods=["POST"])
+@METRICA_SQLITE_SEGUNDOS.cronometrar(operacion="actualizar_entregada_lote")
+def actualizar_entregada_lote():
+    """Registra la entrega de varios pedidos y evalúa su cumplimiento en una sola transacción."""
+    try:
+        entradas, errores = _leer_lote()
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
 
-        promedio_min = round(sum(tiempos) / len(tiempos), 2) if tiempos else 0
+    try:
+        conn = _conectar_planner()
+        try:
+            with conn:
+                por_pedido = {
+                    pedido: _marcar_entregada(conn, pedido, fecha.strftime("%Y-%m-%d %H:%M:%S"))
+                    for pedido, fecha in entradas
+                }
+        finally:
+            conn.close()
+        kpis.invalidar_cache()
+        for pedido, resultado in por_pedido.items():
+            if resultado["status"] == "success":
+                _vencimientos.cancelar(pedido)
+    except Exception as e:
+        if _base_ocupada(e):
+            return _respuesta_base_ocupada()
+        log.exception("⚠️ Error al actualizar entregas en lote: %s", e, extra={"folios": [p for p, _ in entradas]})
+        return jsonify({"status": "error"}), 500
 
-        return render_template(
-            "kpi_dashboard.html",
-            total=total,
-            cumple=cumple,
-            no_cumple=no_cumple,
-            pendiente=pendiente,
-            cumplimiento_pct=cumplimiento_pct,
-            promedio_min=promedio_min,
-            fecha_inicio=fecha_inicio,
-            fecha_fin=fecha_fin
-        )
+    return _respuesta_lote(errores, por_pedido)
 
-    except Exception as e:
-        print(f"⚠️ Error al cargar KPIs: {e}")
-        return render_template(
-            "kpi_dashboard.html",
-            total=0, cumple=0, no_cumple=0,
-            cumplimiento_pct=0, promedio_min=0,
-            error=str(e)
-        )
 
 # ------------------------------------------------------
 # KPI´S
 # ------------------------------------------------------
-@app.route("/kpi")
-def kpi_dashboard():
-    """
-    Página de métricas (KPIs) — muestra estadísticas generales.
-    Calcula los totales desde la base local SQLite (pedidos_local)
-    y los combina con los datos de cumplimiento del sistema.
-    """
-    try:
-        conn = sqlite3.connect(LOCAL_DB)
-        df = pd.read_sql_query("SELECT * FROM pedidos_local", conn)
-        conn.close()
+REPORTE_DIAS = int(os.getenv("REPORTE_DIAS", "30"))
 
-        if df.empty or "cumplimiento" not in df.columns:
-            stats = {
-                "tasa_cumplimiento": 0,
-                "total_cumple": 0,
-                "total_no_cumple": 0,
-                "total_enviadas": 0
-            }
-            facturas = []
-        else:
-            total_enviadas = len(df[df["fecha_entregada"].notnull()])
-            total_cumple = len(df[df["cumplimiento"] == "Cumple"])
-            total_no_cumple = len(df[df["cumplimiento"] == "No Cumple"])
-            tasa_cumplimiento = round((total_cumple / total_enviadas) * 100, 2) if total_enviadas > 0 else 0
 
-            stats = {
-                "tasa_cumplimiento": tasa_cumplimiento,
-                "total_cumple": total_cumple,
-                "total_no_cumple": total_no_cumple,
-                "total_enviadas": total_enviadas
-            }
+def _kpis_del_rango(dias_por_defecto=0):
+    """KPIs (cacheados por rango) de los pedidos entre fecha_inicio y fecha_fin de la petición."""
+    hoy = datetime.now()
+    fecha_inicio = request.args.get("fecha_inicio") or (hoy - timedelta(days=dias_por_defecto)).strftime("%Y-%m-%d")
+    fecha_fin = request.args.get("fecha_fin") or hoy.strftime("%Y-%m-%d")
+    return fecha_inicio, fecha_fin, kpis.kpis_de_pedidos(fecha_inicio, fecha_fin, get_pedidos_con_respaldo)
+
 
-            facturas = df[df["fecha_entregada"].notnull()].to_dict(orient="records")
+def _quiere_json():
+    return request.args.get("ajax") == "1" or request.args.get("formato") == "json"
 
-        return render_template("reporte.html", stats=stats, facturas=facturas)
 
+@app.route("/kpi")
+def kpi_view():
+    """Indicadores del rango (hoy por defecto); en JSON con ?ajax=1 o ?formato=json."""
+    try:
+        fecha_inicio, fecha_fin, k = _kpis_del_rango()
     except Exception as e:
-        print(f"⚠️ Error en kpi_dashboard: {e}")
+        log.exception("⚠️ Error al cargar KPIs: %s", e)
+        if _quiere_json():
+            return jsonify({"status": "error"}), 500
+        return render_template("kpi_dashboard.html", **kpis.kpis_vacios(), respaldo=None,
+                               datetime=datetime, error=str(e))
+
+    no_modificado = respuestas.no_modificado(fecha_inicio, fecha_fin, k["calculado_en"])
+    if no_modificado:
+        return no_modificado
+    if _quiere_json():
+        return jsonify({
+            **{clave: valor for clave, valor in k.items() if clave != "entregas"},
+            "fecha_inicio": fecha_inicio,
+            "fecha_fin": fecha_fin
+        })
+    return render_template(
+        "kpi_dashboard.html",
+        **k,
+        fecha_inicio=fecha_inicio,
+        fecha_fin=fecha_fin,
+        datetime=datetime
+    )
+
+
+@app.route("/kpi/reporte")
+def kpi_dashboard():
+    """Reporte histórico de cumplimiento (últimos REPORTE_DIAS días por defecto)."""
+    try:
+        fecha_inicio, fecha_fin, k = _kpis_del_rango(REPORTE_DIAS)
+    except Exception as e:
+        log.exception("⚠️ Error en kpi_dashboard: %s", e)
         return f"Ocurrió un error al generar el reporte KPI: {e}", 500
 
+    no_modificado = respuestas.no_modificado(fecha_inicio, fecha_fin, k["calculado_en"])
+    if no_modificado:
+        return no_modificado
+    stats = {
+        "tasa_cumplimiento": k["tasa_cumplimiento"],
+        "total_cumple": k["cumplen"],
+        "total_no_cumple": k["no_cumplen"],
+        "total_enviadas": k["entregados"]
+    }
+    return render_template(
+        "reporte.html",
+        stats=stats,
+        entregas=k["entregas"],
+        filas_entregas=fragmentos.filas_reporte(app.jinja_env, k["entregas"]),
+        respaldo=k["respaldo"],
+        fecha_inicio=fecha_inicio,
+        fecha_fin=fecha_fin
+    )
+
+
+@app.cli.command("recalcular-sla")
+@click.option("--desde", help="Primer día a recalcular (YYYY-MM-DD); por defecto todo el historial.")
+@click.option("--hasta", help="Último día a recalcular (YYYY-MM-DD).")
+def recalcular_sla(desde, hasta):
+    """Recalcula hora_limite y cumplimiento del historial con las reglas de SLA vigentes."""
+    inicio = time.perf_counter()
+    reglas = reglas_sla.recargar()
+    inicializar_bases()
+
+    conn = sqlite3.connect("local_data.db", timeout=30)
+    try:
+        # Sin triggers durante la reescritura: los buckets se reconstruyen una vez al final
+        conn.execute("BEGIN IMMEDIATE")
+        kpis.quitar_triggers_buckets(conn)
+        cambios = reglas_sla.recalcular_historial(conn, desde, hasta, reglas)
+        kpis.reconstruir_buckets(conn)
+        kpis.crear_triggers_buckets(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    kpis.invalidar_cache()
+    click.echo(f"✅ {cambios} pedidos actualizados en {time.perf_counter() - inicio:.1f} s")
+
+
+@app.cli.command("tareas")
+def tareas():
+    """Sincronizador con SQL Server y alertas de vencimiento, fuera de los workers web."""
+    inicializar_bases()
+    _vencimientos.iniciar()
+    sincronizar_periodicamente()
+
+
+@app.route("/api/kpi/serie")
+def api_kpi_serie():
+    """Serie diaria (o por hora con ?agrupar=hora) de volumen, cumplimiento y tiempo de entrega."""
+    hoy = datetime.now()
+    fecha_inicio = request.args.get("fecha_inicio") or (hoy - timedelta(days=6)).strftime("%Y-%m-%d")
+    fecha_fin = request.args.get("fecha_fin") or hoy.strftime("%Y-%m-%d")
+    agrupar = request.args.get("agrupar", "dia")
+    if agrupar not in ("dia", "hora"):
+        return jsonify({"status": "error", "msg": "agrupar debe ser 'dia' u 'hora'"}), 400
+    # Los buckets cambian con cada escritura en 'pedidos', igual que seq
+    no_modificado = respuestas.no_modificado(fecha_inicio, fecha_fin, _secuencia_planner())
+    if no_modificado:
+        return no_modificado
+    try:
+        with fase("sqlite"):
+            serie = kpis.serie_kpi(fecha_inicio, fecha_fin, agrupar)
+    except kpis.RangoDemasiadoLargo as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+    except ValueError:
+        return jsonify({"status": "error", "msg": "Fechas con formato YYYY-MM-DD"}), 400
+    return jsonify({
+        "fecha_inicio": fecha_inicio,
+        "fecha_fin": fecha_fin,
+        "agrupar": agrupar,
+        "serie": serie
+    })
+
+# ------------------------------------------------------
+# MÉTRICAS PARA PROMETHEUS
+# ------------------------------------------------------
+@app.route("/metrics")
+def metrics():
+    return exponer(), 200, {"Content-Type": TIPO_CONTENIDO}
+
+
+# ------------------------------------------------------
+# SEGUIMIENTO DE ENTREGA DE NOTIFICACIONES (API)
+# ------------------------------------------------------
+@app.route("/api/entregas/<folio>")
+def api_entregas_folio(folio):
+    """Estado de entrega (sent/delivered/read/failed) de los mensajes de un folio."""
+    mensajes = estado_folio(folio)
+    return jsonify({
+        "folio": folio,
+        "estado": mensajes[-1]["estado"] if mensajes else None,
+        "mensajes": mensajes
+    })
+
+
+@app.route("/api/entregas/latencias")
+def api_entregas_latencias():
+    """Percentiles de latencia envío→entrega/lectura en un rango de fechas (por defecto hoy)."""
+    try:
+        fecha_inicio, fecha_fin = _rango_fechas(request.args.get("fecha_inicio"), request.args.get("fecha_fin"))
+        desde = datetime.strptime(fecha_inicio, "%Y-%m-%d").timestamp()
+        hasta = (datetime.strptime(fecha_fin, "%Y-%m-%d") + timedelta(days=1)).timestamp()
+    except ValueError:
+        return jsonify({"status": "error", "msg": "Fechas inválidas (YYYY-MM-DD)"}), 400
+
+    resumen = resumen_latencias(desde, hasta)
+    resumen.update({"fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin})
+    return jsonify(resumen)
 
 
 # ------------------------------------------------------
 # EJECUCIÓN PRINCIPAL
 # ------------------------------------------------------
+# Servidor de desarrollo. En producción: gunicorn -c gunicorn.conf.py app:app
 if __name__ == "__main__":
+    inicializar_bases()
     hilo_sync = Thread(target=sincronizar_periodicamente, daemon=True)
     hilo_sync.start()
-    init_local_db()
-    sincronizar_pedidos()
-    app.run(debug=True)
\ No newline at end of file
+    _vencimientos.iniciar()
+    app.run(debug=os.getenv("FLASK_DEBUG", "1") != "0")
\ No newline at end of file
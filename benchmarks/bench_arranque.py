@@ -0,0 +1,67 @@
+"""
+Mide el tiempo de arranque de app.py: importar el módulo y servir la primera
+petición (GET /) en un proceso nuevo, como ocurre tras un cold start en Render.
+
+Uso:
+    python benchmarks/bench_arranque.py [--repeticiones 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import shutil
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Se ejecuta en un proceso hijo para medir un arranque en frío real.
+SCRIPT_HIJO = r"""
+import sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+respuesta = app.app.test_client().get("/")
+t2 = time.perf_counter()
+assert respuesta.status_code == 200, respuesta.status_code
+print(f"{(t1 - t0) * 1000:.1f} {(t2 - t0) * 1000:.1f} {','.join(m for m in ('pandas', 'sqlalchemy', 'requests') if m in sys.modules)}")
+"""
+
+
+def medir(repeticiones):
+    # Copia de trabajo para no tocar las bases SQLite del repositorio.
+    directorio = tempfile.mkdtemp(prefix="bench_arranque_")
+    try:
+        for nombre in os.listdir(RAIZ):
+            origen = os.path.join(RAIZ, nombre)
+            if nombre.endswith((".py", ".db")) and os.path.isfile(origen):
+                shutil.copy(origen, directorio)
+        shutil.copytree(os.path.join(RAIZ, "templates"), os.path.join(directorio, "templates"))
+
+        importacion, primera_peticion, modulos = [], [], ""
+        for _ in range(repeticiones):
+            salida = subprocess.run(
+                [sys.executable, "-c", SCRIPT_HIJO],
+                cwd=directorio, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1].split(" ")
+            importacion.append(float(salida[0]))
+            primera_peticion.append(float(salida[1]))
+            modulos = salida[2] if len(salida) > 2 else ""
+        return importacion, primera_peticion, modulos
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=10)
+    args = parser.parse_args()
+
+    importacion, primera_peticion, modulos = medir(args.repeticiones)
+    print(f"import app          p50={statistics.median(importacion):8.1f} ms  max={max(importacion):8.1f} ms")
+    print(f"import + GET /      p50={statistics.median(primera_peticion):8.1f} ms  max={max(primera_peticion):8.1f} ms")
+    print(f"módulos pesados cargados tras GET /: {modulos or 'ninguno'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Mide el costo por petición de la verificación de firma X-Hub-Signature-256
+y de la ventana anti-repetición, aisladas y dentro de POST /webhook.
+
+Uso:
+    python benchmarks/bench_firma_webhook.py [--peticiones 2000]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+SECRETO = b"secreto-de-prueba"
+
+
+def payload_estados(n_estados, semilla):
+    """Callback de estados con el tamaño típico de una ráfaga de Meta."""
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "1234567890",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "5215500000000", "phone_number_id": "1234"},
+                    "statuses": [{
+                        "id": f"wamid.HBgM{semilla:08d}{i:04d}",
+                        "status": "delivered",
+                        "timestamp": str(1700000000 + i),
+                        "recipient_id": "5215511111111",
+                        "conversation": {"id": "c" * 32, "origin": {"type": "utility"}},
+                        "pricing": {"billable": True, "pricing_model": "CBP", "category": "utility"},
+                    } for i in range(n_estados)]
+                }
+            }]
+        }]
+    }).encode()
+
+
+def firmar(cuerpo):
+    return "sha256=" + hmac.new(SECRETO, cuerpo, hashlib.sha256).hexdigest()
+
+
+def medir_post(cliente, cuerpos, firmado):
+    tiempos = []
+    for cuerpo in cuerpos:
+        encabezados = {"X-Hub-Signature-256": firmar(cuerpo)} if firmado else {}
+        t0 = time.perf_counter()
+        respuesta = cliente.post("/webhook", data=cuerpo, headers=encabezados, content_type="application/json")
+        tiempos.append(time.perf_counter() - t0)
+        assert respuesta.status_code == 200, respuesta.status_code
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2] * 1e6, tiempos[int(len(tiempos) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=2000)
+    args = parser.parse_args()
+
+    from firma_webhook import VentanaRepeticion, firma_valida
+
+    cuerpo = payload_estados(3, 0)
+    firma = firmar(cuerpo)
+    n = 20000
+    t_firma = timeit.timeit(lambda: firma_valida(cuerpo, firma, SECRETO), number=n) / n * 1e6
+    ventana = VentanaRepeticion(maximo=10000)
+    claves = iter(range(10 ** 9))
+    t_ventana = timeit.timeit(lambda: ventana.ya_visto(next(claves)), number=n) / n * 1e6
+    print(f"cuerpo de {len(cuerpo)} bytes")
+    print(f"firma_valida            {t_firma:8.2f} µs/llamada")
+    print(f"VentanaRepeticion (LRU) {t_ventana:8.2f} µs/llamada  (lleno: {len(ventana)} claves)")
+
+    # POST /webhook completo, con y sin secreto configurado, en un directorio temporal.
+    directorio = tempfile.mkdtemp(prefix="bench_firma_")
+    os.chdir(directorio)
+    try:
+        import importlib
+        import firma_webhook
+        resultados = {}
+        for firmado in (False, True):
+            os.environ.pop("WHATSAPP_APP_SECRET", None)
+            os.environ["WEBHOOK_SIN_FIRMA"] = "0" if firmado else "1"
+            if firmado:
+                os.environ["WHATSAPP_APP_SECRET"] = SECRETO.decode()
+            importlib.reload(firma_webhook)
+            webhook_local = importlib.reload(importlib.import_module("webhook_local"))
+            cliente = webhook_local.app.test_client()
+            cuerpos = [payload_estados(3, i + (10 ** 6 if firmado else 0)) for i in range(args.peticiones)]
+            resultados[firmado] = medir_post(cliente, cuerpos, firmado)
+
+        for firmado, (p50, p99) in resultados.items():
+            etiqueta = "con firma" if firmado else "sin firma"
+            print(f"POST /webhook {etiqueta}   p50={p50:8.1f} µs  p99={p99:8.1f} µs")
+        print(f"costo añadido p50: {resultados[True][0] - resultados[False][0]:+.1f} µs")
+    finally:
+        os.chdir(RAIZ)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
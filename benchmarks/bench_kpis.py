@@ -0,0 +1,106 @@
+"""
+Compara el cálculo de KPIs fila por fila (como lo hacía kpi_view: dos
+datetime.strptime por pedido) contra el motor vectorizado de kpis.py sobre
+un historial sintético de local_data.db.
+
+Uso:
+    python benchmarks/bench_kpis.py [--meses 12] [--por-dia 800]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+FORMATO = "%Y-%m-%d %H:%M:%S"
+
+
+def sembrar(ruta, meses, por_dia):
+    """Pedidos solicitados a lo largo de 'meses'; 80 % entregados, con un 'No cumple' de vez en cuando."""
+    aleatorio = random.Random(7)
+    hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    filas = []
+    for dia in range(meses * 30):
+        base = hoy - timedelta(days=dia)
+        for i in range(por_dia):
+            solicitada = base + timedelta(seconds=aleatorio.randrange(6 * 3600, 22 * 3600))
+            limite = solicitada + timedelta(minutes=30)
+            entregada = None
+            cumplimiento = "Pendiente"
+            if aleatorio.random() < 0.8:
+                entregada = solicitada + timedelta(minutes=aleatorio.expovariate(1 / 20))
+                cumplimiento = "Cumple" if entregada <= limite else "No cumple"
+                entregada = entregada.strftime(FORMATO)
+            filas.append((f"OV-{dia:04d}{i:05d}-F1", solicitada.strftime(FORMATO), limite.strftime(FORMATO),
+                          entregada, cumplimiento))
+
+    conn = sqlite3.connect(ruta)
+    conn.execute("""
+        CREATE TABLE pedidos (
+            pedido TEXT PRIMARY KEY, fecha_solicitada TEXT, hora_limite TEXT,
+            fecha_entregada TEXT, cumplimiento TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX idx_pedidos_fecha_solicitada ON pedidos (fecha_solicitada)")
+    conn.executemany("INSERT INTO pedidos VALUES (?, ?, ?, ?, ?)", filas)
+    conn.commit()
+    conn.close()
+    return len(filas)
+
+
+def kpis_por_fila(ruta):
+    """Lo que hacía kpi_view: dicts por pedido y strptime dentro del ciclo."""
+    conn = sqlite3.connect(ruta)
+    conn.row_factory = sqlite3.Row
+    pedidos = [dict(r) for r in conn.execute("SELECT * FROM pedidos")]
+    conn.close()
+
+    cumple = sum(1 for p in pedidos if p["cumplimiento"] == "Cumple")
+    no_cumple = sum(1 for p in pedidos if p["cumplimiento"] == "No cumple")
+    tiempos = []
+    for p in pedidos:
+        if p["fecha_solicitada"] and p["fecha_entregada"]:
+            f1 = datetime.strptime(p["fecha_solicitada"], FORMATO)
+            f2 = datetime.strptime(p["fecha_entregada"], FORMATO)
+            tiempos.append((f2 - f1).total_seconds() / 60)
+    return cumple, no_cumple, sum(tiempos) / len(tiempos) if tiempos else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meses", type=int, default=12)
+    parser.add_argument("--por-dia", type=int, default=800)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_kpis_") as directorio:
+        ruta = os.path.join(directorio, "local_data.db")
+        n = sembrar(ruta, args.meses, args.por_dia)
+
+        import kpis
+
+        t0 = time.perf_counter()
+        kpis_por_fila(ruta)
+        por_fila = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        historial = kpis.cargar_historial(conn=sqlite3.connect(ruta))
+        carga = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        resultado = kpis.calcular_kpis(historial)
+        calculo = time.perf_counter() - t0
+
+    print(f"{n:,} pedidos en {args.meses} meses")
+    print(f"{'fila por fila (solo conteos y promedio)':<48}{por_fila * 1000:>10.0f} ms")
+    print(f"{'kpis.cargar_historial':<48}{carga * 1000:>10.0f} ms")
+    print(f"{'kpis.calcular_kpis (+ mediana, p90, hora, día)':<48}{calculo * 1000:>10.0f} ms")
+    print(f"eficiencia {resultado['eficiencia']} %, tiempo de entrega {resultado['tiempo_entrega_min']}")
+
+
+if __name__ == "__main__":
+    main()
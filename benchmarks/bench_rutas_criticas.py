@@ -0,0 +1,195 @@
+"""
+Benchmark de las rutas críticas de app.py contra dobles locales de SQL Server
+y de la Graph API (benchmarks/dobles.py):
+
+  - get_pedidos                      consulta + armado de la lista
+  - tick (10 nuevos)                 un ciclo de sincronizar_periodicamente con 10 folios nuevos
+  - tick tras reinicio               primer ciclo después de un reinicio (todos ya notificados hoy)
+  - GET /planner                     combinación SQL + local y render de la plantilla
+  - GET /exportar_excel              combinación y escritura del .xlsx
+
+Cada tamaño corre en un proceso nuevo dentro de un directorio temporal (no toca
+las bases SQLite del repositorio) para que el pico de RSS sea el de ese tamaño.
+
+Uso:
+    python benchmarks/bench_rutas_criticas.py [--tamanos 1000,10000,100000] [--repeticiones 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUEVOS_POR_TICK = 10
+
+
+def _percentil(tiempos, p):
+    ordenados = sorted(tiempos)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _medir(funcion, repeticiones, calentar=False):
+    tiempos = []
+    if calentar:
+        # Excluye importaciones diferidas y compilación de plantillas de la medición
+        with contextlib.redirect_stdout(io.StringIO()):
+            funcion(0)
+    for i in range(repeticiones):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            funcion(i)
+            tiempos.append(time.perf_counter() - t0)
+    return tiempos
+
+
+def _sembrar_local(folios, reservados):
+    """Estado local típico: un tercio solicitados, un tercio entregados; todos notificados hoy salvo 'reservados'."""
+    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = sqlite3.connect("local_data.db")
+    filas = []
+    for i, folio in enumerate(folios):
+        if i % 3 == 0:
+            filas.append((folio, None, None, None, "Pendiente"))
+        elif i % 3 == 1:
+            filas.append((folio, ahora, ahora, None, "Pendiente"))
+        else:
+            filas.append((folio, ahora, ahora, ahora, "Cumple"))
+    # Columnas con nombre: pedidos tiene más (seq) que las que se siembran
+    from delta_planner import COLUMNAS
+    conn.executemany(
+        f"INSERT OR REPLACE INTO pedidos ({', '.join(COLUMNAS)}) VALUES ({', '.join('?' * len(COLUMNAS))})",
+        filas
+    )
+    conn.commit()
+    conn.close()
+
+    # Se siembra después de inicializar_bases: folios_vistos no se rellena solo
+    from folios import clave_de
+    notificados = [f for f in folios if f not in reservados]
+    conn = sqlite3.connect("pedidos_local.db")
+    conn.executemany(
+        "INSERT OR REPLACE INTO pedidos_local (folio, fecha_envio) VALUES (?, ?)",
+        [(f, ahora) for f in notificados]
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO folios_vistos (dia, clave) VALUES (?, ?)",
+        [(ahora[:10], clave_de(f)) for f in notificados]
+    )
+    conn.commit()
+    conn.close()
+
+
+def correr_tamano(n, repeticiones, latencia_sql):
+    """Se ejecuta en el proceso hijo, con el directorio temporal como cwd."""
+    sys.path.insert(0, RAIZ)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from dobles import EngineFalso, GraphAPIFalsa, generar_filas
+
+    graph = GraphAPIFalsa()
+    os.environ["WHATSAPP_API_URL"] = graph.url
+    os.environ.setdefault("SNAPSHOT_TTL", "3600")
+    # Los logs van a stdout desde otro hilo y se mezclarían con el JSON del resultado
+    os.environ.setdefault("LOG_NIVEL", "CRITICAL")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        app.inicializar_bases()
+
+    filas = generar_filas(n)
+    app.engine = EngineFalso(filas, latencia=latencia_sql)
+    folios = [f.IDDocumentoSalida for f in filas]
+    reservados = set(folios[:NUEVOS_POR_TICK * repeticiones])
+    _sembrar_local(folios, reservados)
+
+    resultados = {}
+    resultados["get_pedidos"] = _medir(lambda i: app.get_pedidos(), repeticiones, calentar=True)
+
+    todos = set(folios)
+
+    def tick_nuevos(i):
+        lote = set(folios[i * NUEVOS_POR_TICK:(i + 1) * NUEVOS_POR_TICK])
+        app.sincronizar_una_vez(todos - lote)
+
+    resultados[f"tick ({NUEVOS_POR_TICK} nuevos)"] = _medir(tick_nuevos, repeticiones)
+    def tick_reinicio(i):
+        # Como tras un reinicio: sin pedidos previos y los vistos de hoy se leen de folios_vistos
+        app._vistos_hoy = app.folios.VistosHoy()
+        app.sincronizar_una_vez(set())
+
+    resultados["tick tras reinicio"] = _medir(tick_reinicio, repeticiones)
+
+    cliente = app.app.test_client()
+
+    def pedir(ruta):
+        def _pedir(i):
+            respuesta = cliente.get(ruta)
+            assert respuesta.status_code == 200, (ruta, respuesta.status_code)
+            respuesta.get_data()
+        return _pedir
+
+    resultados["GET /planner"] = _medir(pedir("/planner"), repeticiones, calentar=True)
+    resultados["GET /exportar_excel"] = _medir(pedir("/exportar_excel"), repeticiones, calentar=True)
+    graph.cerrar()
+
+    return {
+        "n": n,
+        "mensajes_enviados": graph.recibidos,
+        "rss_pico_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "operaciones": {
+            nombre: {
+                "p50_ms": _percentil(t, 50) * 1000,
+                "p99_ms": _percentil(t, 99) * 1000,
+                "filas_por_seg": n / _percentil(t, 50) if _percentil(t, 50) else 0,
+            }
+            for nombre, t in resultados.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="1000,10000,100000")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--latencia-sql-ms", type=float, default=0.0,
+                        help="latencia simulada por consulta a SQL Server")
+    parser.add_argument("--json", action="store_true", help="imprime los resultados en JSON")
+    parser.add_argument("--hijo", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        resultado = correr_tamano(args.hijo, args.repeticiones, args.latencia_sql_ms / 1000)
+        print(json.dumps(resultado))
+        return
+
+    resultados = []
+    for n in (int(x) for x in args.tamanos.split(",")):
+        with tempfile.TemporaryDirectory(prefix="bench_rutas_") as directorio:
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--hijo", str(n),
+                 "--repeticiones", str(args.repeticiones), "--latencia-sql-ms", str(args.latencia_sql_ms)],
+                cwd=directorio, capture_output=True, text=True
+            )
+            if salida.returncode != 0:
+                sys.exit(f"Falló el tamaño {n}:\n{salida.stderr}")
+            resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+        return
+
+    for r in resultados:
+        print(f"\n== {r['n']:,} pedidos  (RSS pico {r['rss_pico_mb']:.0f} MB, {r['mensajes_enviados']} mensajes a la Graph API falsa)")
+        print(f"{'operación':<24}{'p50 ms':>12}{'p99 ms':>12}{'pedidos/s':>14}")
+        for nombre, m in r["operaciones"].items():
+            print(f"{nombre:<24}{m['p50_ms']:>12.2f}{m['p99_ms']:>12.2f}{m['filas_por_seg']:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Prueba de carga del perfil de producción (gunicorn.conf.py) contra dobles
+locales de SQL Server y de la Graph API (benchmarks/dobles.py).
+
+Levanta app.py y webhook_local.py detrás de un mismo puerto, en un directorio
+temporal (no toca las bases SQLite del repositorio), y lo golpea con N
+usuarios concurrentes, cada uno con su conexión keep-alive y sin pausa entre
+peticiones, con la mezcla de un piso de operación:
+
+  - GET /planner                     con If-None-Match, como la recarga del navegador
+  - GET /api/planner/delta           el sondeo de la página abierta
+  - GET /kpi
+  - POST /actualizar_solicitada/...  y POST /actualizar_entregada/...
+  - POST /webhook                    callbacks de estados firmados
+
+Por cada escalón de usuarios informa peticiones/s y latencias p50/p95/p99. La
+capacidad es el mayor escalón con p95 dentro del objetivo y sin errores; en
+"usuarios de piso" se traduce con la tasa de peticiones de una persona real
+(un sondeo cada 15 s más sus marcas, ~0.1 pet/s).
+
+Con gunicorn instalado se sirve con gunicorn.conf.py; si no, con el servidor
+con hilos de werkzeug (sirve para comparar cambios, no para dimensionar).
+El generador corre en un solo proceso: si su CPU se satura antes que la del
+servidor, las cifras son un mínimo.
+
+Uso:
+    python benchmarks/carga.py [--usuarios 5,10,25,50] [--duracion 20] [--pedidos 5000]
+                               [--servidor auto|gunicorn|werkzeug] [--objetivo-p95-ms 500]
+"""
+import argparse
+import gzip
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, BENCHMARKS)
+
+from bench_firma_webhook import SECRETO, firmar, payload_estados  # noqa: E402
+
+# Peso de cada operación en la mezcla
+MEZCLA = {
+    "GET /planner": 25,
+    "GET /api/planner/delta": 35,
+    "GET /kpi": 10,
+    "POST /actualizar_solicitada": 10,
+    "POST /actualizar_entregada": 10,
+    "POST /webhook": 10,
+}
+ESPERA_ARRANQUE_SEG = 120
+
+
+def crear_aplicacion():
+    """
+    App WSGI con los dobles: /webhook va a webhook_local.py y lo demás a app.py.
+    Se llama dentro del directorio temporal (en el maestro de gunicorn con preload_app).
+    """
+    from dobles import EngineFalso, GraphAPIFalsa, generar_filas
+    from bench_rutas_criticas import _sembrar_local
+
+    n = int(os.getenv("CARGA_PEDIDOS", "5000"))
+    graph = GraphAPIFalsa()
+    os.environ["WHATSAPP_API_URL"] = graph.url
+    os.environ.setdefault("SNAPSHOT_TTL", "3600")
+
+    import app
+    import webhook_local
+
+    app.inicializar_bases()
+    filas = generar_filas(n)
+    app.engine = EngineFalso(filas, latencia=float(os.getenv("CARGA_LATENCIA_SQL_MS", "0")) / 1000)
+    _sembrar_local([f.IDDocumentoSalida for f in filas], set())
+
+    def aplicacion(environ, start_response):
+        destino = webhook_local.app if environ.get("PATH_INFO") == "/webhook" else app.app
+        return destino(environ, start_response)
+
+    return aplicacion
+
+
+def _servir(puerto):
+    from werkzeug.serving import run_simple
+
+    run_simple("127.0.0.1", puerto, crear_aplicacion(), threaded=True)
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _elegir_servidor(servidor):
+    if servidor != "auto":
+        return servidor
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return "werkzeug"
+    return "gunicorn"
+
+
+def arrancar_servidor(servidor, puerto, directorio, args):
+    env = dict(
+        os.environ,
+        CARGA_PEDIDOS=str(args.pedidos),
+        CARGA_LATENCIA_SQL_MS=str(args.latencia_sql_ms),
+        WHATSAPP_APP_SECRET=SECRETO.decode(),
+        GUNICORN_TAREAS="0",
+        PYTHONPATH=os.pathsep.join([RAIZ, BENCHMARKS, os.environ.get("PYTHONPATH", "")]),
+    )
+    # Los logs de cada petición compiten por CPU con lo que se mide
+    env.setdefault("LOG_NIVEL", "WARNING")
+    if servidor == "gunicorn":
+        comando = [sys.executable, "-m", "gunicorn", "-c", os.path.join(RAIZ, "gunicorn.conf.py"),
+                   "--bind", f"127.0.0.1:{puerto}", "carga:crear_aplicacion()"]
+    else:
+        comando = [sys.executable, os.path.abspath(__file__), "--servir", str(puerto)]
+
+    salida = open(os.path.join(directorio, "servidor.log"), "wb")
+    proceso = subprocess.Popen(comando, cwd=directorio, env=env, stdout=salida, stderr=subprocess.STDOUT)
+    salida.close()
+    limite = time.monotonic() + ESPERA_ARRANQUE_SEG
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            break
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", puerto, timeout=5)
+            conn.request("GET", "/api/planner/delta?since=0")
+            conn.getresponse().read()
+            conn.close()
+            return proceso
+        except OSError:
+            time.sleep(0.2)
+    detener_servidor(proceso)
+    with open(os.path.join(directorio, "servidor.log"), encoding="utf-8", errors="replace") as f:
+        sys.exit(f"El servidor ({servidor}) no arrancó:\n{f.read()[-4000:]}")
+
+
+def detener_servidor(proceso):
+    if proceso.poll() is None:
+        proceso.terminate()
+        try:
+            proceso.wait(30)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+
+def _percentil(tiempos, p):
+    ordenados = sorted(tiempos)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _leer(respuesta):
+    datos = respuesta.read()
+    if respuesta.getheader("Content-Encoding") == "gzip":
+        datos = gzip.decompress(datos)
+    return datos
+
+
+class Usuario:
+    """Un navegador del piso: su conexión, su ETag del planner y su seq de delta."""
+
+    def __init__(self, numero, puerto, folios, contadores):
+        self.numero = numero
+        self.puerto = puerto
+        self.folios = folios
+        self.contadores = contadores
+        self.azar = random.Random(numero)
+        self.etag = None
+        self.seq = 0
+        self.envios = itertools.count()
+        self.conn = None
+        self.resultados = []  # (operación, estado, segundos)
+
+    def _pedir(self, metodo, ruta, cuerpo=None, encabezados=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.puerto, timeout=60)
+        encabezados = dict(encabezados or {}, **{"Accept-Encoding": "gzip"})
+        try:
+            self.conn.request(metodo, ruta, body=cuerpo, headers=encabezados)
+            respuesta = self.conn.getresponse()
+            return respuesta, _leer(respuesta)
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def _folio(self, tipo):
+        # solicitada: pendientes (i % 3 == 0); entregada: ya solicitados (i % 3 == 1)
+        candidatos = self.folios[tipo]
+        return candidatos[next(self.contadores[tipo]) % len(candidatos)]
+
+    def operar(self, operacion):
+        if operacion == "GET /planner":
+            encabezados = {"If-None-Match": self.etag} if self.etag else None
+            respuesta, datos = self._pedir("GET", "/planner", encabezados=encabezados)
+            if respuesta.status == 200:
+                self.etag = respuesta.getheader("ETag")
+                m = re.search(rb'data-seq="(\d+)"', datos)
+                self.seq = int(m.group(1)) if m else self.seq
+            return respuesta.status
+        if operacion == "GET /api/planner/delta":
+            respuesta, datos = self._pedir("GET", f"/api/planner/delta?since={self.seq}")
+            if respuesta.status == 200:
+                self.seq = json.loads(datos)["seq"]
+            return respuesta.status
+        if operacion == "GET /kpi":
+            return self._pedir("GET", "/kpi")[0].status
+        if operacion == "POST /actualizar_solicitada":
+            return self._pedir("POST", f"/actualizar_solicitada/{self._folio('solicitada')}")[0].status
+        if operacion == "POST /actualizar_entregada":
+            return self._pedir("POST", f"/actualizar_entregada/{self._folio('entregada')}")[0].status
+        cuerpo = payload_estados(3, self.numero * 10 ** 6 + next(self.envios))
+        return self._pedir("POST", "/webhook", cuerpo, {
+            "Content-Type": "application/json",
+            "X-Hub-Signature-256": firmar(cuerpo),
+        })[0].status
+
+    def correr(self, hasta):
+        operaciones, pesos = list(MEZCLA), list(MEZCLA.values())
+        while time.monotonic() < hasta:
+            operacion = self.azar.choices(operaciones, pesos)[0]
+            t0 = time.perf_counter()
+            try:
+                estado = self.operar(operacion)
+            except (OSError, http.client.HTTPException):
+                estado = 0
+            self.resultados.append((operacion, estado, time.perf_counter() - t0))
+        if self.conn is not None:
+            self.conn.close()
+
+
+def correr_escalon(usuarios, duracion, puerto, folios):
+    contadores = {tipo: itertools.count() for tipo in folios}
+    grupo = [Usuario(i, puerto, folios, contadores) for i in range(usuarios)]
+    hasta = time.monotonic() + duracion
+    hilos = [threading.Thread(target=u.correr, args=(hasta,)) for u in grupo]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    transcurrido = time.perf_counter() - inicio
+    return [r for u in grupo for r in u.resultados], transcurrido
+
+
+def _resumen(resultados, transcurrido):
+    tiempos = [t for _, _, t in resultados]
+    # 4xx esperables (entrega repetida = 409) no son fallas del servidor
+    errores = sum(1 for _, estado, _ in resultados if estado == 0 or estado >= 500)
+    return {
+        "peticiones": len(resultados),
+        "pet_por_seg": len(resultados) / transcurrido if transcurrido else 0,
+        "p50_ms": _percentil(tiempos, 50) * 1000 if tiempos else 0,
+        "p95_ms": _percentil(tiempos, 95) * 1000 if tiempos else 0,
+        "p99_ms": _percentil(tiempos, 99) * 1000 if tiempos else 0,
+        "errores": errores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", default="5,10,25,50", help="escalones de usuarios concurrentes")
+    parser.add_argument("--duracion", type=float, default=20, help="segundos por escalón")
+    parser.add_argument("--pedidos", type=int, default=5000, help="pedidos del día en el SQL Server falso")
+    parser.add_argument("--latencia-sql-ms", type=float, default=0.0,
+                        help="latencia simulada por consulta a SQL Server")
+    parser.add_argument("--servidor", choices=("auto", "gunicorn", "werkzeug"), default="auto")
+    parser.add_argument("--objetivo-p95-ms", type=float, default=500)
+    parser.add_argument("--pet-por-usuario-piso", type=float, default=0.1,
+                        help="peticiones/s de una persona real con el planner abierto")
+    parser.add_argument("--json", action="store_true", help="imprime los resultados en JSON")
+    parser.add_argument("--servir", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        _servir(args.servir)
+        return
+
+    from dobles import generar_filas
+
+    todos = [f.IDDocumentoSalida for f in generar_filas(args.pedidos)]
+    folios = {"solicitada": todos[0::3], "entregada": todos[1::3]}
+    servidor = _elegir_servidor(args.servidor)
+    puerto = _puerto_libre()
+
+    escalones = []
+    directorio = tempfile.mkdtemp(prefix="carga_")
+    proceso = arrancar_servidor(servidor, puerto, directorio, args)
+    try:
+        for usuarios in (int(x) for x in args.usuarios.split(",")):
+            resultados, transcurrido = correr_escalon(usuarios, args.duracion, puerto, folios)
+            operaciones = {}
+            for operacion in MEZCLA:
+                propios = [r for r in resultados if r[0] == operacion]
+                operaciones[operacion] = _resumen(propios, transcurrido)
+            escalones.append({"usuarios": usuarios, **_resumen(resultados, transcurrido), "operaciones": operaciones})
+    finally:
+        detener_servidor(proceso)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    aceptables = [e for e in escalones if e["errores"] == 0 and e["p95_ms"] <= args.objetivo_p95_ms]
+    capacidad = max(aceptables, key=lambda e: e["usuarios"], default=None)
+    resumen = {
+        "servidor": servidor,
+        "pedidos": args.pedidos,
+        "escalones": escalones,
+        "capacidad_usuarios": capacidad["usuarios"] if capacidad else None,
+        "capacidad_usuarios_piso": int(capacidad["pet_por_seg"] / args.pet_por_usuario_piso) if capacidad else None,
+    }
+    if args.json:
+        print(json.dumps(resumen, indent=2))
+        return
+
+    print(f"\n== {servidor}, {args.pedidos:,} pedidos, {args.duracion:g} s por escalón")
+    print(f"{'usuarios':>9}{'pet/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}")
+    for e in escalones:
+        print(f"{e['usuarios']:>9}{e['pet_por_seg']:>10.0f}{e['p50_ms']:>10.1f}"
+              f"{e['p95_ms']:>10.1f}{e['p99_ms']:>10.1f}{e['errores']:>9}")
+
+    ultimo = escalones[-1]
+    print(f"\n-- por operación con {ultimo['usuarios']} usuarios")
+    print(f"{'operación':<30}{'pet/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errores':>9}")
+    for nombre, m in ultimo["operaciones"].items():
+        print(f"{nombre:<30}{m['pet_por_seg']:>10.0f}{m['p50_ms']:>10.1f}{m['p95_ms']:>10.1f}{m['errores']:>9}")
+
+    if capacidad:
+        print(f"\nCapacidad: {capacidad['usuarios']} usuarios sin pausa con p95 ≤ {args.objetivo_p95_ms:g} ms "
+              f"({capacidad['pet_por_seg']:.0f} pet/s ≈ {resumen['capacidad_usuarios_piso']:,} usuarios de piso "
+              f"a {args.pet_por_usuario_piso:g} pet/s)")
+    else:
+        print(f"\nNingún escalón cumple p95 ≤ {args.objetivo_p95_ms:g} ms sin errores")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Dobles de prueba para los benchmarks: un engine en proceso que imita a SQL Server
+(DOCUMENTOSALIDA ⋈ DETALLEEMBARQUE ya filtrado) y un servidor HTTP que imita
+la Graph API de WhatsApp.
+"""
+import bisect
+import itertools
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FilaWMS = namedtuple("FilaWMS", "IDDocumentoSalida FechaHoraRegistro")
+
+SUFIJOS = ("F1", "F1X", "F2")
+
+
+def generar_filas(n, hasta=None, dias=1, inicio_folio=500000):
+    """n pedidos repartidos en 'dias' días que terminan en 'hasta', del más nuevo al más viejo."""
+    hasta = hasta or datetime.now().replace(microsecond=0)
+    paso = timedelta(days=dias) / max(n, 1)
+    return [
+        FilaWMS(f"OV-{inicio_folio + i}-{SUFIJOS[i % 3]}", hasta - paso * i)
+        for i in range(n)
+    ]
+
+
+class _Resultado:
+    def __init__(self, filas):
+        self._filas = filas
+        self._pos = 0
+
+    def fetchall(self):
+        filas = self._filas[self._pos:]
+        self._pos = len(self._filas)
+        return filas
+
+    def fetchmany(self, n):
+        filas = self._filas[self._pos:self._pos + n]
+        self._pos += len(filas)
+        return filas
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._pos = len(self._filas)
+
+
+class _Conexion:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execution_options(self, **opciones):
+        return self
+
+    def exec_driver_sql(self, sql, *args, **kwargs):
+        return _Resultado([])
+
+    def execute(self, query, params=None):
+        if self.engine.caido:
+            raise ConnectionError("SQL Server no disponible (doble de prueba)")
+        if self.engine.latencia:
+            time.sleep(self.engine.latencia)
+        params = params or {}
+        return _Resultado(self.engine.filtrar(params.get("inicio"), params.get("fin")))
+
+
+class EngineFalso:
+    """
+    Imita lo que get_pedidos usa de un Engine de SQLAlchemy. Filtra por fecha
+    (YYYY-MM-DD, inclusivo) y devuelve las filas ordenadas por FechaHoraRegistro DESC.
+    """
+
+    def __init__(self, filas, latencia=0.0):
+        self.filas = sorted(filas, key=lambda f: f.FechaHoraRegistro, reverse=True)
+        self._claves = [-f.FechaHoraRegistro.timestamp() for f in self.filas]
+        self.latencia = latencia
+        self.caido = False
+
+    def filtrar(self, inicio, fin):
+        desde = datetime.strptime(fin, "%Y-%m-%d") + timedelta(days=1)
+        hasta = datetime.strptime(inicio, "%Y-%m-%d")
+        i = bisect.bisect_right(self._claves, -desde.timestamp())
+        j = bisect.bisect_right(self._claves, -hasta.timestamp())
+        return self.filas[i:j]
+
+    def connect(self):
+        return _Conexion(self)
+
+    def dispose(self, close=True):
+        pass
+
+
+class GraphAPIFalsa:
+    """Servidor HTTP local que responde como POST /{phone_id}/messages de la Graph API."""
+
+    def __init__(self, latencia=0.0):
+        contador = itertools.count(1)
+        self.recibidos = 0
+
+        doble = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if latencia:
+                    time.sleep(latencia)
+                doble.recibidos += 1
+                cuerpo = json.dumps({
+                    "messaging_product": "whatsapp",
+                    "messages": [{"id": f"wamid.falso{next(contador)}", "message_status": "accepted"}],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.url = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
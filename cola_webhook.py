@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from entregas_whatsapp import init_entregas_db, aplicar_estados
+from firma_webhook import VentanaRepeticion
+from metricas import Contador, Histograma, Medidor
+from registro import obtener_logger
+
+log = obtener_logger("cola_webhook")
+
+
+# ------------------------------------------------------
+# COLA DURABLE DE WEBHOOKS (SQLite)
+# ------------------------------------------------------
+# El endpoint /webhook solo guarda el cuerpo crudo y responde 200 de inmediato;
+# un hilo consumidor vacía la cola por lotes y extrae estados y mensajes.
+WEBHOOK_DB = os.getenv("WEBHOOK_DB", "webhook_local.db")
+TAMANO_LOTE = int(os.getenv("WEBHOOK_TAMANO_LOTE", "200"))
+
+_local = threading.local()
+_hay_trabajo = threading.Event()
+
+METRICA_WEBHOOKS = Contador(
+    "recsolog_webhooks_total", "Webhooks POST recibidos por resultado", ("resultado",))
+METRICA_EVENTOS = Contador(
+    "recsolog_webhook_eventos_total", "Eventos extraídos de los webhooks por tipo", ("tipo",))
+METRICA_LOTE_SEGUNDOS = Histograma(
+    "recsolog_webhook_lote_segundos", "Duración del procesamiento de un lote de la cola")
+
+# Descarta callbacks repetidos del mismo mensaje y estado (ventana por wamid)
+_estados_vistos = VentanaRepeticion()
+
+
+def _conectar():
+    conn = sqlite3.connect(WEBHOOK_DB, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _conexion_hilo():
+    """Una conexión por hilo para no abrir el archivo en cada webhook."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _conectar()
+    return conn
+
+
+def init_cola():
+    """Crea las tablas de la cola y de los eventos ya procesados."""
+    conn = _conectar()
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS cola_webhook (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recibido_en REAL NOT NULL,
+            cuerpo BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS webhook_estados (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            wamid TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            timestamp INTEGER,
+            destinatario TEXT,
+            errores TEXT,
+            recibido_en REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_webhook_estados_wamid ON webhook_estados (wamid);
+        CREATE TABLE IF NOT EXISTS webhook_mensajes (
+            wamid TEXT PRIMARY KEY,
+            remitente TEXT,
+            tipo TEXT,
+            texto TEXT,
+            timestamp INTEGER,
+            recibido_en REAL NOT NULL
+        );
+    """)
+    conn.close()
+
+
+def encolar(cuerpo):
+    """Guarda el cuerpo crudo del webhook. Es lo único que se hace en la petición."""
+    _conexion_hilo().execute(
+        "INSERT INTO cola_webhook (recibido_en, cuerpo) VALUES (?, ?)",
+        (time.time(), cuerpo)
+    )
+    _hay_trabajo.set()
+
+
+def profundidad_cola():
+    return _conexion_hilo().execute("SELECT COUNT(*) FROM cola_webhook").fetchone()[0]
+
+
+METRICA_PROFUNDIDAD = Medidor(
+    "recsolog_webhook_cola_profundidad", "Webhooks en cola sin procesar", funcion=profundidad_cola)
+
+
+# ------------------------------------------------------
+# EXTRACCIÓN DE ESTADOS Y MENSAJES
+# ------------------------------------------------------
+def extraer_eventos(cuerpo):
+    """Devuelve (estados, mensajes) de un payload de WhatsApp Cloud API."""
+    data = json.loads(cuerpo)
+    estados, mensajes = [], []
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for s in value.get("statuses", []):
+                estados.append({
+                    "wamid": s.get("id"),
+                    "estado": s.get("status"),
+                    "timestamp": int(s["timestamp"]) if s.get("timestamp") else None,
+                    "destinatario": s.get("recipient_id"),
+                    "errores": json.dumps(s["errors"]) if s.get("errors") else None,
+                })
+            for m in value.get("messages", []):
+                mensajes.append({
+                    "wamid": m.get("id"),
+                    "remitente": m.get("from"),
+                    "tipo": m.get("type"),
+                    "texto": (m.get("text") or {}).get("body"),
+                    "timestamp": int(m["timestamp"]) if m.get("timestamp") else None,
+                })
+    return estados, mensajes
+
+
+def procesar_lote(conn):
+    """
+    Toma hasta TAMANO_LOTE webhooks de la cola, los procesa y los borra en una
+    sola transacción: si el proceso muere a la mitad, o no se pueden aplicar
+    los estados a entregas_whatsapp.db, el lote sigue en la cola y se reintenta
+    (aplicar un estado dos veces no cambia nada).
+    Devuelve cuántos webhooks se procesaron.
+    """
+    inicio = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        filas = conn.execute(
+            "SELECT id, recibido_en, cuerpo FROM cola_webhook ORDER BY id LIMIT ?",
+            (TAMANO_LOTE,)
+        ).fetchall()
+        if not filas:
+            conn.execute("COMMIT")
+            return 0
+
+        estados, mensajes = [], []
+        for id_cola, recibido_en, cuerpo in filas:
+            try:
+                e, m = extraer_eventos(cuerpo)
+            except (ValueError, AttributeError, KeyError, TypeError) as ex:
+                METRICA_EVENTOS.inc(tipo="invalido")
+                log.warning("⚠️ Webhook %s descartado, payload inválido: %s", id_cola, ex)
+                continue
+            estados.extend(
+                dict(x, recibido_en=recibido_en) for x in e
+                if not _estados_vistos.visto((x["wamid"], x["estado"]))
+            )
+            mensajes.extend(dict(x, recibido_en=recibido_en) for x in m)
+
+        conn.executemany("""
+            INSERT INTO webhook_estados (wamid, estado, timestamp, destinatario, errores, recibido_en)
+            VALUES (:wamid, :estado, :timestamp, :destinatario, :errores, :recibido_en)
+        """, estados)
+        conn.executemany("""
+            INSERT OR IGNORE INTO webhook_mensajes (wamid, remitente, tipo, texto, timestamp, recibido_en)
+            VALUES (:wamid, :remitente, :tipo, :texto, :timestamp, :recibido_en)
+        """, mensajes)
+        # Correlaciona los estados con los mensajes enviados desde app.py antes de borrar el lote
+        aplicar_estados(estados)
+        conn.execute("DELETE FROM cola_webhook WHERE id <= ?", (filas[-1][0],))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    _estados_vistos.registrar((x["wamid"], x["estado"]) for x in estados)
+    METRICA_EVENTOS.inc(len(estados), tipo="estado")
+    METRICA_EVENTOS.inc(len(mensajes), tipo="mensaje")
+    METRICA_LOTE_SEGUNDOS.observe(time.perf_counter() - inicio)
+    if mensajes:
+        log.info("💬 %d mensajes entrantes registrados.", len(mensajes), extra={"muestra": 20})
+    return len(filas)
+
+
+def consumir_periodicamente(espera=1.0):
+    """Hilo consumidor: vacía la cola por lotes y duerme cuando no hay trabajo."""
+    conn = _conectar()
+    while True:
+        try:
+            _hay_trabajo.clear()
+            if procesar_lote(conn) < TAMANO_LOTE:
+                _hay_trabajo.wait(espera)
+        except Exception as e:
+            log.exception("⚠️ Error procesando la cola de webhooks: %s", e)
+            time.sleep(espera)
+
+
+_consumidor = None
+_consumidor_lock = threading.Lock()
+
+
+def iniciar_consumidor():
+    """Inicializa la cola y arranca el hilo consumidor una sola vez por proceso."""
+    global _consumidor
+    if _consumidor is not None:
+        return
+    with _consumidor_lock:
+        if _consumidor is None:
+            init_cola()
+            init_entregas_db()
+            _consumidor = threading.Thread(target=consumir_periodicamente, daemon=True)
+            _consumidor.start()
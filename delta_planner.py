@@ -0,0 +1,69 @@
+# ------------------------------------------------------
+# SECUENCIA DE CAMBIOS DEL PLANNER (local_data.db)
+# ------------------------------------------------------
+# Cada alta o cambio de estado en 'pedidos' (sincronizador, solicitada,
+# entregada, recálculos de SLA) toma el siguiente número de planner_secuencia
+# y lo deja en pedidos.seq, desde triggers: ningún escritor puede olvidarlo.
+# Como SQLite serializa a los escritores, el orden de seq es el orden de
+# confirmación, y /api/planner/delta?since=N devuelve solo lo cambiado
+# después de N para que la página aplique parches en lugar de recargar.
+COLUMNAS = ("pedido", "fecha_solicitada", "hora_limite", "fecha_entregada", "cumplimiento")
+MAX_DELTA = 500
+
+_SQL_SIGUIENTE = """
+    UPDATE planner_secuencia SET valor = valor + 1 WHERE id = 1;
+    UPDATE pedidos SET seq = (SELECT valor FROM planner_secuencia WHERE id = 1) WHERE pedido = NEW.pedido;
+"""
+
+_TRIGGERS_SECUENCIA = {
+    "trg_planner_seq_insert": f"AFTER INSERT ON pedidos BEGIN {_SQL_SIGUIENTE} END",
+    "trg_planner_seq_update": (
+        f"AFTER UPDATE OF {', '.join(COLUMNAS[1:])} ON pedidos BEGIN {_SQL_SIGUIENTE} END"
+    ),
+}
+
+
+def init_secuencia(conn):
+    """Columna seq, contador y triggers (idempotente)."""
+    columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(pedidos)")}
+    if "seq" not in columnas:
+        conn.execute("ALTER TABLE pedidos ADD COLUMN seq INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_seq ON pedidos (seq)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS planner_secuencia (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            valor INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO planner_secuencia (id, valor) VALUES (1, 0)")
+    for nombre, cuerpo in _TRIGGERS_SECUENCIA.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nombre} {cuerpo}")
+    conn.commit()
+
+
+def secuencia_actual(conn):
+    fila = conn.execute("SELECT valor FROM planner_secuencia WHERE id = 1").fetchone()
+    return fila[0] if fila else 0
+
+
+def cambios_desde(conn, desde, limite=MAX_DELTA):
+    """
+    {"seq", "pedidos", "mas", "reiniciar"}: hasta 'limite' pedidos con seq > desde
+    en orden de cambio. 'seq' es el valor para la siguiente consulta; con 'mas'
+    quedan cambios por pedir, con 'reiniciar' el cliente debe recargar todo
+    (la secuencia está detrás de 'desde': base restaurada o reemplazada).
+    """
+    if secuencia_actual(conn) < desde:
+        return {"seq": 0, "pedidos": [], "mas": False, "reiniciar": True}
+    filas = conn.execute(
+        f"SELECT {', '.join(COLUMNAS)}, seq FROM pedidos WHERE seq > ? ORDER BY seq LIMIT ?",
+        (desde, limite + 1)
+    ).fetchall()
+    mas = len(filas) > limite
+    filas = filas[:limite]
+    return {
+        "seq": filas[-1][-1] if filas else desde,
+        "pedidos": [dict(zip(COLUMNAS, fila)) for fila in filas],
+        "mas": mas,
+        "reiniciar": False,
+    }
@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+from datetime import datetime
+
+
+# ------------------------------------------------------
+# SEGUIMIENTO DE ENTREGA DE MENSAJES DE WHATSAPP
+# ------------------------------------------------------
+# app.py registra el id (wamid) que devuelve la Graph API junto con el folio;
+# el consumidor de webhooks actualiza el estado con los callbacks de Meta.
+# Ambos procesos deben apuntar al mismo archivo (ENTREGAS_DB). Un callback
+# puede llegar antes de que app.py registre su wamid: queda en
+# estados_sin_mensaje y se aplica al registrarse el mensaje (los que nunca
+# encuentran mensaje se borran tras DIAS_SIN_MENSAJE).
+ENTREGAS_DB = os.getenv("ENTREGAS_DB", "entregas_whatsapp.db")
+DIAS_SIN_MENSAJE = 7
+
+# Meta manda sus timestamps en segundos enteros (truncados) y enviado_en es el
+# reloj local antes del POST: las latencias tienen resolución de 1 s y una
+# diferencia negativa (entrega en el mismo segundo) cuenta como 0.
+RESOLUCION_SEG = 1
+
+# Orden de avance de los estados; 'failed' siempre gana.
+RANGO_ESTADOS = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+_RANGO_ACTUAL = "CASE estado {} ELSE 0 END".format(
+    " ".join(f"WHEN '{estado}' THEN {rango}" for estado, rango in RANGO_ESTADOS.items())
+)
+
+_SQL_APLICAR_ESTADO = f"""
+    UPDATE mensajes_enviados SET
+        estado = CASE WHEN :rango > {_RANGO_ACTUAL} THEN :estado ELSE estado END,
+        entregado_en = CASE WHEN :estado IN ('delivered', 'read')
+            THEN COALESCE(entregado_en, :ts) ELSE entregado_en END,
+        leido_en = CASE WHEN :estado = 'read' THEN COALESCE(leido_en, :ts) ELSE leido_en END,
+        fallido_en = CASE WHEN :estado = 'failed' THEN COALESCE(fallido_en, :ts) ELSE fallido_en END,
+        error = COALESCE(:error, error)
+    WHERE wamid = :wamid
+"""
+
+
+def _conectar():
+    conn = sqlite3.connect(ENTREGAS_DB, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def init_entregas_db():
+    conn = _conectar()
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS mensajes_enviados (
+            wamid TEXT PRIMARY KEY,
+            folio TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'accepted',
+            enviado_en REAL NOT NULL,
+            entregado_en REAL,
+            leido_en REAL,
+            fallido_en REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_mensajes_folio ON mensajes_enviados (folio);
+        CREATE INDEX IF NOT EXISTS idx_mensajes_estado_enviado ON mensajes_enviados (estado, enviado_en);
+        CREATE TABLE IF NOT EXISTS estados_sin_mensaje (
+            wamid TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            rango INTEGER NOT NULL,
+            ts REAL,
+            error TEXT,
+            recibido_en REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_estados_sin_mensaje_wamid ON estados_sin_mensaje (wamid);
+    """)
+    conn.commit()
+    conn.close()
+
+
+def registrar_mensaje_enviado(wamid, folio, enviado_en=None):
+    """
+    Guarda el id devuelto por la Graph API contra el folio notificado (y aplica
+    estados adelantados). enviado_en: epoch de justo antes del POST (por defecto, ahora).
+    """
+    conn = _conectar()
+    conn.row_factory = sqlite3.Row
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO mensajes_enviados (wamid, folio, enviado_en) VALUES (?, ?, ?)",
+            (wamid, folio, enviado_en or time.time())
+        )
+        adelantados = conn.execute(
+            "SELECT wamid, estado, rango, ts, error FROM estados_sin_mensaje WHERE wamid = ? ORDER BY ts",
+            (wamid,)
+        ).fetchall()
+        if adelantados:
+            conn.executemany(_SQL_APLICAR_ESTADO, [dict(e) for e in adelantados])
+            conn.execute("DELETE FROM estados_sin_mensaje WHERE wamid = ?", (wamid,))
+    conn.close()
+
+
+def aplicar_estados(estados):
+    """
+    Aplica los callbacks de estado (dicts con wamid, estado, timestamp, errores)
+    a los mensajes enviados en una transacción. Un estado nunca retrocede (p. ej.
+    'delivered' que llega después de 'read'); los de un wamid aún no registrado
+    quedan en estados_sin_mensaje.
+    """
+    filas = [
+        {
+            "wamid": e["wamid"],
+            "estado": e["estado"],
+            "rango": RANGO_ESTADOS.get(e["estado"], 0),
+            "ts": e["timestamp"] or e.get("recibido_en") or time.time(),
+            "error": e.get("errores"),
+        }
+        for e in estados if e.get("wamid") and e.get("estado")
+    ]
+    if not filas:
+        return
+    ahora = time.time()
+    conn = _conectar()
+    try:
+        with conn:
+            conn.executemany(_SQL_APLICAR_ESTADO, filas)
+            # Los que aún no tienen mensaje se guardan para registrar_mensaje_enviado
+            conn.executemany("""
+                INSERT INTO estados_sin_mensaje (wamid, estado, rango, ts, error, recibido_en)
+                SELECT :wamid, :estado, :rango, :ts, :error, :ahora
+                WHERE NOT EXISTS (SELECT 1 FROM mensajes_enviados WHERE wamid = :wamid)
+            """, [dict(f, ahora=ahora) for f in filas])
+            conn.execute(
+                "DELETE FROM estados_sin_mensaje WHERE recibido_en < ?", (ahora - DIAS_SIN_MENSAJE * 86400,)
+            )
+    finally:
+        conn.close()
+
+
+def _fmt(epoch):
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S") if epoch else None
+
+
+def estado_folio(folio):
+    """Mensajes enviados para un folio con su estado de entrega."""
+    conn = _conectar()
+    conn.row_factory = sqlite3.Row
+    filas = conn.execute("""
+        SELECT wamid, estado, enviado_en, entregado_en, leido_en, fallido_en, error
+        FROM mensajes_enviados WHERE folio = ? ORDER BY enviado_en
+    """, (folio,)).fetchall()
+    conn.close()
+    return [
+        {
+            "wamid": f["wamid"],
+            "estado": f["estado"],
+            "enviado_en": _fmt(f["enviado_en"]),
+            "entregado_en": _fmt(f["entregado_en"]),
+            "leido_en": _fmt(f["leido_en"]),
+            "fallido_en": _fmt(f["fallido_en"]),
+            "segundos_a_entrega": max(round(f["entregado_en"] - f["enviado_en"], 3), 0) if f["entregado_en"] else None,
+            "error": f["error"],
+        }
+        for f in filas
+    ]
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    i = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return round(ordenados[i], 3)
+
+
+def resumen_latencias(desde, hasta):
+    """
+    Conteo por estado y percentiles (segundos, resolución RESOLUCION_SEG) de
+    envío→entrega y envío→lectura.
+    """
+    conn = _conectar()
+    conteos = dict(conn.execute("""
+        SELECT estado, COUNT(*) FROM mensajes_enviados
+        WHERE enviado_en BETWEEN ? AND ? GROUP BY estado
+    """, (desde, hasta)).fetchall())
+    entrega = [r[0] for r in conn.execute("""
+        SELECT MAX(entregado_en - enviado_en, 0) AS s FROM mensajes_enviados
+        WHERE enviado_en BETWEEN ? AND ? AND entregado_en IS NOT NULL ORDER BY s
+    """, (desde, hasta))]
+    lectura = [r[0] for r in conn.execute("""
+        SELECT MAX(leido_en - enviado_en, 0) AS s FROM mensajes_enviados
+        WHERE enviado_en BETWEEN ? AND ? AND leido_en IS NOT NULL ORDER BY s
+    """, (desde, hasta))]
+    conn.close()
+
+    return {
+        "total": sum(conteos.values()),
+        "por_estado": conteos,
+        "resolucion_seg": RESOLUCION_SEG,
+        "entrega_seg": {
+            "n": len(entrega),
+            "p50": _percentil(entrega, 50),
+            "p90": _percentil(entrega, 90),
+            "p99": _percentil(entrega, 99),
+        },
+        "lectura_seg": {
+            "n": len(lectura),
+            "p50": _percentil(lectura, 50),
+            "p90": _percentil(lectura, 90),
+            "p99": _percentil(lectura, 99),
+        },
+    }
@@ -0,0 +1,68 @@
+import os
+import hmac
+import time
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+
+# ------------------------------------------------------
+# VERIFICACIÓN DE FIRMA (X-Hub-Signature-256) Y VENTANA ANTI-REPETICIÓN
+# ------------------------------------------------------
+# Meta firma el cuerpo crudo con HMAC-SHA256 usando el App Secret.
+# La firma se calcula sobre los bytes tal como llegaron, sin parsear el JSON.
+# Sin WHATSAPP_APP_SECRET el webhook rechaza todo, salvo que se desactive la
+# verificación a propósito con WEBHOOK_SIN_FIRMA=1 (solo pruebas locales).
+WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
+WEBHOOK_SIN_FIRMA = os.getenv("WEBHOOK_SIN_FIRMA") == "1"
+VENTANA_REPETICION_SEG = int(os.getenv("WEBHOOK_VENTANA_REPETICION_SEG", "300"))
+VENTANA_REPETICION_MAX = int(os.getenv("WEBHOOK_VENTANA_REPETICION_MAX", "10000"))
+
+_PREFIJO = "sha256="
+
+
+def firma_valida(cuerpo, encabezado, secreto):
+    """True si 'encabezado' (sha256=<hex>) es el HMAC de 'cuerpo' con 'secreto' (bytes)."""
+    if not encabezado or not encabezado.startswith(_PREFIJO):
+        return False
+    esperado = hmac.new(secreto, cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperado, encabezado[len(_PREFIJO):])
+
+
+class VentanaRepeticion:
+    """
+    LRU acotado de claves vistas en los últimos 'segundos'. ya_visto() registra
+    la clave y devuelve True si ya había llegado dentro de la ventana.
+    """
+
+    def __init__(self, segundos=VENTANA_REPETICION_SEG, maximo=VENTANA_REPETICION_MAX):
+        self.segundos = segundos
+        self.maximo = maximo
+        self._vistos = OrderedDict()
+        self._lock = Lock()
+
+    def visto(self, clave):
+        """True si la clave llegó dentro de la ventana (no la registra)."""
+        visto_en = self._vistos.get(clave)
+        return visto_en is not None and time.monotonic() - visto_en <= self.segundos
+
+    def registrar(self, claves):
+        with self._lock:
+            self._registrar(claves, time.monotonic())
+
+    def ya_visto(self, clave):
+        with self._lock:
+            if self.visto(clave):
+                return True
+            self._registrar((clave,), time.monotonic())
+            return False
+
+    def _registrar(self, claves, ahora):
+        for clave in claves:
+            self._vistos[clave] = ahora
+            self._vistos.move_to_end(clave)
+        while len(self._vistos) > self.maximo:
+            self._vistos.popitem(last=False)
+
+    def __len__(self):
+        return len(self._vistos)
@@ -0,0 +1,200 @@
+import os
+import re
+import sqlite3
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from datetime import datetime, timedelta
+
+
+# ------------------------------------------------------
+# FOLIOS COMPACTOS Y FOLIOS YA NOTIFICADOS POR DÍA
+# ------------------------------------------------------
+# Un folio 'OV-533381-F1X' se guarda como un entero: número << 2 | código de
+# sufijo (F1=1, F1X=2, F2=3). Los que no siguen ese patrón se quedan como
+# texto. folios_vistos (en pedidos_local.db) guarda por día los folios ya
+# notificados; el sincronizador los carga una vez al arrancar y consulta en
+# memoria, en lugar de ir a SQLite por cada folio tras cada reinicio.
+FOLIOS_DB = os.getenv("FOLIOS_DB", "pedidos_local.db")
+DIAS_CONSERVADOS = 7
+
+SUFIJOS = {"F1": 1, "F1X": 2, "F2": 3}
+SUFIJOS_POR_CODIGO = {codigo: sufijo for sufijo, codigo in SUFIJOS.items()}
+_PATRON = re.compile(r"OV-([1-9]\d{0,14})-(F1X|F1|F2)")
+
+
+def codificar(folio):
+    """Entero que representa al folio, o None si no tiene la forma OV-<número>-<sufijo>."""
+    m = _PATRON.fullmatch(folio)
+    if m is None:
+        return None
+    return int(m.group(1)) << 2 | SUFIJOS[m.group(2)]
+
+
+def decodificar(clave):
+    return f"OV-{clave >> 2}-{SUFIJOS_POR_CODIGO[clave & 3]}"
+
+
+def clave_de(folio):
+    """Clave para guardar: el entero si se puede codificar, si no el propio texto."""
+    clave = codificar(folio)
+    return folio if clave is None else clave
+
+
+class ConjuntoFolios:
+    """Conjunto de folios en un arreglo ordenado de enteros de 8 bytes (más un set para los raros)."""
+
+    __slots__ = ("_claves", "_otros")
+
+    def __init__(self, claves=()):
+        enteros = sorted({c for c in claves if isinstance(c, int)})
+        self._claves = array("q", enteros)
+        self._otros = {c for c in claves if not isinstance(c, int)}
+
+    def __contains__(self, folio):
+        clave = codificar(folio)
+        if clave is None:
+            return folio in self._otros
+        i = bisect_left(self._claves, clave)
+        return i < len(self._claves) and self._claves[i] == clave
+
+    def __len__(self):
+        return len(self._claves) + len(self._otros)
+
+    def agregar(self, folios):
+        nuevos = set()
+        for folio in folios:
+            clave = codificar(folio)
+            if clave is None:
+                self._otros.add(folio)
+            else:
+                nuevos.add(clave)
+        if nuevos:
+            self._claves = array("q", sorted(nuevos.union(self._claves)))
+
+
+def _conectar():
+    return sqlite3.connect(FOLIOS_DB, timeout=10)
+
+
+def _hoy():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def init_folios_db():
+    """Crea folios_vistos, borra días viejos y, si hoy está vacío, lo llena con los envíos de hoy."""
+    conn = _conectar()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS folios_vistos (
+            dia TEXT NOT NULL,
+            clave NOT NULL,
+            PRIMARY KEY (dia, clave)
+        ) WITHOUT ROWID
+    """)
+    limite = (datetime.now() - timedelta(days=DIAS_CONSERVADOS)).strftime("%Y-%m-%d")
+    conn.execute("DELETE FROM folios_vistos WHERE dia < ?", (limite,))
+
+    hoy = _hoy()
+    if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM folios_vistos WHERE dia = ?)", (hoy,)).fetchone()[0]:
+        # Envíos de hoy registrados antes de existir esta tabla
+        try:
+            enviados = conn.execute(
+                "SELECT folio FROM pedidos_local WHERE fecha_envio >= ?", (hoy,)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            enviados = []
+        conn.executemany(
+            "INSERT OR IGNORE INTO folios_vistos (dia, clave) VALUES (?, ?)",
+            [(hoy, clave_de(f)) for f, in enviados]
+        )
+    conn.commit()
+    conn.close()
+
+
+class VistosHoy:
+    """Folios notificados hoy: en memoria y persistidos en folios_vistos."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._dia = None
+        self._conjunto = None
+
+    def _cargar(self):
+        hoy = _hoy()
+        if self._dia != hoy:
+            conn = _conectar()
+            claves = [c for c, in conn.execute("SELECT clave FROM folios_vistos WHERE dia = ?", (hoy,))]
+            conn.close()
+            self._conjunto = ConjuntoFolios(claves)
+            self._dia = hoy
+        return self._conjunto
+
+    def no_vistos(self, folios):
+        """Los folios que aún no se notificaron hoy, sin consultar SQLite (salvo al cambiar de día)."""
+        with self._lock:
+            conjunto = self._cargar()
+            return [f for f in folios if f not in conjunto]
+
+    def registrar(self, folios):
+        """Marca los folios como notificados hoy (en memoria y en disco, en una transacción)."""
+        folios = list(folios)
+        if not folios:
+            return
+        with self._lock:
+            conjunto = self._cargar()
+            conn = _conectar()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO folios_vistos (dia, clave) VALUES (?, ?)",
+                    [(self._dia, clave_de(f)) for f in folios]
+                )
+            conn.close()
+            conjunto.agregar(folios)
+
+
+# ------------------------------------------------------
+# REGISTRO COMPACTO DE PEDIDO
+# ------------------------------------------------------
+# Lo que viaja de SQL Server al planner, al Excel y a los KPIs: el folio ya
+# codificado y las cuatro columnas de local_data.db, sin un dict por fila.
+# Jinja lee los atributos igual que las claves de un dict (factura.pedido).
+COLUMNAS_PEDIDO = ("fecha_solicitada", "hora_limite", "fecha_entregada", "cumplimiento")
+
+
+class Pedido:
+    __slots__ = ("clave",) + COLUMNAS_PEDIDO
+
+    def __init__(self, folio, fecha_solicitada=None, hora_limite=None, fecha_entregada=None,
+                 cumplimiento="Pendiente"):
+        self.clave = clave_de(folio)
+        self.fecha_solicitada = fecha_solicitada
+        self.hora_limite = hora_limite
+        self.fecha_entregada = fecha_entregada
+        self.cumplimiento = cumplimiento or "Pendiente"
+
+    @property
+    def pedido(self):
+        return decodificar(self.clave) if isinstance(self.clave, int) else self.clave
+
+    def con_estado(self, fecha_solicitada=None, hora_limite=None, fecha_entregada=None, cumplimiento="Pendiente"):
+        """Copia con otro estado, reutilizando la clave ya codificada (sin volver a analizar el folio)."""
+        copia = Pedido.__new__(Pedido)
+        copia.clave = self.clave
+        copia.fecha_solicitada = fecha_solicitada
+        copia.hora_limite = hora_limite
+        copia.fecha_entregada = fecha_entregada
+        copia.cumplimiento = cumplimiento or "Pendiente"
+        return copia
+
+    def __repr__(self):
+        return f"Pedido({self.pedido!r}, {self.cumplimiento!r})"
+
+
+def combinar(pedidos, estado_local):
+    """
+    Copias de 'pedidos' (Pedido de SQL Server) con su estado de local_data.db
+    ({pedido: (solicitada, límite, entregada, cumplimiento)}). No se copian
+    en su lugar: los de SQL Server pueden venir del cache compartido.
+    """
+    vacio = (None, None, None, "Pendiente")
+    return [p.con_estado(*estado_local.get(p.pedido, vacio)) for p in pedidos]
@@ -0,0 +1,73 @@
+import os
+from threading import Lock
+from collections import OrderedDict
+from operator import attrgetter, itemgetter
+
+from markupsafe import Markup
+
+
+# ------------------------------------------------------
+# FRAGMENTOS DE FILA CACHEADOS (PLANNER Y REPORTE)
+# ------------------------------------------------------
+# Cada fila de tabla se renderiza una vez con su macro de _filas.html y se
+# guarda como HTML listo; la página se arma uniendo fragmentos y solo se
+# renderizan las filas que cambiaron. La clave de una fila es su folio con
+# los valores que muestra (su versión): cualquier cambio de estado, por la vía
+# que sea, da una clave nueva y la vieja sale cuando el cache se llena (por
+# orden de llegada: mover cada acierto al final costaría tanto como renderizar
+# la fila). Al recargarse la plantilla (modo debug) se descarta todo.
+FRAGMENTOS_MAX = int(os.getenv("FRAGMENTOS_MAX", "20000"))
+PLANTILLA = "_filas.html"
+
+
+class CacheFragmentos:
+    """Fragmentos HTML por clave, hasta 'maximo'; un solo lock por página, no por fila."""
+
+    def __init__(self, maximo=FRAGMENTOS_MAX):
+        self.maximo = maximo
+        self._fragmentos = OrderedDict()
+        self._lock = Lock()
+        self._plantilla = None
+
+    def __len__(self):
+        return len(self._fragmentos)
+
+    def unir(self, jinja_env, macro, elementos, clave):
+        """HTML de todos los 'elementos' con 'macro', reutilizando los ya renderizados."""
+        plantilla = jinja_env.get_template(PLANTILLA)
+        claves = list(map(clave, elementos))
+        with self._lock:
+            if plantilla is not self._plantilla:
+                self._fragmentos.clear()
+                self._plantilla = plantilla
+            partes = list(map(self._fragmentos.get, claves))
+
+        faltantes = [i for i, parte in enumerate(partes) if parte is None]
+        if faltantes:
+            renderizar = getattr(plantilla.module, macro)
+            for i in faltantes:
+                partes[i] = str(renderizar(elementos[i]))
+            with self._lock:
+                for i in faltantes:
+                    self._fragmentos[claves[i]] = partes[i]
+                # popitem(last=False) saca el más viejo sin copiar las claves
+                while len(self._fragmentos) > self.maximo:
+                    self._fragmentos.popitem(last=False)
+        return Markup("".join(partes))
+
+
+_cache = CacheFragmentos()
+
+# Claves de distinta longitud: una fila del planner nunca choca con una del reporte
+_clave_pedido = attrgetter("clave", "fecha_solicitada", "hora_limite", "fecha_entregada", "cumplimiento")
+_clave_entrega = itemgetter("pedido", "hora_limite", "fecha_entregada", "cumplimiento")
+
+
+def filas_planner(jinja_env, pedidos):
+    """Filas del planner para una lista de folios.Pedido."""
+    return _cache.unir(jinja_env, "fila_pedido", pedidos, _clave_pedido)
+
+
+def filas_reporte(jinja_env, entregas):
+    """Filas del historial de entregas del reporte (dicts de kpis.detalle_entregas)."""
+    return _cache.unir(jinja_env, "fila_entrega", entregas, _clave_entrega)
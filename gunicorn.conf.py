@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import subprocess
+import threading
+import multiprocessing
+
+
+# ------------------------------------------------------
+# PERFIL DE PRODUCCIÓN (GUNICORN)
+# ------------------------------------------------------
+#   gunicorn -c gunicorn.conf.py app:app              planner, KPIs y exportaciones
+#   gunicorn -c gunicorn.conf.py webhook_local:app    webhook de WhatsApp
+#
+# Workers gthread: cada petición espera casi todo el tiempo a SQL Server
+# (pyodbc), a SQLite o a la Graph API, y esas tres sueltan el GIL, así que
+# unos pocos procesos con varios hilos cada uno atienden a todo el piso. gevent
+# no sirve aquí: pyodbc y sqlite3 son C y bloquearían el worker entero.
+#
+# preload_app importa la app una vez en el maestro y los workers nacen por fork
+# (arranque rápido y memoria compartida). La app no corre nada en el maestro:
+# registro.py y get_engine se rehacen en cada hijo, y el sincronizador con
+# SQL Server y las alertas de vencimiento corren en un proceso aparte,
+# 'flask --app app tareas', que este maestro lanza y vigila (GUNICORN_TAREAS=0
+# si se ejecuta como servicio propio). Cada worker tiene sus propios caches y
+# sus propias métricas en /metrics.
+#
+# Recarga: kill -HUP <maestro> reinicia los workers con calma (graceful_timeout)
+# y relanza las tareas; con preload_app el código nuevo solo se carga con un
+# reinicio completo del maestro (o USR2 + TERM al viejo para no cortar).
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", min(multiprocessing.cpu_count(), 4)))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+
+# Con gthread el latido lo da el hilo principal: una exportación larga no mata al worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Reciclar workers de a poco acota el crecimiento de caches y fragmentación
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG") or None
+errorlog = "-"
+
+TAREAS = os.getenv("GUNICORN_TAREAS", "1") == "1"
+REINTENTO_TAREAS_SEG = 5
+
+_tareas = None
+_deteniendo = False
+
+
+def _lanzar_tareas(server):
+    global _tareas
+    _tareas = subprocess.Popen([sys.executable, "-m", "flask", "--app", "app", "tareas"])
+    server.log.info("Tareas de fondo iniciadas (pid %s)", _tareas.pid)
+
+
+def _vigilar_tareas(server):
+    # Solo espera al proceso y lo relanza: no toca nada de la app
+    while not _deteniendo:
+        codigo = _tareas.wait()
+        if _deteniendo:
+            return
+        server.log.warning("Tareas de fondo terminaron (código %s); se relanzan en %d s",
+                           codigo, REINTENTO_TAREAS_SEG)
+        time.sleep(REINTENTO_TAREAS_SEG)
+        if not _deteniendo:
+            _lanzar_tareas(server)
+
+
+def when_ready(server):
+    # Solo para app.py (el webhook no lo importa)
+    if not TAREAS or "app" not in sys.modules:
+        return
+    _lanzar_tareas(server)
+    threading.Thread(target=_vigilar_tareas, args=(server,), name="vigilante-tareas", daemon=True).start()
+
+
+def on_reload(server):
+    # El vigilante lo relanza con el código y la configuración actuales
+    if _tareas is not None and _tareas.poll() is None:
+        _tareas.terminate()
+
+
+def on_exit(server):
+    global _deteniendo
+    _deteniendo = True
+    if _tareas is not None and _tareas.poll() is None:
+        _tareas.terminate()
+        try:
+            _tareas.wait(graceful_timeout)
+        except subprocess.TimeoutExpired:
+            _tareas.kill()
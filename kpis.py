@@ -0,0 +1,377 @@
+import os
+import time
+import sqlite3
+from threading import Lock
+
+
+# ------------------------------------------------------
+# MOTOR DE KPIs VECTORIZADO
+# ------------------------------------------------------
+# Lee de local_data.db solo las columnas de fechas de los pedidos del rango,
+# las convierte una vez a datetime64 y calcula cumplimiento, conteos, tiempos
+# de entrega y desgloses por hora y por día con operaciones de columna (sin
+# recorrer los pedidos en Python). Pensado para rangos de hasta un año.
+PLANNER_DB = os.getenv("PLANNER_DB", "local_data.db")
+
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+COLUMNAS_FECHA = ("fecha_solicitada", "hora_limite", "fecha_entregada")
+
+# Resultados por rango de fechas; se descartan al vencer KPI_TTL o cuando
+# el planner marca una solicitud o una entrega (invalidar_cache).
+KPI_TTL = int(os.getenv("KPI_TTL", "60"))
+KPI_CACHE_MAX = 64
+MAX_ENTREGAS_DETALLE = 500
+
+_cache = {}
+_cache_lock = Lock()
+
+
+def cargar_historial(fecha_inicio=None, fecha_fin=None, conn=None):
+    """
+    DataFrame con los pedidos solicitados entre fecha_inicio y fecha_fin
+    (YYYY-MM-DD, inclusivos; sin límite si se omiten) y las fechas ya tipadas.
+    """
+    import pandas as pd
+
+    condiciones, params = [], []
+    if fecha_inicio:
+        condiciones.append("fecha_solicitada >= ?")
+        params.append(fecha_inicio)
+    if fecha_fin:
+        condiciones.append("fecha_solicitada < date(?, '+1 day')")
+        params.append(fecha_fin)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    propia = conn is None
+    if propia:
+        conn = sqlite3.connect(PLANNER_DB)
+    try:
+        df = pd.read_sql_query(
+            f"SELECT pedido, {', '.join(COLUMNAS_FECHA)}, cumplimiento FROM pedidos {where}",
+            conn, params=params
+        )
+    finally:
+        if propia:
+            conn.close()
+
+    for columna in COLUMNAS_FECHA:
+        df[columna] = pd.to_datetime(df[columna], format=FORMATO_FECHA, errors="coerce")
+    return df
+
+
+def _estados(df):
+    """Máscaras (cumple, no_cumple, pendiente) calculadas desde las fechas."""
+    entregado = df["fecha_entregada"].notna()
+    con_limite = df["hora_limite"].notna()
+    a_tiempo = df["fecha_entregada"] <= df["hora_limite"]
+
+    # Sin hora límite se respeta lo que quedó guardado ("No cumple" y "No Cumple" son lo mismo)
+    guardado = df["cumplimiento"].fillna("").str.strip().str.lower()
+    cumple = entregado & ((con_limite & a_tiempo) | (~con_limite & (guardado == "cumple")))
+    no_cumple = entregado & ~cumple
+    return cumple, no_cumple, ~entregado
+
+
+def _pct(parte, total):
+    return round(parte / total * 100, 2) if total else 0
+
+
+def _resumen_tiempos(minutos=None):
+    if minutos is None or minutos.empty:
+        return {"n": 0, "promedio": 0, "mediana": 0, "p90": 0}
+    return {
+        "n": int(minutos.size),
+        "promedio": round(float(minutos.mean()), 2),
+        "mediana": round(float(minutos.median()), 2),
+        "p90": round(float(minutos.quantile(0.9)), 2),
+    }
+
+
+def _desglose(cumple, no_cumple, pendiente, clave, formato=str):
+    import pandas as pd
+
+    grupos = pd.DataFrame({
+        "total": 1,
+        "cumplen": cumple.astype(int),
+        "no_cumplen": no_cumple.astype(int),
+        "pendientes": pendiente.astype(int),
+    }).groupby(clave).sum()
+    grupos["eficiencia"] = (grupos["cumplen"] / grupos["total"] * 100).round(2)
+    return [
+        {"clave": formato(indice), **{k: (float(v) if k == "eficiencia" else int(v)) for k, v in fila.items()}}
+        for indice, fila in zip(grupos.index, grupos.to_dict(orient="records"))
+    ]
+
+
+def seleccionar_pedidos(df, pedidos):
+    """Exactamente una fila por Pedido (folios.py); los que no tienen registro local quedan vacíos (pendientes)."""
+    import pandas as pd
+
+    df = df.drop_duplicates("pedido").set_index("pedido")
+    return df.reindex(pd.Index([p.pedido for p in pedidos], name="pedido")).reset_index()
+
+
+def kpis_vacios():
+    return {
+        "total": 0, "cumplen": 0, "no_cumplen": 0, "pendientes": 0, "entregados": 0,
+        "eficiencia": 0, "tasa_cumplimiento": 0,
+        "tiempo_entrega_min": _resumen_tiempos(),
+        "por_hora": [], "por_dia": [],
+    }
+
+
+def calcular_kpis(df, pedidos=None):
+    """
+    KPIs de cumplimiento sobre el DataFrame de cargar_historial. 'eficiencia'
+    es cumplidos / total y 'tasa_cumplimiento' es cumplidos / entregados.
+    Tiempos de entrega en minutos (solicitada → entregada).
+
+    Con 'pedidos' (Pedido de folios.py) se evalúan exactamente esos: los que
+    no tienen registro local cuentan como pendientes.
+    """
+    if pedidos is not None:
+        df = seleccionar_pedidos(df, pedidos)
+
+    total = len(df)
+    if not total:
+        return kpis_vacios()
+
+    cumple, no_cumple, pendiente = _estados(df)
+    cumplen, no_cumplen = int(cumple.sum()), int(no_cumple.sum())
+    entregados = cumplen + no_cumplen
+
+    minutos = (df["fecha_entregada"] - df["fecha_solicitada"]).dt.total_seconds().div(60).dropna()
+    solicitada = df["fecha_solicitada"]
+
+    return {
+        "total": total,
+        "cumplen": cumplen,
+        "no_cumplen": no_cumplen,
+        "pendientes": int(pendiente.sum()),
+        "entregados": entregados,
+        "eficiencia": _pct(cumplen, total),
+        "tasa_cumplimiento": _pct(cumplen, entregados),
+        "tiempo_entrega_min": _resumen_tiempos(minutos),
+        "por_hora": _desglose(cumple, no_cumple, pendiente, solicitada.dt.hour.astype("Int64")),
+        "por_dia": _desglose(cumple, no_cumple, pendiente, solicitada.dt.normalize(),
+                             formato=lambda dia: dia.strftime("%Y-%m-%d")),
+    }
+
+
+def detalle_entregas(df, limite=MAX_ENTREGAS_DETALLE):
+    """Los 'limite' pedidos entregados más recientes, con su resultado, para el reporte."""
+    import pandas as pd
+
+    cumple, no_cumple, _ = _estados(df)
+    entregados = df.assign(cumple=cumple)[cumple | no_cumple]
+    entregados = entregados.sort_values("fecha_entregada", ascending=False).head(limite)
+    return [
+        {
+            "pedido": fila.pedido,
+            "hora_limite": fila.hora_limite.strftime(FORMATO_FECHA) if pd.notna(fila.hora_limite) else None,
+            "fecha_entregada": fila.fecha_entregada.strftime(FORMATO_FECHA),
+            "cumplimiento": "Cumple" if fila.cumple else "No Cumple",
+        }
+        for fila in entregados.itertuples(index=False)
+    ]
+
+
+def invalidar_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def kpis_de_pedidos(fecha_inicio, fecha_fin, obtener_pedidos):
+    """
+    KPIs y detalle de entregas de los pedidos del rango (YYYY-MM-DD).
+    obtener_pedidos(inicio, fin) -> (pedidos, respaldo) da los folios de SQL
+    Server; su estado sale de local_data.db. Cacheado por rango.
+    """
+    clave = (fecha_inicio, fecha_fin)
+    with _cache_lock:
+        entrada = _cache.get(clave)
+    if entrada and entrada[0] > time.monotonic():
+        return entrada[1]
+
+    pedidos, respaldo = obtener_pedidos(fecha_inicio, fecha_fin)
+    # Un pedido se solicita después de registrarse: basta el límite inferior
+    df = seleccionar_pedidos(cargar_historial(fecha_inicio), pedidos)
+    resultado = calcular_kpis(df)
+    resultado["entregas"] = detalle_entregas(df)
+    resultado["respaldo"] = respaldo
+    resultado["calculado_en"] = time.time()
+
+    with _cache_lock:
+        if len(_cache) >= KPI_CACHE_MAX:
+            _cache.pop(next(iter(_cache)))
+        _cache[clave] = (time.monotonic() + KPI_TTL, resultado)
+    return resultado
+
+
+# ------------------------------------------------------
+# BUCKETS PREAGREGADOS POR HORA (SERIE DE TENDENCIA)
+# ------------------------------------------------------
+# kpi_buckets guarda por (día, hora) de fecha_solicitada los conteos y la suma
+# de minutos de entrega. Los triggers sobre 'pedidos' recalculan solo la hora
+# afectada (unas decenas de filas por índice), así cualquier escritura — planner,
+# acciones en lote o recálculos — mantiene la serie al día sin trabajo en la
+# petición. /api/kpi/serie suma buckets: 365 días son ~9k filas.
+_AGREGADO_BUCKET = """
+    SELECT substr(fecha_solicitada, 1, 10) AS dia,
+           CAST(substr(fecha_solicitada, 12, 2) AS INTEGER) AS hora,
+           COUNT(*) AS total,
+           SUM(fecha_entregada IS NOT NULL) AS entregados,
+           SUM(fecha_entregada IS NOT NULL AND CASE
+                   WHEN hora_limite IS NOT NULL THEN fecha_entregada <= hora_limite
+                   ELSE lower(trim(cumplimiento)) = 'cumple'
+               END) AS cumplen,
+           COALESCE(SUM((julianday(fecha_entregada) - julianday(fecha_solicitada)) * 1440), 0) AS suma_min
+    FROM pedidos
+"""
+
+
+def _sql_recalcular_bucket(fila):
+    prefijo = f"substr({fila}.fecha_solicitada, 1, 13)"
+    return f"""
+        DELETE FROM kpi_buckets
+        WHERE dia = substr({fila}.fecha_solicitada, 1, 10)
+          AND hora = CAST(substr({fila}.fecha_solicitada, 12, 2) AS INTEGER);
+        INSERT INTO kpi_buckets (dia, hora, total, entregados, cumplen, suma_min)
+        {_AGREGADO_BUCKET}
+        WHERE fecha_solicitada >= {prefijo} AND fecha_solicitada < {prefijo} || ';'
+        GROUP BY dia, hora;
+    """
+
+
+# Solo estas columnas mueven un bucket (otras, como seq, no lo recalculan)
+_COLUMNAS_BUCKET = ("fecha_solicitada", "hora_limite", "fecha_entregada", "cumplimiento")
+
+_TRIGGERS_BUCKETS = {
+    "trg_kpi_buckets_insert": f"AFTER INSERT ON pedidos BEGIN {_sql_recalcular_bucket('NEW')} END",
+    "trg_kpi_buckets_update": f"AFTER UPDATE OF {', '.join(_COLUMNAS_BUCKET)} ON pedidos BEGIN {_sql_recalcular_bucket('OLD')} {_sql_recalcular_bucket('NEW')} END",
+    "trg_kpi_buckets_delete": f"AFTER DELETE ON pedidos BEGIN {_sql_recalcular_bucket('OLD')} END",
+}
+
+
+def init_kpi_buckets(conn):
+    """Crea kpi_buckets y sus triggers; la primera vez la llena con el historial existente."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kpi_buckets (
+            dia TEXT NOT NULL,
+            hora INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            entregados INTEGER NOT NULL,
+            cumplen INTEGER NOT NULL,
+            suma_min REAL NOT NULL,
+            PRIMARY KEY (dia, hora)
+        )
+    """)
+    # Solo se recrean si la definición guardada cambió, y en una sola transacción:
+    # con los triggers quitados, las escrituras de otros procesos no moverían los buckets
+    if not _triggers_al_dia(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        if not _triggers_al_dia(conn):
+            quitar_triggers_buckets(conn)
+            crear_triggers_buckets(conn)
+        conn.commit()
+    vacia = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM kpi_buckets)").fetchone()[0]
+    if vacia:
+        reconstruir_buckets(conn)
+    conn.commit()
+
+
+def _triggers_al_dia(conn):
+    # sqlite_master guarda el CREATE TRIGGER sin el IF NOT EXISTS
+    guardados = dict(conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(_TRIGGERS_BUCKETS))})",
+        tuple(_TRIGGERS_BUCKETS),
+    ))
+    return all(guardados.get(nombre) == f"CREATE TRIGGER {nombre} {cuerpo}" for nombre, cuerpo in _TRIGGERS_BUCKETS.items())
+
+
+def crear_triggers_buckets(conn):
+    for nombre, cuerpo in _TRIGGERS_BUCKETS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {nombre} {cuerpo}")
+
+
+def quitar_triggers_buckets(conn):
+    """Para escrituras masivas: quitar los triggers, escribir, reconstruir_buckets y volver a crearlos (en la misma transacción)."""
+    for nombre in _TRIGGERS_BUCKETS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+
+
+def reconstruir_buckets(conn):
+    """Recalcula todos los buckets desde 'pedidos' (no confirma la transacción)."""
+    conn.execute("DELETE FROM kpi_buckets")
+    conn.execute(f"""
+        INSERT INTO kpi_buckets (dia, hora, total, entregados, cumplen, suma_min)
+        {_AGREGADO_BUCKET}
+        WHERE fecha_solicitada IS NOT NULL
+        GROUP BY dia, hora
+    """)
+
+
+# Días máximos por serie: por día ~5 años (1 826 puntos), por hora 31 días (744)
+SERIE_MAX_DIAS = {
+    "dia": int(os.getenv("SERIE_MAX_DIAS", "1830")),
+    "hora": int(os.getenv("SERIE_MAX_DIAS_HORA", "31")),
+}
+
+
+class RangoDemasiadoLargo(ValueError):
+    """El rango pedido a serie_kpi supera SERIE_MAX_DIAS para esa agrupación."""
+
+
+def serie_kpi(fecha_inicio, fecha_fin, agrupar="dia", conn=None):
+    """
+    Un punto por día (o por hora con agrupar='hora') entre fecha_inicio y
+    fecha_fin (YYYY-MM-DD, inclusivos), con volumen, tasa de cumplimiento
+    (cumplidos / entregados) y tiempo promedio de entrega. Los periodos sin
+    pedidos aparecen con ceros para que la gráfica no se salte días.
+    """
+    from datetime import datetime, timedelta
+
+    inicio = datetime.strptime(fecha_inicio, "%Y-%m-%d")
+    limite = datetime.strptime(fecha_fin, "%Y-%m-%d") + timedelta(days=1)
+    maximo = SERIE_MAX_DIAS["hora" if agrupar == "hora" else "dia"]
+    if (limite - inicio).days > maximo:
+        raise RangoDemasiadoLargo(f"El rango no puede pasar de {maximo} días con agrupar={agrupar}")
+
+    columnas = "dia, hora" if agrupar == "hora" else "dia"
+    propia = conn is None
+    if propia:
+        conn = sqlite3.connect(PLANNER_DB)
+    try:
+        filas = conn.execute(f"""
+            SELECT {columnas}, SUM(total), SUM(entregados), SUM(cumplen), SUM(suma_min)
+            FROM kpi_buckets
+            WHERE dia BETWEEN ? AND ?
+            GROUP BY {columnas}
+        """, (fecha_inicio, fecha_fin)).fetchall()
+    finally:
+        if propia:
+            conn.close()
+
+    if agrupar == "hora":
+        por_periodo = {f"{f[0]} {f[1]:02d}:00": f[2:] for f in filas}
+        paso, formato = timedelta(hours=1), "%Y-%m-%d %H:00"
+    else:
+        por_periodo = {f[0]: f[1:] for f in filas}
+        paso, formato = timedelta(days=1), "%Y-%m-%d"
+
+    serie = []
+    actual = inicio
+    while actual < limite:
+        periodo = actual.strftime(formato)
+        total, entregados, cumplen, suma_min = por_periodo.get(periodo, (0, 0, 0, 0.0))
+        serie.append({
+            "periodo": periodo,
+            "total": total,
+            "entregados": entregados,
+            "cumplen": cumplen,
+            "no_cumplen": entregados - cumplen,
+            "tasa_cumplimiento": _pct(cumplen, entregados),
+            "promedio_min": round(suma_min / entregados, 2) if entregados else 0,
+        })
+        actual += paso
+    return serie
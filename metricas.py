@@ -0,0 +1,144 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# ------------------------------------------------------
+# MÉTRICAS EN FORMATO PROMETHEUS (SIN DEPENDENCIAS)
+# ------------------------------------------------------
+# Contadores, medidores e histogramas en memoria del proceso; /metrics los
+# expone en formato de texto de Prometheus. Con varios workers de gunicorn
+# cada proceso expone los suyos (Prometheus los distingue por instancia).
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_CONTEO = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+_LE_INF = 'le="+Inf"'
+
+_registro = []
+_registro_lock = threading.Lock()
+
+
+def _formato_etiquetas(nombres, valores, extra=""):
+    pares = [f'{n}="{str(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _formato_valor(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+        with _registro_lock:
+            _registro.append(self)
+
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def _lineas(self):
+        with self._lock:
+            valores = dict(self._valores)
+        for clave, valor in sorted(valores.items()):
+            yield f"{self.nombre}{_formato_etiquetas(self.etiquetas, clave)} {_formato_valor(valor)}"
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas.extend(self._lineas())
+        return "\n".join(lineas)
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja. Con 'funcion' se calcula al momento de exponerlo."""
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+    def set(self, valor, **etiquetas):
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def dec(self, valor=1, **etiquetas):
+        self.inc(-valor, **etiquetas)
+
+    def _lineas(self):
+        if self.funcion is not None:
+            try:
+                self.set(self.funcion())
+            except Exception:
+                return
+        yield from super()._lineas()
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            datos = self._valores.get(clave)
+            if datos is None:
+                datos = self._valores[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            datos[0][i] += 1
+            datos[1] += valor
+            datos[2] += 1
+
+    @contextmanager
+    def cronometrar(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **etiquetas)
+
+    def _lineas(self):
+        with self._lock:
+            valores = {k: ([*v[0]], v[1], v[2]) for k, v in self._valores.items()}
+        for clave, (conteos, suma, total) in sorted(valores.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                le = f'le="{_formato_valor(float(limite))}"'
+                yield f"{self.nombre}_bucket{_formato_etiquetas(self.etiquetas, clave, le)} {acumulado}"
+            yield f"{self.nombre}_bucket{_formato_etiquetas(self.etiquetas, clave, _LE_INF)} {total}"
+            yield f"{self.nombre}_sum{_formato_etiquetas(self.etiquetas, clave)} {_formato_valor(suma)}"
+            yield f"{self.nombre}_count{_formato_etiquetas(self.etiquetas, clave)} {total}"
+
+
+def exponer():
+    """Todas las métricas registradas en formato de texto de Prometheus."""
+    with _registro_lock:
+        metricas = list(_registro)
+    return "\n".join(m.exponer() for m in metricas) + "\n"
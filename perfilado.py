@@ -0,0 +1,132 @@
+import os
+import time
+import logging
+import itertools
+from threading import Lock
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+
+from registro import obtener_logger
+
+log = obtener_logger("peticiones")
+
+
+# ------------------------------------------------------
+# TIEMPOS POR PETICIÓN, SERVER-TIMING Y PERFILADO BAJO DEMANDA
+# ------------------------------------------------------
+# Cada petición acumula el tiempo de sus fases (sql, sqlite, merge, render...)
+# y las devuelve en el encabezado Server-Timing. Las peticiones más lentas que
+# UMBRAL_LENTA_MS se registran con sus fases como campos del log. Opcionalmente se perfila
+# con cProfile una de cada PERFIL_CADA_N peticiones o las que traen ?_perfil=1
+# (si PERFIL_POR_PARAMETRO=1), guardando el .prof en PERFIL_DIR.
+UMBRAL_LENTA_MS = float(os.getenv("UMBRAL_LENTA_MS", "1000"))
+PERFIL_CADA_N = int(os.getenv("PERFIL_CADA_N", "0"))
+PERFIL_POR_PARAMETRO = os.getenv("PERFIL_POR_PARAMETRO", "0") == "1"
+PERFIL_DIR = os.getenv("PERFIL_DIR", "perfiles")
+
+_contador = itertools.count(1)
+_perfil_lock = Lock()  # cProfile no admite dos perfiles activos a la vez
+
+
+@contextmanager
+def fase(nombre):
+    """Suma la duración del bloque a la fase 'nombre' de la petición actual (no-op fuera de una petición)."""
+    if not has_request_context() or "fases" not in g:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.fases[nombre] = g.fases.get(nombre, 0.0) + (time.perf_counter() - inicio) * 1000
+
+
+def _quiere_perfil():
+    if PERFIL_POR_PARAMETRO and request.args.get("_perfil") == "1":
+        return True
+    return PERFIL_CADA_N > 0 and next(_contador) % PERFIL_CADA_N == 0
+
+
+def _iniciar_peticion():
+    g.inicio_peticion = time.perf_counter()
+    g.fases = {}
+    g.perfil = None
+    if (PERFIL_CADA_N or PERFIL_POR_PARAMETRO) and _quiere_perfil() and _perfil_lock.acquire(blocking=False):
+        import cProfile
+
+        g.perfil = cProfile.Profile()
+        g.perfil.enable()
+
+
+def _guardar_perfil(perfil):
+    perfil.disable()
+    try:
+        os.makedirs(PERFIL_DIR, exist_ok=True)
+        nombre = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{request.endpoint or 'sin_ruta'}.prof"
+        ruta = os.path.join(PERFIL_DIR, nombre)
+        perfil.dump_stats(ruta)
+        return ruta
+    finally:
+        _perfil_lock.release()
+
+
+def _terminar_peticion(respuesta):
+    if "inicio_peticion" not in g:
+        return respuesta
+    total_ms = (time.perf_counter() - g.inicio_peticion) * 1000
+
+    ruta_perfil = None
+    if g.perfil is not None:
+        ruta_perfil = _guardar_perfil(g.perfil)
+        g.perfil = None
+
+    metricas = [f"{nombre};dur={ms:.1f}" for nombre, ms in g.fases.items()]
+    metricas.append(f"total;dur={total_ms:.1f}")
+    respuesta.headers["Server-Timing"] = ", ".join(metricas)
+
+    if total_ms >= UMBRAL_LENTA_MS or ruta_perfil:
+        lenta = total_ms >= UMBRAL_LENTA_MS
+        log.log(
+            logging.WARNING if lenta else logging.INFO,
+            "🐢 Petición lenta %s %s" if lenta else "🔬 Petición perfilada %s %s",
+            request.method, request.path,
+            extra={
+                "evento": "peticion_lenta" if lenta else "peticion_perfilada",
+                "endpoint": request.endpoint,
+                "status": respuesta.status_code,
+                "total_ms": round(total_ms, 1),
+                "fases_ms": {k: round(v, 1) for k, v in g.fases.items()},
+                "perfil": ruta_perfil,
+            }
+        )
+    return respuesta
+
+
+def _limpiar_perfil(_error=None):
+    # Si la vista lanzó una excepción no se llama after_request: liberar el perfilador
+    perfil = g.pop("perfil", None)
+    if perfil is not None:
+        perfil.disable()
+        _perfil_lock.release()
+
+
+def _antes_de_render(_app, template, context, **extra):
+    if "fases" in g:
+        g.inicio_render = time.perf_counter()
+
+
+def _despues_de_render(_app, template, context, **extra):
+    inicio = g.pop("inicio_render", None)
+    if inicio is not None:
+        g.fases["render"] = g.fases.get("render", 0.0) + (time.perf_counter() - inicio) * 1000
+
+
+def instalar(app):
+    """Registra los hooks de medición en la app Flask."""
+    app.before_request(_iniciar_peticion)
+    app.after_request(_terminar_peticion)
+    app.teardown_request(_limpiar_perfil)
+    before_render_template.connect(_antes_de_render, app)
+    template_rendered.connect(_despues_de_render, app)
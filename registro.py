@@ -0,0 +1,154 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import itertools
+from threading import Lock
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# ------------------------------------------------------
+# LOGGING ESTRUCTURADO Y NO BLOQUEANTE
+# ------------------------------------------------------
+# Los módulos piden su logger con un nombre corto: obtener_logger("app"). Los registros van a
+# una cola en memoria y un hilo aparte los escribe en stdout, así la petición
+# no espera la E/S. LOG_FORMATO=json (por defecto) o texto; LOG_NIVEL=INFO.
+# Para eventos de alto volumen: logger.info(..., extra={"muestra": 100})
+# deja pasar 1 de cada 100 registros de ese mismo mensaje.
+#
+# Con gunicorn (preload_app) el logging se configura en el proceso maestro y
+# los workers nacen por fork sin el hilo escritor: cada hijo arma su propia
+# cola y su propio hilo al nacer (_reiniciar_en_hijo).
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json").lower()
+LOG_COLA_MAX = int(os.getenv("LOG_COLA_MAX", "10000"))
+
+RAIZ_LOGGER = "recsolog"
+
+# Atributos propios de LogRecord; lo demás llegó por 'extra' y va al JSON
+_ATRIBUTOS_BASE = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_FORMATO_BASE = logging.Formatter()
+
+_configurado = False
+_config_lock = Lock()
+_listener = None
+_manejador = None
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        datos = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_BASE and clave != "muestra":
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            datos["excepcion"] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class FiltroMuestreo(logging.Filter):
+    """Deja pasar 1 de cada N registros que traen extra={'muestra': N}, por mensaje."""
+
+    def __init__(self):
+        super().__init__()
+        self._contadores = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        n = getattr(record, "muestra", None)
+        if not n or n <= 1:
+            return True
+        clave = (record.name, record.msg)
+        with self._lock:
+            contador = self._contadores.get(clave)
+            if contador is None:
+                contador = self._contadores[clave] = itertools.count()
+            if next(contador) % n:
+                return False
+        record.muestreado_1_de = n
+        return True
+
+
+class _ColaSinBloqueo(QueueHandler):
+    """Si la cola se llena se descarta el registro en vez de bloquear la petición."""
+
+    def prepare(self, record):
+        # QueueHandler.prepare mete el traceback en msg; aquí se formatea una sola
+        # vez en exc_text, que el formateador escribe en su propio campo
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _FORMATO_BASE.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def configurar_logging():
+    """Configura el logger raíz de la aplicación una sola vez por proceso."""
+    global _configurado, _listener, _manejador
+    if _configurado:
+        return
+    with _config_lock:
+        if _configurado:
+            return
+        salida = logging.StreamHandler(sys.stdout)
+        if LOG_FORMATO == "json":
+            salida.setFormatter(FormatoJSON())
+        else:
+            salida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+        cola = queue.Queue(LOG_COLA_MAX)
+        _manejador = _ColaSinBloqueo(cola)
+        _manejador.addFilter(FiltroMuestreo())
+        _listener = QueueListener(cola, salida, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        raiz = logging.getLogger(RAIZ_LOGGER)
+        raiz.setLevel(LOG_NIVEL)
+        raiz.addHandler(_manejador)
+        raiz.propagate = False
+        _configurado = True
+
+
+def _reiniciar_en_hijo():
+    """Tras un fork: cola, hilo escritor y locks nuevos (los del padre no sirven aquí)."""
+    global _listener, _config_lock
+    _config_lock = Lock()
+    if _listener is None:
+        return
+    cola = queue.Queue(LOG_COLA_MAX)
+    _manejador.queue = cola
+    for filtro in _manejador.filters:
+        if isinstance(filtro, FiltroMuestreo):
+            filtro._lock = Lock()
+    _listener = QueueListener(cola, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def obtener_logger(nombre):
+    configurar_logging()
+    return logging.getLogger(f"{RAIZ_LOGGER}.{nombre}")
@@ -0,0 +1,309 @@
+import os
+import json
+import sqlite3
+from bisect import bisect_left
+from threading import Lock
+from datetime import date, datetime, timedelta
+
+from registro import obtener_logger
+
+log = obtener_logger("reglas_sla")
+
+
+# ------------------------------------------------------
+# REGLAS DE SLA (HORA LÍMITE) Y CALENDARIO LABORAL
+# ------------------------------------------------------
+# La hora límite de un pedido es su fecha de solicitud más N minutos, donde N
+# sale de la regla más específica que coincide con su sufijo (F1/F1X/F2), su
+# mesa y si es urgente (facturacion.db). Con "horario" los minutos solo corren
+# dentro de los turnos y fuera de los feriados. Formato de REGLAS_SLA (JSON):
+#
+#   {
+#     "minutos_por_defecto": 30,
+#     "reglas": [
+#       {"sufijo": "F2", "minutos": 45},
+#       {"urgente": true, "minutos": 15},
+#       {"sufijo": "F1X", "mesa": "7", "minutos": 20}
+#     ],
+#     "horario": {"lun": [["07:00", "15:00"], ["15:30", "23:00"]], "sab": [["08:00", "14:00"]]},
+#     "feriados": ["2025-12-25"]
+#   }
+#
+# Gana la regla con más campos; a igualdad, la primera de la lista. Con
+# "horario": null los minutos son corridos (24/7). Cada proceso vuelve a leer
+# el archivo cuando cambia su fecha de modificación, así los pedidos nuevos toman
+# las reglas nuevas sin reiniciar; para llevarlas también al historial:
+#   flask --app app recalcular-sla [--desde YYYY-MM-DD] [--hasta YYYY-MM-DD]
+REGLAS_SLA = os.getenv("REGLAS_SLA", "reglas_sla.json")
+FACTURACION_DB = os.getenv("FACTURACION_DB", "facturacion.db")
+
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+SUFIJOS = ("F1", "F1X", "F2")
+DIAS = ("lun", "mar", "mie", "jue", "vie", "sab", "dom")
+CUALQUIERA = "*"
+
+# El calendario se precalcula para este margen de años alrededor de hoy
+ANIOS_CALENDARIO = 10
+
+
+def sufijo_de(folio):
+    """'OV-12345-F1X' -> 'F1X' (None si el folio no trae sufijo)."""
+    if not folio or "-" not in folio:
+        return None
+    return folio.rsplit("-", 1)[1].upper()
+
+
+def _minutos_del_dia(hhmm):
+    horas, minutos = hhmm.split(":")
+    return int(horas) * 60 + int(minutos)
+
+
+class Calendario:
+    """
+    Minutos laborables acumulados al inicio de cada día de la ventana, para
+    convertir una fecha en 'minuto laboral' y de vuelta sin recorrer días.
+    """
+
+    def __init__(self, horario, feriados=()):
+        self.turnos_por_dia = tuple(
+            tuple(sorted((_minutos_del_dia(a), _minutos_del_dia(b)) for a, b in horario.get(dia, ())))
+            for dia in DIAS
+        )
+        feriados = {date.fromisoformat(f).toordinal() for f in feriados}
+
+        hoy = date.today()
+        self._base = date(hoy.year - ANIOS_CALENDARIO, 1, 1).toordinal()
+        fin = date(hoy.year + ANIOS_CALENDARIO, 12, 31).toordinal()
+
+        self._turnos = []
+        self._acumulado = [0]
+        for ordinal in range(self._base, fin + 1):
+            turnos = () if ordinal in feriados else self.turnos_por_dia[date.fromordinal(ordinal).weekday()]
+            self._turnos.append(turnos)
+            self._acumulado.append(self._acumulado[-1] + sum(b - a for a, b in turnos))
+
+        if self._acumulado[-1] == 0:
+            raise ValueError("El horario de SLA no tiene ningún turno")
+
+    def _dia(self, momento):
+        dia = momento.toordinal() - self._base
+        if not 0 <= dia < len(self._turnos):
+            raise ValueError(f"{momento} está fuera del calendario de SLA")
+        return dia
+
+    def sumar(self, inicio, minutos):
+        """inicio + 'minutos' laborables. Si inicio cae fuera de turno, el reloj empieza en el siguiente turno."""
+        dia = self._dia(inicio)
+        ahora = inicio.hour * 60 + inicio.minute + inicio.second / 60
+        transcurrido = sum(min(ahora, b) - a for a, b in self._turnos[dia] if ahora > a)
+        objetivo = self._acumulado[dia] + transcurrido + max(minutos, 0)
+
+        # Lo normal es que venza el mismo día; si no, búsqueda binaria
+        if objetivo > self._acumulado[dia + 1]:
+            dia = bisect_left(self._acumulado, objetivo) - 1
+            if dia >= len(self._turnos):
+                raise ValueError(f"La hora límite de {inicio} queda fuera del calendario de SLA")
+        restante = objetivo - self._acumulado[dia]
+        for a, b in self._turnos[dia]:
+            if restante <= b - a:
+                return datetime.fromordinal(self._base + dia) + timedelta(minutes=a + restante)
+            restante -= b - a
+        # Solo con 0 minutos de SLA en un día sin turnos
+        return inicio
+
+
+class ReglasSLA:
+    """Reglas compiladas en una tabla (sufijo, mesa, urgente) -> minutos: una búsqueda por pedido."""
+
+    def __init__(self, config):
+        self.config = config
+        por_defecto = int(config.get("minutos_por_defecto", 30))
+        reglas = config.get("reglas", [])
+
+        sufijos = set(SUFIJOS) | {str(r["sufijo"]).upper() for r in reglas if "sufijo" in r}
+        self.mesas = {str(r["mesa"]) for r in reglas if "mesa" in r}
+        self.sufijos = sufijos
+
+        # Más campos primero; sort estable => a igualdad, el orden del archivo
+        ordenadas = sorted(reglas, key=lambda r: -sum(k in r for k in ("sufijo", "mesa", "urgente")))
+        self._tabla = {}
+        for sufijo in sufijos | {CUALQUIERA}:
+            for mesa in self.mesas | {CUALQUIERA}:
+                for urgente in (False, True):
+                    self._tabla[(sufijo, mesa, urgente)] = next(
+                        (int(r["minutos"]) for r in ordenadas
+                         if r.get("sufijo", sufijo).upper() == sufijo
+                         and str(r.get("mesa", mesa)) == mesa
+                         and bool(r.get("urgente", urgente)) == urgente),
+                        por_defecto
+                    )
+
+        horario = config.get("horario")
+        self.calendario = Calendario(horario, config.get("feriados", ())) if horario else None
+
+    def minutos(self, sufijo=None, mesa=None, urgente=False):
+        sufijo = sufijo if sufijo in self.sufijos else CUALQUIERA
+        mesa = str(mesa) if mesa is not None and str(mesa) in self.mesas else CUALQUIERA
+        return self._tabla[(sufijo, mesa, bool(urgente))]
+
+    def hora_limite(self, folio, solicitada, mesa=None, urgente=False):
+        """Hora límite (datetime) de un pedido solicitado en 'solicitada'."""
+        minutos = self.minutos(sufijo_de(folio), mesa, urgente)
+        if self.calendario is None:
+            return solicitada + timedelta(minutes=minutos)
+        return self.calendario.sumar(solicitada, minutos)
+
+
+_reglas = None
+_firma_reglas = None
+_reglas_lock = Lock()
+
+
+def cargar_reglas(ruta=None):
+    ruta = ruta or REGLAS_SLA
+    config = {}
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            config = json.load(f)
+    return ReglasSLA(config)
+
+
+def _firma_archivo(ruta):
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return estado.st_mtime_ns, estado.st_size
+
+
+def reglas():
+    """Reglas vigentes; se recompilan si el archivo de REGLAS_SLA cambió desde la última carga."""
+    global _reglas, _firma_reglas
+    firma = _firma_archivo(REGLAS_SLA)
+    if _reglas is None or firma != _firma_reglas:
+        with _reglas_lock:
+            if _reglas is None or firma != _firma_reglas:
+                try:
+                    _reglas = cargar_reglas()
+                except (ValueError, KeyError, TypeError):
+                    # Un archivo a medio editar no tumba las marcas: siguen las reglas anteriores
+                    if _reglas is None:
+                        raise
+                    log.exception("No se pudieron recargar las reglas de SLA de %s", REGLAS_SLA)
+                _firma_reglas = firma
+    return _reglas
+
+
+def recargar():
+    global _reglas, _firma_reglas
+    with _reglas_lock:
+        _firma_reglas = _firma_archivo(REGLAS_SLA)
+        _reglas = cargar_reglas()
+    return _reglas
+
+
+def _es_urgente(valor):
+    return str(valor or "").strip().lower() in ("sí", "si", "1", "true", "urgente")
+
+
+def atributos_facturacion(folios=None):
+    """
+    {folio_fiscal: (mesa, urgente)} desde facturacion.db; con 'folios', solo
+    esos folios (o su base sin sufijo). Sin la base devuelve {}.
+    """
+    try:
+        conn = sqlite3.connect(f"file:{FACTURACION_DB}?mode=ro", uri=True)
+        try:
+            if folios is None:
+                filas = conn.execute("SELECT folio_fiscal, mesa, urgente FROM facturas").fetchall()
+            else:
+                buscados = set()
+                for folio in folios:
+                    buscados.add(folio)
+                    if sufijo_de(folio):
+                        buscados.add(folio.rsplit("-", 1)[0])
+                buscados = list(buscados)
+                filas = []
+                for i in range(0, len(buscados), 500):
+                    lote = buscados[i:i + 500]
+                    filas += conn.execute(
+                        f"SELECT folio_fiscal, mesa, urgente FROM facturas "
+                        f"WHERE folio_fiscal IN ({', '.join('?' * len(lote))})",
+                        lote
+                    ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+    return {f: (mesa, _es_urgente(urgente)) for f, mesa, urgente in filas}
+
+
+def _atributos_de(atributos, folio):
+    encontrado = atributos.get(folio)
+    if encontrado is None and sufijo_de(folio):
+        encontrado = atributos.get(folio.rsplit("-", 1)[0])
+    return encontrado or (None, False)
+
+
+def hora_limite_pedido(folio, solicitada):
+    """Hora límite de un pedido con sus atributos de facturación, como texto YYYY-MM-DD HH:MM:SS."""
+    atributos = atributos_facturacion([folio]) if folio else {}
+    mesa, urgente = _atributos_de(atributos, folio)
+    return reglas().hora_limite(folio, solicitada, mesa, urgente).strftime(FORMATO_FECHA)
+
+
+def horas_limite(pedidos):
+    """
+    Como hora_limite_pedido para [(folio, solicitada)], con una sola consulta
+    de atributos. None para los que quedan fuera del calendario de SLA.
+    """
+    atributos = atributos_facturacion([folio for folio, _ in pedidos])
+    vigentes = reglas()
+    resultado = []
+    for folio, solicitada in pedidos:
+        try:
+            limite = vigentes.hora_limite(folio, solicitada, *_atributos_de(atributos, folio))
+        except ValueError:
+            resultado.append(None)
+        else:
+            resultado.append(limite.strftime(FORMATO_FECHA))
+    return resultado
+
+
+def recalcular_historial(conn, desde=None, hasta=None, reglas_sla=None):
+    """
+    Recalcula hora_limite y cumplimiento de los pedidos de local_data.db
+    solicitados entre 'desde' y 'hasta' (YYYY-MM-DD, inclusivos) con las
+    reglas vigentes. Devuelve cuántos pedidos cambiaron. No toca kpi_buckets:
+    quien llama los reconstruye en la misma transacción.
+    """
+    reglas_sla = reglas_sla or reglas()
+    atributos = atributos_facturacion()
+
+    condiciones, params = ["fecha_solicitada IS NOT NULL"], []
+    if desde:
+        condiciones.append("fecha_solicitada >= ?")
+        params.append(desde)
+    if hasta:
+        condiciones.append("fecha_solicitada < date(?, '+1 day')")
+        params.append(hasta)
+    filas = conn.execute(
+        f"SELECT pedido, fecha_solicitada, hora_limite, fecha_entregada, cumplimiento FROM pedidos "
+        f"WHERE {' AND '.join(condiciones)}",
+        params
+    ).fetchall()
+
+    cambios = []
+    for pedido, solicitada, limite_actual, entregada, cumplimiento_actual in filas:
+        mesa, urgente = _atributos_de(atributos, pedido)
+        limite = reglas_sla.hora_limite(pedido, datetime.fromisoformat(solicitada), mesa, urgente)
+        limite = limite.strftime(FORMATO_FECHA)
+        if entregada:
+            cumplimiento = "Cumple" if entregada <= limite else "No cumple"
+        else:
+            cumplimiento = "Pendiente"
+        if limite != limite_actual or cumplimiento != cumplimiento_actual:
+            cambios.append((limite, cumplimiento, pedido))
+
+    conn.executemany("UPDATE pedidos SET hora_limite = ?, cumplimiento = ? WHERE pedido = ?", cambios)
+    return len(cambios)
@@ -0,0 +1,131 @@
+import os
+import zlib
+import hashlib
+
+from flask import g, request
+
+try:
+    import brotli  # opcional: sin el paquete solo se ofrece gzip
+except ImportError:
+    brotli = None
+
+
+# ------------------------------------------------------
+# COMPRESIÓN Y GET CONDICIONAL (ETAG)
+# ------------------------------------------------------
+# Las respuestas HTML/JSON/CSV se comprimen con brotli (si está instalado) o
+# gzip según Accept-Encoding; las que se envían por partes (exportación CSV)
+# se comprimen trozo por trozo, sin esperar al final. Las vistas que conocen
+# la versión de sus datos llaman a no_modificado(...) antes de armar la
+# página: si el navegador ya tiene esa versión se responde 304 sin consultar
+# ni renderizar nada más.
+COMPRESION_MIN_BYTES = int(os.getenv("COMPRESION_MIN_BYTES", "1024"))
+NIVEL_GZIP = 6
+CALIDAD_BROTLI = 5  # buena relación tamaño/CPU para páginas dinámicas
+
+TIPOS_COMPRIMIBLES = ("text/html", "application/json", "text/csv", "text/plain", "text/javascript")
+SUFIJOS_ETAG = {"br": "-br", "gzip": "-gz"}
+
+
+def _version_codigo():
+    """Cambia al desplegar: la última modificación de los .py y las plantillas."""
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    rutas = [os.path.join(raiz, n) for n in os.listdir(raiz) if n.endswith(".py")]
+    plantillas = os.path.join(raiz, "templates")
+    if os.path.isdir(plantillas):
+        rutas += [os.path.join(plantillas, n) for n in os.listdir(plantillas) if n.endswith(".html")]
+    return str(int(max((os.path.getmtime(r) for r in rutas), default=0)))
+
+
+VERSION_CODIGO = _version_codigo()
+
+
+def no_modificado(*version):
+    """
+    ETag de la petición actual a partir de la versión de sus datos. Devuelve
+    una respuesta 304 si el cliente ya la tiene; si no, None (la ETag se añade
+    a la respuesta 200 al salir).
+    """
+    base = "|".join(map(str, (VERSION_CODIGO, request.full_path) + version))
+    etag = hashlib.sha1(base.encode()).hexdigest()[:24]
+    g.etag = etag
+    enviadas = request.if_none_match
+    vigente = next(
+        (etag + sufijo for sufijo in ("",) + tuple(SUFIJOS_ETAG.values()) if etag + sufijo in enviadas), None
+    )
+    if vigente is None:
+        return None
+
+    from flask import current_app
+
+    respuesta = current_app.response_class(status=304)
+    respuesta.set_etag(vigente)
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    respuesta.vary.add("Accept-Encoding")
+    return respuesta
+
+
+def _codificacion():
+    disponibles = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(disponibles)
+
+
+def _comprimir(datos, codificacion):
+    if codificacion == "br":
+        return brotli.compress(datos, quality=CALIDAD_BROTLI)
+    return zlib.compress(datos, NIVEL_GZIP, wbits=31)
+
+
+def _comprimir_por_partes(partes, codificacion):
+    """Comprime un flujo; cada parte sale en cuanto llega (flush de sincronización)."""
+    if codificacion == "br":
+        compresor = brotli.Compressor(quality=CALIDAD_BROTLI)
+        for parte in partes:
+            salida = compresor.process(parte) + compresor.flush()
+            if salida:
+                yield salida
+        yield compresor.finish()
+    else:
+        compresor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+        for parte in partes:
+            salida = compresor.compress(parte) + compresor.flush(zlib.Z_SYNC_FLUSH)
+            if salida:
+                yield salida
+        yield compresor.flush()
+
+
+def _preparar_respuesta(respuesta):
+    etag = g.pop("etag", None)
+    if respuesta.status_code != 200:
+        return respuesta
+    if etag:
+        respuesta.set_etag(etag)
+        respuesta.headers["Cache-Control"] = "private, no-cache"
+
+    if (respuesta.direct_passthrough
+            or "Content-Encoding" in respuesta.headers
+            or respuesta.mimetype not in TIPOS_COMPRIMIBLES):
+        return respuesta
+    respuesta.vary.add("Accept-Encoding")
+    codificacion = _codificacion()
+    if not codificacion:
+        return respuesta
+
+    if respuesta.is_streamed:
+        respuesta.response = _comprimir_por_partes(respuesta.iter_encoded(), codificacion)
+        respuesta.headers.pop("Content-Length", None)
+    else:
+        datos = respuesta.get_data()
+        if len(datos) < COMPRESION_MIN_BYTES:
+            return respuesta
+        respuesta.set_data(_comprimir(datos, codificacion))
+    respuesta.headers["Content-Encoding"] = codificacion
+    if etag:
+        # Otra representación, otra ETag (no_modificado acepta las dos formas)
+        respuesta.set_etag(etag + SUFIJOS_ETAG[codificacion])
+    return respuesta
+
+
+def instalar(app):
+    """Registra la compresión y las ETag en la app Flask."""
+    app.after_request(_preparar_respuesta)
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+
+
+# ------------------------------------------------------
+# RESPALDO EN DISCO DEL ÚLTIMO RESULTADO DE SQL SERVER
+# ------------------------------------------------------
+# Guarda por rango de fechas la última lista de folios que devolvió
+# SQL Server junto con la hora en que se obtuvo. Se sirve al arrancar
+# el proceso (arranque en caliente) y cuando SQL Server está lento o caído.
+# En memoria se guardan los SNAPSHOT_MEMORIA_MAX rangos usados más
+# recientemente; antes de servir uno se compara su guardado_en con el del
+# disco, por si otro proceso (flask tareas, otro worker) guardó uno más nuevo.
+# Los rangos que nadie guarda en SNAPSHOT_RETENCION_DIAS se borran.
+SNAPSHOT_DB = os.getenv("SNAPSHOT_DB", "snapshot_pedidos.db")
+SNAPSHOT_MEMORIA_MAX = int(os.getenv("SNAPSHOT_MEMORIA_MAX", "32"))
+SNAPSHOT_RETENCION_DIAS = int(os.getenv("SNAPSHOT_RETENCION_DIAS", "7"))
+
+_memoria = OrderedDict()  # (fecha_inicio, fecha_fin) -> (folios, guardado_en)
+_lock = Lock()
+
+
+def _recordar(clave, encontrado):
+    """Guarda en memoria (con el lock tomado) y descarta los rangos menos usados."""
+    _memoria[clave] = encontrado
+    _memoria.move_to_end(clave)
+    while len(_memoria) > SNAPSHOT_MEMORIA_MAX:
+        _memoria.popitem(last=False)
+
+
+def init_snapshot_db():
+    """Crea la tabla de respaldos si no existe."""
+    conn = sqlite3.connect(SNAPSHOT_DB)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            fecha_inicio TEXT NOT NULL,
+            fecha_fin TEXT NOT NULL,
+            guardado_en REAL NOT NULL,
+            folios TEXT NOT NULL,
+            PRIMARY KEY (fecha_inicio, fecha_fin)
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def guardar_snapshot(fecha_inicio, fecha_fin, folios):
+    """Guarda la lista de folios del rango y devuelve la hora de guardado (epoch)."""
+    guardado_en = time.time()
+    folios = list(folios)
+    with _lock:
+        _recordar((fecha_inicio, fecha_fin), (folios, guardado_en))
+        conn = sqlite3.connect(SNAPSHOT_DB)
+        conn.execute("""
+            INSERT INTO snapshots (fecha_inicio, fecha_fin, guardado_en, folios)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(fecha_inicio, fecha_fin) DO UPDATE SET
+                guardado_en=excluded.guardado_en,
+                folios=excluded.folios
+        """, (fecha_inicio, fecha_fin, guardado_en, json.dumps(folios, separators=(",", ":"))))
+        conn.execute(
+            "DELETE FROM snapshots WHERE guardado_en < ?", (guardado_en - SNAPSHOT_RETENCION_DIAS * 86400,)
+        )
+        conn.commit()
+        conn.close()
+    return guardado_en
+
+
+def leer_snapshot(fecha_inicio, fecha_fin):
+    """Devuelve (folios, guardado_en) del rango o None si nunca se ha guardado."""
+    clave = (fecha_inicio, fecha_fin)
+    en_memoria = _memoria.get(clave)
+    guardado_en_memoria = en_memoria[1] if en_memoria is not None else None
+
+    # Si la copia en memoria sigue siendo la del disco no se trae ni se decodifica el JSON
+    conn = sqlite3.connect(SNAPSHOT_DB)
+    row = conn.execute(
+        "SELECT guardado_en, CASE WHEN guardado_en = ? THEN NULL ELSE folios END FROM snapshots "
+        "WHERE fecha_inicio = ? AND fecha_fin = ?",
+        (guardado_en_memoria, fecha_inicio, fecha_fin)
+    ).fetchone()
+    conn.close()
+    if not row:
+        return en_memoria
+
+    guardado_en, folios = row
+    encontrado = en_memoria if folios is None else (json.loads(folios), guardado_en)
+    with _lock:
+        actual = _memoria.get(clave)
+        # Otro hilo pudo guardar uno más nuevo mientras tanto
+        if actual is not None and actual[1] > encontrado[1]:
+            encontrado = actual
+        _recordar(clave, encontrado)
+    return encontrado
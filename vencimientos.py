@@ -0,0 +1,248 @@
+import os
+import heapq
+import sqlite3
+from threading import Condition, Thread
+from datetime import datetime
+
+import delta_planner
+from metricas import Contador, Medidor
+from registro import obtener_logger
+
+log = obtener_logger("vencimientos")
+
+
+# ------------------------------------------------------
+# ALERTAS DE SLA VENCIDO (MONTÍCULO DE HORAS LÍMITE)
+# ------------------------------------------------------
+# Los pedidos solicitados y aún sin entregar viven en un montículo ordenado por
+# hora_limite. Un hilo duerme hasta el vencimiento más próximo (o hasta que
+# llega uno más cercano) y avisa por WhatsApp; no se recorre la tabla salvo una
+# vez al arrancar, con un índice parcial. Las marcas del planner actualizan el
+# montículo en O(log n): las entradas que dejan de valer (entregado, nueva hora
+# límite) se descartan al salir, sin buscarlas dentro del montículo. Si las
+# marcas llegan desde otros procesos (workers de gunicorn), el hilo las recoge
+# cada MAX_ESPERA segundos por pedidos.seq (delta_planner.py), solo lo cambiado.
+#
+# Antes de avisar se "reclama" la alerta en alertas_sla con un INSERT que solo
+# prospera si el pedido sigue pendiente con esa misma hora límite: así no se
+# avisa de algo ya entregado por otro proceso, ni dos veces (varios workers o
+# un reinicio). Los plazos que cambie 'flask recalcular-sla' también llegan por seq.
+# Al crear alertas_sla (primer despliegue) los plazos ya vencidos del historial
+# se dan por avisados: solo se alerta de lo que vence de ahí en adelante.
+PLANNER_DB = os.getenv("PLANNER_DB", "local_data.db")
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+# Tope de cada espera: cada cuánto se leen los cambios de otros procesos
+MAX_ESPERA = int(os.getenv("VENCIMIENTOS_REVISION", "30"))
+
+METRICA_PENDIENTES = Medidor(
+    "recsolog_sla_pendientes", "Pedidos solicitados sin entregar con alerta de vencimiento programada")
+METRICA_ALERTAS = Contador(
+    "recsolog_sla_alertas_total", "Alertas de SLA vencido por resultado", ("resultado",))
+
+SQL_RECLAMAR_ALERTA = """
+    INSERT INTO alertas_sla (pedido, hora_limite, enviada_en)
+    SELECT pedido, hora_limite, :ahora FROM pedidos
+    WHERE pedido = :pedido
+      AND hora_limite = :hora_limite
+      AND fecha_solicitada IS NOT NULL
+      AND fecha_entregada IS NULL
+    ON CONFLICT DO NOTHING
+    RETURNING pedido
+"""
+
+
+def init_alertas_db(conn):
+    """Tabla de alertas ya enviadas e índice parcial de pendientes (en local_data.db)."""
+    nueva = conn.execute(
+        "SELECT NOT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'alertas_sla')"
+    ).fetchone()[0]
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS alertas_sla (
+            pedido TEXT NOT NULL,
+            hora_limite TEXT NOT NULL,
+            enviada_en TEXT NOT NULL,
+            PRIMARY KEY (pedido, hora_limite)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pedidos_pendientes ON pedidos (hora_limite)
+        WHERE fecha_solicitada IS NOT NULL AND fecha_entregada IS NULL
+    """)
+    if nueva:
+        ahora = datetime.now().strftime(FORMATO_FECHA)
+        conn.execute("""
+            INSERT OR IGNORE INTO alertas_sla (pedido, hora_limite, enviada_en)
+            SELECT pedido, hora_limite, ? FROM pedidos
+            WHERE fecha_solicitada IS NOT NULL AND fecha_entregada IS NULL AND hora_limite <= ?
+        """, (ahora, ahora))
+    conn.commit()
+
+
+class Vencimientos:
+    """
+    Programador de alertas: alertar(pedido, hora_limite) se llama una vez por
+    pedido cuya hora límite pasó sin entrega.
+    """
+
+    def __init__(self, alertar):
+        self._alertar = alertar
+        self._monticulo = []  # (hora_limite, pedido); el texto ISO ordena igual que la fecha
+        self._vigentes = {}   # pedido -> hora_limite programada
+        self._cond = Condition()
+        self._hilo = None
+        self._seq = 0  # último pedidos.seq ya aplicado
+
+    def __len__(self):
+        return len(self._vigentes)
+
+    def programar(self, pedido, hora_limite):
+        """Programa (o reprograma) la alerta del pedido. No-op en procesos sin el hilo de alertas."""
+        if self._hilo is not None:
+            self._programar(pedido, hora_limite)
+
+    def cancelar(self, pedido):
+        """El pedido ya no vence (entregado). No-op en procesos sin el hilo de alertas."""
+        if self._hilo is not None:
+            self._cancelar(pedido)
+
+    def _programar(self, pedido, hora_limite):
+        if not hora_limite:
+            return self._cancelar(pedido)
+        with self._cond:
+            if self._vigentes.get(pedido) == hora_limite:
+                return
+            self._vigentes[pedido] = hora_limite
+            heapq.heappush(self._monticulo, (hora_limite, pedido))
+            self._compactar()
+            METRICA_PENDIENTES.set(len(self._vigentes))
+            if self._monticulo[0] == (hora_limite, pedido):
+                self._cond.notify()
+
+    def _cancelar(self, pedido):
+        # La entrada queda en el montículo y se descarta al llegar a la cima
+        with self._cond:
+            if self._vigentes.pop(pedido, None) is not None:
+                self._compactar()
+                METRICA_PENDIENTES.set(len(self._vigentes))
+
+    def _compactar(self):
+        # Demasiadas entradas muertas: reconstruir en O(n) con las vigentes
+        if len(self._monticulo) > 2 * len(self._vigentes) + 1024:
+            self._monticulo = [(limite, pedido) for pedido, limite in self._vigentes.items()]
+            heapq.heapify(self._monticulo)
+
+    def cargar(self, conn=None):
+        """Programa los pendientes de local_data.db que aún no tienen alerta enviada."""
+        propia = conn is None
+        conn = conn or sqlite3.connect(PLANNER_DB, timeout=10)
+        try:
+            # Antes de leer: lo que cambie durante la carga llega por sincronizar_cambios
+            seq = delta_planner.secuencia_actual(conn)
+            filas = conn.execute("""
+                SELECT p.pedido, p.hora_limite FROM pedidos p
+                WHERE p.fecha_solicitada IS NOT NULL AND p.fecha_entregada IS NULL
+                  AND p.hora_limite IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM alertas_sla a WHERE a.pedido = p.pedido AND a.hora_limite = p.hora_limite
+                  )
+            """).fetchall()
+        finally:
+            if propia:
+                conn.close()
+        with self._cond:
+            self._seq = seq
+            self._vigentes.update(filas)
+            self._monticulo = [(limite, pedido) for pedido, limite in self._vigentes.items()]
+            heapq.heapify(self._monticulo)
+            METRICA_PENDIENTES.set(len(self._vigentes))
+            self._cond.notify()
+        return len(filas)
+
+    def sincronizar_cambios(self, conn=None):
+        """Aplica los pedidos cambiados desde la última lectura (por seq). Devuelve cuántos."""
+        propia = conn is None
+        conn = conn or sqlite3.connect(PLANNER_DB, timeout=10)
+        aplicados = 0
+        try:
+            while True:
+                cambios = delta_planner.cambios_desde(conn, self._seq)
+                if cambios["reiniciar"]:
+                    self._seq = 0
+                    continue
+                for p in cambios["pedidos"]:
+                    if p["fecha_solicitada"] and not p["fecha_entregada"]:
+                        self._programar(p["pedido"], p["hora_limite"])
+                    else:
+                        self._cancelar(p["pedido"])
+                aplicados += len(cambios["pedidos"])
+                self._seq = cambios["seq"]
+                if not cambios["mas"]:
+                    return aplicados
+        finally:
+            if propia:
+                conn.close()
+
+    def vencidos(self, ahora=None):
+        """Saca del montículo los pedidos vencidos a 'ahora' -> [(pedido, hora_limite)]."""
+        ahora = (ahora or datetime.now()).strftime(FORMATO_FECHA)
+        salida = []
+        with self._cond:
+            while self._monticulo and self._monticulo[0][0] <= ahora:
+                limite, pedido = heapq.heappop(self._monticulo)
+                if self._vigentes.get(pedido) == limite:
+                    del self._vigentes[pedido]
+                    salida.append((pedido, limite))
+            if salida:
+                METRICA_PENDIENTES.set(len(self._vigentes))
+        return salida
+
+    def _espera(self):
+        """Segundos hasta el próximo vencimiento (con el lock tomado)."""
+        if not self._monticulo:
+            return MAX_ESPERA
+        proximo = datetime.strptime(self._monticulo[0][0], FORMATO_FECHA)
+        return min(max((proximo - datetime.now()).total_seconds(), 0), MAX_ESPERA)
+
+    def _disparar(self, pedido, hora_limite):
+        try:
+            conn = sqlite3.connect(PLANNER_DB, timeout=10)
+            try:
+                with conn:
+                    reclamada = conn.execute(SQL_RECLAMAR_ALERTA, {
+                        "pedido": pedido,
+                        "hora_limite": hora_limite,
+                        "ahora": datetime.now().strftime(FORMATO_FECHA),
+                    }).fetchall()
+            finally:
+                conn.close()
+            if not reclamada:
+                METRICA_ALERTAS.inc(resultado="descartada")
+                return
+            self._alertar(pedido, hora_limite)
+            METRICA_ALERTAS.inc(resultado="enviada")
+        except Exception as e:
+            METRICA_ALERTAS.inc(resultado="error")
+            log.exception("⚠️ Error al alertar vencimiento: %s", e, extra={"folio": pedido, "hora_limite": hora_limite})
+
+    def _ciclo(self):
+        while True:
+            with self._cond:
+                espera = self._espera()
+                if espera > 0:
+                    self._cond.wait(espera)
+            try:
+                self.sincronizar_cambios()
+            except Exception as e:
+                log.warning("⚠️ No se pudieron leer los cambios del planner: %s", e)
+            for pedido, hora_limite in self.vencidos():
+                self._disparar(pedido, hora_limite)
+
+    def iniciar(self):
+        """Carga los pendientes y arranca el hilo de alertas (una vez por proceso)."""
+        if self._hilo is not None:
+            return
+        n = self.cargar()
+        self._hilo = Thread(target=self._ciclo, name="vencimientos", daemon=True)
+        self._hilo.start()
+        log.info("⏰ Alertas de vencimiento activas: %d pedidos pendientes", n)
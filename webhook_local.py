@@ -1,9 +1,23 @@
 from flask import Flask, request, jsonify
 import os
+from cola_webhook import encolar, iniciar_consumidor, METRICA_WEBHOOKS
+from metricas import TIPO_CONTENIDO, exponer
+from registro import obtener_logger
+from firma_webhook import WHATSAPP_APP_SECRET, WEBHOOK_SIN_FIRMA, VentanaRepeticion, firma_valida
+
+log = obtener_logger("webhook")
 
 app = Flask(__name__)
 
-print("🚀 Iniciando archivo webhook_local.py en Render...")
+log.info("🚀 Iniciando archivo webhook_local.py en Render...")
+
+_secreto = WHATSAPP_APP_SECRET.encode() if WHATSAPP_APP_SECRET else None
+_firmas_vistas = VentanaRepeticion()
+if _secreto is None:
+    if WEBHOOK_SIN_FIRMA:
+        log.warning("⚠️ WEBHOOK_SIN_FIRMA=1: no se verificará X-Hub-Signature-256.")
+    else:
+        log.error("❌ WHATSAPP_APP_SECRET no configurado: se rechazarán los webhooks POST.")
 
 @app.route("/", methods=["GET"])
 def home():
@@ -22,27 +36,61 @@ def verify_webhook():
 
     if mode and token:
         if mode == "subscribe" and token == verify_token:
-            print("🟢 Verificación de webhook exitosa.")
+            log.info("🟢 Verificación de webhook exitosa.")
             return challenge, 200
         else:
-            print("🔴 Token de verificación inválido.")
+            log.warning("🔴 Token de verificación inválido.")
             return "Token de verificación inválido", 403
     return "Solicitud inválida", 400
 
 
+# El consumidor de la cola arranca con la primera petición (o en __main__).
+@app.before_request
+def asegurar_consumidor():
+    iniciar_consumidor()
+
+
 # ✅ Ruta POST para recibir mensajes desde WhatsApp Cloud API
+# Verifica la firma sobre el cuerpo crudo, lo guarda en la cola y responde;
+# el hilo consumidor lo procesa.
 @app.route("/webhook", methods=["POST"])
 def receive_webhook():
     try:
-        data = request.get_json()
-        print("📩 Webhook recibido:", data)
+        cuerpo = request.get_data()
+        firma = None
+        if _secreto is not None:
+            firma = request.headers.get("X-Hub-Signature-256")
+            if not firma_valida(cuerpo, firma, _secreto):
+                METRICA_WEBHOOKS.inc(resultado="firma_invalida")
+                log.warning("🔴 Firma de webhook inválida.", extra={"muestra": 10})
+                return jsonify({"error": "Firma inválida"}), 403
+            # Un reintento de Meta trae el mismo cuerpo y por lo tanto la misma firma
+            if _firmas_vistas.visto(firma):
+                METRICA_WEBHOOKS.inc(resultado="duplicado")
+                return jsonify({"status": "duplicate"}), 200
+        elif not WEBHOOK_SIN_FIRMA:
+            METRICA_WEBHOOKS.inc(resultado="sin_secreto")
+            return jsonify({"error": "Webhook sin secreto configurado"}), 403
+
+        encolar(cuerpo)
+        # Solo cuenta como visto lo que quedó guardado: si encolar falla, el reintento entra
+        if firma is not None:
+            _firmas_vistas.registrar((firma,))
+        METRICA_WEBHOOKS.inc(resultado="encolado")
         return jsonify({"status": "received"}), 200
     except Exception as e:
-        print("⚠️ Error procesando webhook:", e)
+        log.exception("⚠️ Error procesando webhook: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+# 📈 Métricas de la cola de webhooks para Prometheus
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return exponer(), 200, {"Content-Type": TIPO_CONTENIDO}
+
+
 # 🔧 Puerto dinámico para Render
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    iniciar_consumidor()
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file